@@ -322,9 +322,9 @@ from langgraph.prebuilt import create_react_agent
 
 #         print()
 import pyaudio
-import whisper
 import numpy as np
 import threading
+from backend.asr_engines import make_engine
 
 # print("PyTorch 版本:", torch.__version__)
 # print("绑定的 CUDA 版本:", torch.version.cuda)  # 必须 ≥12.0
@@ -336,11 +336,17 @@ CHANNELS = 1  # 单声道
 RATE = 16000  # 采样率16kHz
 CHUNK = 1024  # 每次读取的音频块大小
 
-# 加载Whisper模型
-# model = whisper.load_model("base", device="cuda:0")  
-model = whisper.load_model("base", device="cpu")  
+# 识别引擎：优先用共享识别服务（python -m backend.asr_server，见 ASR_SERVER_URL），服务没起时才在本进程加载 faster_whisper；
+# 第一次说话时才创建，导入本模块不再加载模型
+_ASR = None
 
-def record_and_transcribe(model):  # 传入whisper模型
+def asr_engine():
+    global _ASR
+    if _ASR is None:
+        _ASR = make_engine()
+    return _ASR
+
+def record_and_transcribe(model):  # 传入识别引擎（asr_engine()）
     p = pyaudio.PyAudio()
     stream = p.open(
         format=FORMAT,
@@ -377,12 +383,9 @@ def record_and_transcribe(model):  # 传入whisper模型
 
     # 处理音频并转录
     if frames:  # 确保有录音数据
-        audio_data = np.concatenate(frames).astype(np.float32) / 32768.0  # 归一化
-        result = model.transcribe(audio_data, fp16=False,     # 禁用半精度，确保兼容性
-            without_timestamps=True  # 不需要时间戳，加快处理
-            )
-        print("转换结果：", result["text"])
-        return result["text"]
+        text = model.transcribe(np.concatenate(frames), RATE)
+        print("转换结果：", text)
+        return text
     else:
         print("未录制到音频")
         return ""
@@ -419,7 +422,7 @@ async def run_agent():
     })
 
     while True:
-        user_input = record_and_transcribe(model)
+        user_input = record_and_transcribe(asr_engine())
         # print(user_input)
         if (user_input.lower() == 'exit' or user_input.lower() == "quit"):
             break
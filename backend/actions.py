@@ -0,0 +1,106 @@
+# backend/actions.py
+"""
+一次输出多个动作：JSON-ReAct 的 action 可以是列表，每项 {"id", "name", "args", "after": [依赖的 id]}。
+“给A和B发邮件并打开B站”一步给出三个动作并发执行，不用三次 LLM 往返。
+
+- 没有依赖的动作同时启动（ToolExecutor 的线程池，各工具仍受自身并发上限约束）；
+- after 只能引用列表里更靠前的动作（天然无环），引用不存在或靠后的 id 忽略；
+- 依赖的动作没成功时跳过，结果标 skipped；
+- 结果按列表顺序汇总成一个观察结果块。
+
+id 缺省为序号 "1"、"2"…；单个对象与原来的写法一样，视为只有一项的列表。
+"""
+from __future__ import annotations
+import os
+import json
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List
+
+ACTIONS_MAX = int(os.getenv("ACTIONS_MAX", "6"))   # 一步最多执行几个动作，多出的丢弃
+
+
+@dataclass
+class PlannedAction:
+    id: str
+    name: str
+    args: Dict[str, Any]
+    after: List[str] = field(default_factory=list)
+
+
+def action_list(action: Any) -> List[Dict[str, Any]]:
+    """action 可以是一个对象或对象列表；null / {} / 非法项都忽略"""
+    if isinstance(action, dict):
+        return [action] if action else []
+    if isinstance(action, list):
+        return [a for a in action if isinstance(a, dict) and a]
+    return []
+
+
+def plan(action: Any) -> List[PlannedAction]:
+    out: List[PlannedAction] = []
+    seen: set = set()
+    for i, a in enumerate(action_list(action)[:ACTIONS_MAX]):
+        aid = str(a.get("id") or i + 1)
+        if aid in seen:                         # 重复 id：退回序号，序号也被占用时加后缀
+            aid, n = str(i + 1), 1
+            while aid in seen:
+                n += 1
+                aid = f"{i + 1}#{n}"
+        after = a.get("after") or []
+        if not isinstance(after, list):
+            after = [after]
+        out.append(PlannedAction(aid, a.get("name", ""), a.get("args") or {},
+                                 [str(d) for d in after if str(d) in seen]))
+        seen.add(aid)
+    return out
+
+
+def _skipped(p: PlannedAction, dep: str) -> Dict[str, Any]:
+    return {"id": p.id, "name": p.name, "ok": False, "result": None, "error": f"依赖的动作 {dep} 未成功",
+            "timed_out": False, "skipped": True, "elapsed_ms": 0.0}
+
+
+async def run_plan(steps: List[PlannedAction],
+                   run: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """按依赖执行，无依赖的并发；返回与 steps 同序的结果（每项带 id）"""
+    tasks: Dict[str, asyncio.Task] = {}                 # 供依赖查找；plan() 保证 id 唯一
+
+    async def one(p: PlannedAction) -> Dict[str, Any]:
+        for dep in p.after:
+            if not (await tasks[dep]).get("ok"):
+                return _skipped(p, dep)
+        r = await run({"name": p.name, "args": p.args})
+        return dict(r, id=p.id)
+
+    ordered: List[asyncio.Task] = []                    # 按位置收集结果，id 即便重复也不丢
+    for p in steps:
+        t = asyncio.create_task(one(p))
+        tasks.setdefault(p.id, t)
+        ordered.append(t)
+    return list(await asyncio.gather(*ordered))
+
+
+def _result_text(r: Dict[str, Any], limit: int) -> str:
+    if r.get("ok"):
+        res = r.get("result")
+        body = res if isinstance(res, str) else json.dumps(res, ensure_ascii=False)
+        status = "成功"
+    else:
+        body = r.get("error") or ""
+        status = "跳过" if r.get("skipped") else ("超时" if r.get("timed_out") else "失败")
+    if len(body) > limit:
+        body = body[:limit] + "…（已截断）"
+    return f"[{r.get('id', 1)}] {r.get('name')} {status}：{body}"
+
+
+def observation_block(results: List[Dict[str, Any]], limit: int) -> str:
+    """所有动作的结果汇总成一段；limit 为总字数上限，按动作数均分，每个动作的结果都能看到"""
+    if not results:
+        return ""
+    per = max(limit // len(results), 80)
+    lines = [_result_text(r, per) for r in results]
+    if len(results) == 1:
+        return lines[0]
+    ok = sum(1 for r in results if r.get("ok"))
+    return f"共 {len(results)} 个动作（{ok} 个成功）：\n" + "\n".join(lines)
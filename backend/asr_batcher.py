@@ -0,0 +1,125 @@
+# backend/asr_batcher.py
+"""
+识别服务的跨会话攒批：多个客户端同时说完时，各自的识别请求不再各跑一次编码器，
+而是在 ASR_BATCH_WAIT_MS 的窗口里攒到最多 ASR_BATCH_SIZE 段，补零后一次成批推理（FasterWhisperEngine.decode_batch）。
+
+BatchedEngine 包在引擎外面，接口不变：decode() 在调用方线程里阻塞等结果，StreamSession / 服务端接口都不用改。
+窗口从批里第一段入队算起，单个请求最多多等 ASR_BATCH_WAIT_MS；队列里已经攒满时立即开跑。
+ASR_BATCH_SIZE=1 时不包装，和原来逐段识别一样。
+
+对比：python -m bench.asr_batch
+"""
+from __future__ import annotations
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.asr_engines import ASREngine, Segment
+from backend.audio_capture import SAMPLE_RATE
+from backend.metrics import Histogram, LATENCY_BUCKETS, DEPTH_BUCKETS
+
+ASR_BATCH_SIZE = int(os.getenv("ASR_BATCH_SIZE", "4"))
+ASR_BATCH_WAIT_MS = float(os.getenv("ASR_BATCH_WAIT_MS", "30"))
+
+
+@dataclass(eq=False)
+class _Job:
+    item: Tuple[np.ndarray, int, str]
+    fut: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class BatchedEngine(ASREngine):
+    def __init__(self, inner: ASREngine, batch_size: int = ASR_BATCH_SIZE, wait_ms: float = ASR_BATCH_WAIT_MS,
+                 runners: int = 1):
+        self.inner = inner
+        self.name = inner.name
+        self.streaming = inner.streaming
+        self.batch_size = max(batch_size, 1)
+        self.wait_s = max(wait_ms, 0.0) / 1000
+        self._q: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = Histogram(DEPTH_BUCKETS)
+        self.queue_wait = Histogram(LATENCY_BUCKETS)      # 入队到开跑
+        self.batch_time = Histogram(LATENCY_BUCKETS)      # 一批的推理耗时
+        # runners 个批次可同时推理（对应 WhisperModel 的 num_workers）
+        self._threads = [threading.Thread(target=self._run, name=f"asr-batch-{i}", daemon=True)
+                         for i in range(max(runners, 1))]
+        for t in self._threads:
+            t.start()
+
+    def decode(self, pcm: np.ndarray, sample_rate: int = SAMPLE_RATE, prompt: str = "") -> List[Segment]:
+        job = _Job((pcm, sample_rate, prompt))
+        self._q.put(job)
+        return job.fut.result()
+
+    def decode_batch(self, items: List[Tuple[np.ndarray, int, str]]) -> List[List[Segment]]:
+        return self.inner.decode_batch(items)
+
+    def _collect(self, first: _Job) -> List[_Job]:
+        batch = [first]
+        deadline = first.enqueued + self.wait_s
+        while len(batch) < self.batch_size:
+            try:
+                job = self._q.get_nowait()
+            except queue.Empty:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    job = self._q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if job is None:
+                self._q.put(None)               # 留给其它 runner 退出
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._q.get()
+            if first is None:
+                self._q.put(None)
+                return
+            batch = self._collect(first)
+            t0 = time.monotonic()
+            for j in batch:
+                self.queue_wait.observe(t0 - j.enqueued)
+            try:
+                results = self.inner.decode_batch([j.item for j in batch])
+            except Exception as e:
+                for j in batch:
+                    j.fut.set_exception(e)
+                continue
+            finally:
+                self.batches += 1
+                self.items += len(batch)
+                self.batch_sizes.observe(len(batch))
+                self.batch_time.observe(time.monotonic() - t0)
+            for j, r in zip(batch, results):
+                j.fut.set_result(r)
+
+    def close(self) -> None:
+        self._q.put(None)
+        for t in self._threads:
+            t.join(timeout=2)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batch_size": self.batch_size,
+            "wait_ms": self.wait_s * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes": self.batch_sizes.stats(),
+            "queue_wait_s": self.queue_wait.stats(),
+            "batch_time_s": self.batch_time.stats(),
+        }
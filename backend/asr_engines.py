@@ -0,0 +1,447 @@
+# backend/asr_engines.py
+"""
+可插拔的语音识别引擎：ASR_ENGINE=auto | remote | faster_whisper | google | sphinx。
+
+- remote：共享识别服务（backend/asr_server.py，ASR_SERVER_URL）；模型只在服务里加载一次，客户端启动不再等模型；
+- faster_whisper：本地 CTranslate2 int8 推理，不走网络；支持流式——说话过程中对“已说的部分”反复识别出部分结果，
+  端点判定时最后一次识别通常已经跑完，定稿几乎不花时间；
+- google / sphinx：原来 speech_recognition 的两条路（Google 失败退回 Sphinx），只在说完后整句识别；
+- auto：识别服务连得上就用它，否则本地 faster_whisper，再不行 google。
+
+流式识别（StreamSession）：
+  音频从这句话的起点开始累积，每多 ASR_STEP_MS 新音频就对“未确认部分”重新识别一次（相邻两次有大量重叠，
+  后一次能修正前一次的结尾）。未确认部分超过 ASR_WINDOW_S 时，把结束时间早于末尾 ASR_OVERLAP_S 的分段确认下来，
+  之后只识别确认点之后的音频，并把已确认文本的结尾作为 prompt 提供上下文——每次识别的音频长度有上限，不随句子变长。
+  静音刚开始（ASR_PREFINAL_MS）时不等步长再识别一次，端点判定（VAD_END_MS）到来时结果已经就绪。
+"""
+from __future__ import annotations
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from backend import tracing
+from backend.audio_capture import SAMPLE_RATE, VAD_PRE_ROLL_MS, MicCapture, Utterance
+
+ASR_ENGINE = os.getenv("ASR_ENGINE", "auto").lower()
+ASR_SERVER_URL = os.getenv("ASR_SERVER_URL", "http://127.0.0.1:8002")   # 置空则 auto 不尝试识别服务
+ASR_SERVER_TIMEOUT = float(os.getenv("ASR_SERVER_TIMEOUT", "30"))
+ASR_MODEL = os.getenv("ASR_MODEL", "small")                 # tiny/base/small/medium 或本地 CTranslate2 模型目录
+ASR_DEVICE = os.getenv("ASR_DEVICE", "cpu")
+ASR_COMPUTE_TYPE = os.getenv("ASR_COMPUTE_TYPE", "int8")    # cpu 上 int8 最快；gpu 可用 int8_float16
+ASR_CPU_THREADS = int(os.getenv("ASR_CPU_THREADS", "0"))    # 0 = CTranslate2 默认
+ASR_BEAM_SIZE = int(os.getenv("ASR_BEAM_SIZE", "1"))        # 贪心解码，延迟最低
+# whisper 中文常输出繁体，给一句简体提示把它拉回来
+ASR_INITIAL_PROMPT = os.getenv("ASR_INITIAL_PROMPT", "以下是普通话的句子。")
+
+ASR_STEP_MS = int(os.getenv("ASR_STEP_MS", "500"))          # 说话中每多这么多新音频识别一次
+ASR_MIN_MS = int(os.getenv("ASR_MIN_MS", "500"))            # 不足这么长的音频不出部分结果
+ASR_WINDOW_S = float(os.getenv("ASR_WINDOW_S", "8"))        # 未确认部分的上限
+ASR_OVERLAP_S = float(os.getenv("ASR_OVERLAP_S", "1.5"))    # 确认时末尾留作重叠、不确认的长度
+ASR_PREFINAL_MS = int(os.getenv("ASR_PREFINAL_MS", str(VAD_PRE_ROLL_MS)))  # 静音这么久就提前识别一次
+ASR_PROMPT_CHARS = 100
+
+
+@dataclass
+class Segment:
+    start: float    # 秒，相对送进去的这段音频
+    end: float
+    text: str
+
+
+def join_text(a: str, b: str) -> str:
+    """拼接两段识别文本：两边都是字母数字（英文单词）时补空格，中文直接拼"""
+    if a and b and a[-1].isascii() and a[-1].isalnum() and b[0].isascii() and b[0].isalnum():
+        return a + " " + b
+    return a + b
+
+
+def _resample(pcm: np.ndarray, src: int, dst: int) -> np.ndarray:
+    if src == dst or not pcm.size:
+        return pcm
+    n = int(round(pcm.size * dst / src))
+    return np.interp(np.linspace(0, pcm.size - 1, n), np.arange(pcm.size), pcm).astype(np.int16)
+
+
+class ASREngine:
+    """引擎接口：decode 识别一段 int16 PCM 返回分段；streaming 为 True 时说话过程中也可以调用"""
+    name = "base"
+    streaming = False
+
+    def decode(self, pcm: np.ndarray, sample_rate: int = SAMPLE_RATE, prompt: str = "") -> List[Segment]:
+        raise NotImplementedError
+
+    def decode_batch(self, items: List[Tuple[np.ndarray, int, str]]) -> List[List[Segment]]:
+        """一次识别多段 (pcm, sample_rate, prompt)；默认逐段 decode，能真正成批推理的引擎覆盖它"""
+        return [self.decode(pcm, sr, prompt) for pcm, sr, prompt in items]
+
+    def transcribe(self, pcm: np.ndarray, sample_rate: int = SAMPLE_RATE) -> str:
+        text = ""
+        for s in self.decode(pcm, sample_rate):
+            text = join_text(text, s.text)
+        return text.strip()
+
+    def session(self, sample_rate: int = SAMPLE_RATE) -> "StreamSession":
+        return StreamSession(self, sample_rate)
+
+
+class FasterWhisperEngine(ASREngine):
+    name = "faster_whisper"
+    streaming = True
+
+    def __init__(self, model: str = ASR_MODEL, device: str = ASR_DEVICE, compute_type: str = ASR_COMPUTE_TYPE,
+                 language: str = "zh", beam_size: int = ASR_BEAM_SIZE, cpu_threads: int = ASR_CPU_THREADS,
+                 num_workers: int = 1):
+        from faster_whisper import WhisperModel
+        t0 = time.perf_counter()
+        self.model = WhisperModel(model, device=device, compute_type=compute_type,
+                                  cpu_threads=cpu_threads, num_workers=num_workers)
+        self.language = language.split("-")[0].lower() or None   # zh-CN -> zh
+        self.beam_size = beam_size
+        print(f"[ASR] faster_whisper {model}（{device}/{compute_type}）加载耗时 {time.perf_counter() - t0:.1f}s")
+
+    def decode(self, pcm: np.ndarray, sample_rate: int = SAMPLE_RATE, prompt: str = "") -> List[Segment]:
+        # faster_whisper 直接吃 16kHz float32 数组，不经过文件 / ffmpeg
+        audio = _resample(pcm, sample_rate, 16000).astype(np.float32) / 32768.0
+        segments, _ = self.model.transcribe(
+            audio, language=self.language, beam_size=self.beam_size, temperature=0.0,
+            condition_on_previous_text=False, vad_filter=False,
+            initial_prompt=(ASR_INITIAL_PROMPT + prompt) or None,
+        )
+        return [Segment(s.start, s.end, s.text.strip()) for s in segments if s.text.strip()]
+
+    def decode_batch(self, items: List[Tuple[np.ndarray, int, str]]) -> List[List[Segment]]:
+        """
+        多段音频拼成一个 batch：各自算 log-mel、补零到 30 秒窗口（whisper 本来就按 30 秒窗口编码，单独识别也是这么补的），
+        一次 generate 完成编码器前向和贪心/束搜索解码。超过 30 秒的段落回到逐段 decode。
+        与逐段 transcribe 的区别：不做温度回退和压缩比检查，no_speech 概率高的段落直接判为无语音。
+        """
+        from ctranslate2 import StorageView
+        fe = self.model.feature_extractor
+        window = fe.nb_max_frames
+        out: List[Optional[List[Segment]]] = [None] * len(items)
+        feats, prompts, idx, durations = [], [], [], []
+        for i, (pcm, sample_rate, prompt) in enumerate(items):
+            audio = _resample(pcm, sample_rate, 16000).astype(np.float32) / 32768.0
+            if audio.size > fe.n_samples:
+                out[i] = self.decode(pcm, sample_rate, prompt)
+                continue
+            f = fe(audio)[:, :window]
+            feats.append(np.pad(f, ((0, 0), (0, window - f.shape[1]))))
+            prompts.append(self._prompt(ASR_INITIAL_PROMPT + prompt))
+            idx.append(i)
+            durations.append(audio.size / 16000)
+        if feats:
+            batch = StorageView.from_array(np.ascontiguousarray(np.stack(feats), dtype=np.float32))
+            results = self.model.model.generate(
+                batch, prompts, beam_size=self.beam_size, max_length=self.model.max_length,
+                suppress_blank=True, suppress_tokens=[-1], return_no_speech_prob=True,
+                max_initial_timestamp_index=50,
+            )
+            for i, dur, r in zip(idx, durations, results):
+                out[i] = [] if r.no_speech_prob > 0.6 else self._segments(r.sequences_ids[0], dur)
+        return out  # type: ignore[return-value]
+
+    def _tokenizer(self):
+        if getattr(self, "_tok", None) is None:
+            from faster_whisper.tokenizer import Tokenizer
+            self._tok = Tokenizer(self.model.hf_tokenizer, self.model.model.is_multilingual,
+                                  task="transcribe", language=self.language or "zh")
+        return self._tok
+
+    def _prompt(self, text: str) -> List[int]:
+        """与 faster_whisper 单独识别时相同的提示：<|startofprev|> 提示词 + SOT 序列（带时间戳，用来切分段）"""
+        tok = self._tokenizer()
+        prompt: List[int] = []
+        if text.strip():
+            prompt = [tok.sot_prev] + tok.encode(" " + text.strip())[-(self.model.max_length // 2 - 1):]
+        return prompt + list(tok.sot_sequence)
+
+    def _segments(self, ids: List[int], duration: float) -> List[Segment]:
+        """按时间戳 token（每个 0.02 秒）切出分段"""
+        tok = self._tokenizer()
+        segs: List[Segment] = []
+        text_ids: List[int] = []
+        start = 0.0
+        for t in ids:
+            if t >= tok.timestamp_begin:
+                ts = min((t - tok.timestamp_begin) * 0.02, duration)
+                if text_ids:
+                    segs.append(Segment(start, ts, tok.decode(text_ids).strip()))
+                    text_ids = []
+                start = ts
+            elif t < tok.eot:
+                text_ids.append(t)
+        if text_ids:
+            segs.append(Segment(start, duration, tok.decode(text_ids).strip()))
+        return [s for s in segs if s.text]
+
+
+class SpeechRecognitionEngine(ASREngine):
+    """speech_recognition 的 Google（联网）/ Sphinx（离线）；google=True 时先试 Google，失败退回 Sphinx"""
+
+    def __init__(self, language: str = "zh-CN", google: bool = True, recognizer=None):
+        import speech_recognition as sr
+        self._sr = sr
+        self.rec = recognizer or sr.Recognizer()
+        self.language = language
+        self.google = google
+        self.name = "google" if google else "sphinx"
+
+    def decode(self, pcm: np.ndarray, sample_rate: int = SAMPLE_RATE, prompt: str = "") -> List[Segment]:
+        audio = self._sr.AudioData(pcm.astype(np.int16).tobytes(), sample_rate, 2)
+        end = pcm.size / sample_rate
+        if self.google:
+            try:
+                return [Segment(0.0, end, self.rec.recognize_google(audio, language=self.language).strip())]
+            except Exception as e:
+                print(f"[Google 识别失败，退回 Sphinx] {e}")
+        try:
+            return [Segment(0.0, end, self.rec.recognize_sphinx(audio, language=self.language).strip())]
+        except Exception as e:
+            print(f"[Sphinx 识别失败] {e}")
+            return []
+
+
+def make_engine(name: str = ASR_ENGINE, language: str = "zh-CN", recognizer=None, google: bool = True) -> ASREngine:
+    """按名字建引擎；auto 时依次尝试识别服务、本地 faster_whisper（没装、模型下载失败则跳过），最后 google/sphinx"""
+    if name == "remote" or (name == "auto" and ASR_SERVER_URL):
+        try:
+            return RemoteASREngine(ASR_SERVER_URL)
+        except Exception as e:
+            if name != "auto":
+                raise
+            print(f"[ASR] 识别服务 {ASR_SERVER_URL} 不可用，改用本地模型: {type(e).__name__}")
+    if name in ("auto", "faster_whisper", "whisper"):
+        try:
+            return FasterWhisperEngine(language=language)
+        except Exception as e:
+            if name != "auto":
+                raise
+            print(f"[ASR] faster_whisper 不可用，改用 speech_recognition: {type(e).__name__}: {e}")
+    if name == "sphinx":
+        google = False
+    elif name not in ("auto", "google"):
+        raise ValueError(f"未知的 ASR_ENGINE: {name}")
+    return SpeechRecognitionEngine(language, google=google, recognizer=recognizer)
+
+
+class StreamSession:
+    """一句话的流式识别状态：feed 追加音频，partial 按需出部分结果，finalize 出最终结果"""
+
+    def __init__(self, engine: ASREngine, sample_rate: int = SAMPLE_RATE):
+        self.engine = engine
+        self.sample_rate = sample_rate
+        self.reset()
+
+    def reset(self) -> None:
+        self._chunks: List[np.ndarray] = []
+        self._pcm = np.zeros(0, dtype=np.int16)
+        self.total = 0              # 已喂入的样本数
+        self.committed = 0          # 已确认到的样本位置
+        self.committed_text = ""
+        self.hypothesis = ""        # 确认点之后最近一次识别的结果（下次可能被改写）
+        self.decoded_upto = 0       # 最近一次识别覆盖到的样本位置
+        self.decodes = 0
+        self.decode_s = 0.0
+
+    @property
+    def text(self) -> str:
+        return join_text(self.committed_text, self.hypothesis).strip()
+
+    def feed(self, pcm: np.ndarray) -> None:
+        if pcm.size:
+            self._chunks.append(pcm)
+            self.total += pcm.size
+
+    def audio(self) -> np.ndarray:
+        if self._chunks:
+            self._pcm = np.concatenate([self._pcm] + self._chunks)
+            self._chunks = []
+        return self._pcm
+
+    def due(self, force: bool = False) -> bool:
+        """新音频攒够一步（或 force 且有新音频）时该出部分结果了"""
+        if not self.engine.streaming or self.total < ASR_MIN_MS * self.sample_rate // 1000:
+            return False
+        new = self.total - self.decoded_upto
+        return new > 0 and (force or new >= ASR_STEP_MS * self.sample_rate // 1000)
+
+    def partial(self, force: bool = False) -> Optional[str]:
+        """due 时识别一次，返回当前完整文本；否则 None"""
+        if not self.due(force):
+            return None
+        self._decode(self.audio())
+        return self.text
+
+    def finalize(self, pcm: Optional[np.ndarray] = None) -> str:
+        """
+        pcm 为端点切出的整句（与喂入的音频同一起点，结尾静音已裁掉）：最近一次识别已经覆盖到它的结尾时直接复用，
+        否则只识别确认点之后的部分
+        """
+        if pcm is not None:
+            if self.engine.streaming and self.decodes and self.decoded_upto >= pcm.size:
+                return self.text
+            self._chunks, self._pcm, self.total = [], pcm, pcm.size
+            self.committed = min(self.committed, pcm.size)
+        if self.decoded_upto < self.total or not self.decodes:
+            self._decode(self.audio(), final=True)
+        return self.text
+
+    def _decode(self, audio: np.ndarray, final: bool = False) -> None:
+        t0 = time.perf_counter()
+        pending = audio[self.committed:]
+        segs = self.engine.decode(pending, self.sample_rate, self.committed_text[-ASR_PROMPT_CHARS:])
+        self.decodes += 1
+        self.decode_s += time.perf_counter() - t0
+        self.decoded_upto = audio.size
+        if not final and pending.size > ASR_WINDOW_S * self.sample_rate:
+            # 末尾 ASR_OVERLAP_S 之前结束的分段不会再变，确认下来，下次从最后一个确认分段的结尾开始识别
+            keep = pending.size / self.sample_rate - ASR_OVERLAP_S
+            done = [s for s in segs if s.end <= keep]
+            if done:
+                for s in done:
+                    self.committed_text = join_text(self.committed_text, s.text)
+                self.committed += int(done[-1].end * self.sample_rate)
+                segs = segs[len(done):]
+        hyp = ""
+        for s in segs:
+            hyp = join_text(hyp, s.text)
+        self.hypothesis = hyp
+
+    def stats(self) -> dict:
+        return {"engine": self.engine.name, "decodes": self.decodes, "decode_s": round(self.decode_s, 3),
+                "audio_s": round(self.total / self.sample_rate, 2)}
+
+
+class RemoteASREngine(ASREngine):
+    """共享识别服务的客户端；构造时探一下 /health，服务没起时抛异常（auto 据此退回本地模型）"""
+    name = "remote"
+    streaming = True
+
+    def __init__(self, url: str = ASR_SERVER_URL, timeout: float = ASR_SERVER_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.http = requests.Session()          # 复用连接，说话中每步一个请求
+        r = self.http.get(self.url + "/health", timeout=2)
+        r.raise_for_status()
+        self.server = r.json().get("engine", {})
+
+    def post(self, path: str, pcm: np.ndarray, **params) -> requests.Response:
+        return self.http.post(self.url + path, params={k: v for k, v in params.items() if v is not None},
+                              data=pcm.astype(np.int16).tobytes(), timeout=self.timeout,
+                              headers={"Content-Type": "application/octet-stream", **tracing.headers()})
+
+    def decode(self, pcm: np.ndarray, sample_rate: int = SAMPLE_RATE, prompt: str = "") -> List[Segment]:
+        r = self.post("/asr/transcribe", pcm, sample_rate=sample_rate, prompt=prompt or None)
+        r.raise_for_status()
+        return [Segment(s["start"], s["end"], s["text"]) for s in r.json()["segments"]]
+
+    def session(self, sample_rate: int = SAMPLE_RATE) -> "RemoteStreamSession":
+        return RemoteStreamSession(self, sample_rate)
+
+
+class RemoteStreamSession(StreamSession):
+    """
+    服务端持有 StreamSession，这边只把新音频分块送过去：攒够一步才发（与本地同样的 due 判断），服务端识别后返回文本。
+    本地也留一份音频，服务端会话丢了（过期、服务重启）时整句重新识别。
+    """
+    engine: RemoteASREngine
+
+    def reset(self) -> None:
+        old = getattr(self, "session_id", None)
+        if old and getattr(self, "sent", 0):
+            try:
+                self.engine.http.delete(f"{self.engine.url}/asr/sessions/{old}", timeout=2)
+            except requests.RequestException:
+                pass                            # 服务端会话到期自己清理
+        super().reset()
+        self.session_id = uuid.uuid4().hex
+        self.sent = 0
+
+    def _send(self, kind: str, **params) -> Optional[dict]:
+        audio = self.audio()
+        r = self.engine.post(f"/asr/sessions/{self.session_id}/{kind}", audio[self.sent:],
+                             sample_rate=self.sample_rate, offset=self.sent, **params)
+        if r.status_code == 409:
+            return None                         # 服务端没有这个会话或音频对不上
+        if r.status_code == 429 and kind == "audio":
+            return {"text": None}               # 服务端忙，这一步不出部分结果，音频下次一起送
+        r.raise_for_status()
+        self.sent = audio.size
+        data = r.json()
+        if data.get("text") is not None:
+            self.decoded_upto = self.sent
+            self.decodes = data.get("decodes", self.decodes + 1)
+            self.committed_text, self.hypothesis = "", data["text"]
+        return data
+
+    def partial(self, force: bool = False) -> Optional[str]:
+        if not self.due(force):
+            return None
+        t0 = time.perf_counter()
+        data = self._send("audio", force=force)
+        self.decode_s += time.perf_counter() - t0
+        if data is None:
+            self.sent = 0                       # 下次从头送，服务端重新建会话
+            self.session_id = uuid.uuid4().hex
+            return None
+        return data.get("text")
+
+    def finalize(self, pcm: Optional[np.ndarray] = None) -> str:
+        if pcm is not None:
+            if self.decodes and self.decoded_upto >= pcm.size:
+                return self.text                # 最后一次部分结果已经覆盖到结尾，省掉一次往返
+            self._chunks, self._pcm, self.total = [], pcm, pcm.size
+            self.sent = min(self.sent, pcm.size)
+        t0 = time.perf_counter()
+        try:
+            data = self._send("final", end=self.total)
+            if data is None:
+                self.committed_text, self.hypothesis = "", self.engine.transcribe(self.audio(), self.sample_rate)
+                self.decodes += 1
+        finally:
+            self.decode_s += time.perf_counter() - t0
+        return self.text
+
+
+def stream_utterance(cap: MicCapture, session: StreamSession, max_seconds: Optional[float] = None,
+                     timeout: Optional[float] = None,
+                     on_partial: Optional[Callable[[str], None]] = None) -> Optional[Utterance]:
+    """
+    等下一句说完（同 MicCapture.listen），说话过程中把新音频喂给 session 并出部分结果（文本变化时回调 on_partial）。
+    返回切好的 Utterance，调用方再 session.finalize(utt.pcm)。
+    """
+    cap.start()
+    cap.clear()
+    cap.max_seconds = max_seconds
+    deadline = None if timeout is None else time.monotonic() + timeout
+    fed_from: Optional[int] = None
+    last = ""
+    while True:
+        utt = cap.next_utterance(0)
+        if utt is not None:
+            return utt
+        start = cap.speech_start
+        if start is not None:
+            if fed_from != start:
+                session.reset()
+                fed_from = start
+            session.feed(cap.read(start + session.total))
+            try:
+                text = session.partial(force=cap.silence_ms >= ASR_PREFINAL_MS)
+            except Exception as e:
+                # 部分结果出错不影响这句话：继续采集，说完后 finalize 整句再识别
+                print(f"[ASR] 部分识别失败: {type(e).__name__}: {e}")
+                text = None
+            if text and text != last:
+                last = text
+                if on_partial is not None:
+                    on_partial(text)
+        elif deadline is not None and time.monotonic() >= deadline:
+            return None
+        cap.wait_frames(0.1)
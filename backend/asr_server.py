@@ -0,0 +1,271 @@
+# backend/asr_server.py
+"""
+共享语音识别服务：faster_whisper 模型只加载一次，语音客户端（voice_interact / 两个 GUI / agentdemo）都来这里识别，
+不再各自占一份内存、各自等模型加载。
+
+- POST /asr/transcribe                 整段 int16 PCM（application/octet-stream）-> 文本与分段
+- POST /asr/sessions/{id}/audio        流式：追加一块 PCM（offset = 之前已送的样本数），够一步时返回部分结果
+- POST /asr/sessions/{id}/final        送完剩余 PCM，end 为整句长度（裁掉结尾静音），返回最终结果并结束会话
+- DELETE /asr/sessions/{id}
+
+识别在 ASR_WORKERS 个线程里跑（WhisperModel 也开同样多的 worker，可真正并行），前面用 AdmissionScheduler 排队：
+ASR_BATCH_SIZE > 1 时同时在途的请求可达 ASR_WORKERS × ASR_BATCH_SIZE，由 BatchedEngine 攒批后成批推理（backend/asr_batcher.py）；
+最终结果按 interactive、部分结果按 background 优先级，同优先级按会话轮转；排队满时 transcribe/final 返回 429，
+部分结果直接跳过（音频照收，只是这一步不出结果）。会话 ASR_SESSION_TTL 秒没有新音频即清理。
+
+启动：python -m backend.asr_server   （客户端 ASR_SERVER_URL，缺省 http://127.0.0.1:8002）
+"""
+from __future__ import annotations
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+
+from backend.asr_engines import (ASR_MODEL, ASR_DEVICE, ASR_COMPUTE_TYPE, ASREngine, FasterWhisperEngine,
+                                 StreamSession, join_text)
+from backend.asr_batcher import BatchedEngine, ASR_BATCH_SIZE, ASR_BATCH_WAIT_MS
+from backend.audio_capture import SAMPLE_RATE
+from backend.scheduler import AdmissionScheduler, QueueFull
+from backend.metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE
+from backend import tracing
+
+ASR_SERVER_HOST = os.getenv("ASR_SERVER_HOST", "127.0.0.1")
+ASR_SERVER_PORT = int(os.getenv("ASR_SERVER_PORT", "8002"))
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", "2"))
+ASR_MAX_QUEUE = int(os.getenv("ASR_MAX_QUEUE", "16"))
+ASR_MAX_SESSIONS = int(os.getenv("ASR_MAX_SESSIONS", "64"))
+ASR_SESSION_TTL = float(os.getenv("ASR_SESSION_TTL", "60"))
+ASR_LANGUAGE = os.getenv("ASR_LANGUAGE", "zh")
+ASR_MAX_AUDIO_S = float(os.getenv("ASR_MAX_AUDIO_S", "60"))   # 单个请求 / 会话的音频上限
+# 攒批时每个 worker 一次最多推理 ASR_BATCH_SIZE 段，在途请求数相应放大
+ASR_IN_FLIGHT = ASR_WORKERS * max(ASR_BATCH_SIZE, 1)
+
+_M_DECODE = REGISTRY.histogram("asr_decode_seconds", "ASR decode time", ("kind",))
+_M_REQUESTS = REGISTRY.counter("asr_requests", "ASR requests", ("endpoint", "status"))
+
+
+@dataclass(eq=False)
+class _Session:
+    stream: StreamSession
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    touched: float = field(default_factory=time.monotonic)
+
+
+_ENGINE: Optional[ASREngine] = None
+_POOL: Optional[ThreadPoolExecutor] = None
+_SCHED = AdmissionScheduler(ASR_IN_FLIGHT, max_queue=ASR_MAX_QUEUE)
+_SESSIONS: Dict[str, _Session] = {}
+_SWEEP_TASK: Optional[asyncio.Task] = None
+_STATS = {"partials": 0, "partials_skipped": 0, "finals": 0, "finals_reused": 0, "transcribes": 0, "expired": 0}
+
+REGISTRY.collect("gauge", "asr_sessions", "Open streaming ASR sessions", (), lambda: [((), len(_SESSIONS))])
+REGISTRY.collect("gauge", "asr_scheduler_slots", "ASR worker slots", ("state",),
+                 lambda: [(("active",), _SCHED.active), (("queued",), _SCHED.stats()["queued"])])
+
+
+def _engine() -> ASREngine:
+    if _ENGINE is None:
+        raise HTTPException(status_code=503, detail="识别模型尚未加载")
+    return _ENGINE
+
+
+async def _sweep_loop() -> None:
+    while True:
+        await asyncio.sleep(max(ASR_SESSION_TTL / 4, 1.0))
+        cutoff = time.monotonic() - ASR_SESSION_TTL
+        for sid, s in list(_SESSIONS.items()):
+            if s.touched < cutoff and not s.lock.locked():
+                _SESSIONS.pop(sid, None)
+                _STATS["expired"] += 1
+
+
+# ================== FastAPI ==================
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _ENGINE, _POOL, _SWEEP_TASK
+    _POOL = ThreadPoolExecutor(max_workers=ASR_IN_FLIGHT, thread_name_prefix="asr")
+    # 模型加载要好几秒，放到线程里，不卡事件循环
+    engine = await asyncio.get_running_loop().run_in_executor(
+        _POOL, lambda: FasterWhisperEngine(language=ASR_LANGUAGE, num_workers=ASR_WORKERS))
+    _ENGINE = BatchedEngine(engine, ASR_BATCH_SIZE, ASR_BATCH_WAIT_MS, runners=ASR_WORKERS) \
+        if ASR_BATCH_SIZE > 1 else engine
+    _SWEEP_TASK = asyncio.create_task(_sweep_loop())
+    try:
+        yield
+    finally:
+        _SWEEP_TASK.cancel()
+        await asyncio.gather(_SWEEP_TASK, return_exceptions=True)
+        _SESSIONS.clear()
+        if isinstance(_ENGINE, BatchedEngine):
+            _ENGINE.close()
+        _POOL.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="ASR Service", version="0.1.0", lifespan=lifespan)
+tracing.set_service("asr-server")
+
+
+async def _run(kind: str, session: str, priority: str, fn: Callable[..., Any], *args) -> Any:
+    """排队拿到 worker 槽位后在线程池里识别"""
+    async with _SCHED.slot(session, priority):
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_POOL, fn, *args)
+        finally:
+            _M_DECODE.observe(time.perf_counter() - t0, kind)
+
+
+async def _pcm(request: Request, sample_rate: int) -> np.ndarray:
+    """读请求体里的 int16 PCM（分块读，超过上限就拒绝）"""
+    limit = int(ASR_MAX_AUDIO_S * sample_rate) * 2
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail=f"音频超过 {ASR_MAX_AUDIO_S:g} 秒")
+    if len(body) % 2:
+        del body[-1]
+    return np.frombuffer(bytes(body), dtype=np.int16)
+
+
+def _queue_full(e: QueueFull) -> HTTPException:
+    return HTTPException(status_code=429, detail="识别队列已满，请稍后重试",
+                         headers={"Retry-After": str(e.retry_after)})
+
+
+def _trace(x_request_id: Optional[str], traceparent: Optional[str], name: str, **attrs: Any) -> tracing.Span:
+    trace_id, parent_id = tracing.parse_headers(x_request_id, traceparent)
+    return tracing.start(name, trace_id, parent_id, **attrs)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.exposition(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok" if _ENGINE is not None else "loading",
+        "engine": {"name": "faster_whisper", "model": ASR_MODEL, "device": ASR_DEVICE,
+                   "compute_type": ASR_COMPUTE_TYPE, "language": ASR_LANGUAGE},
+        "workers": ASR_WORKERS,
+        "batching": _ENGINE.stats() if isinstance(_ENGINE, BatchedEngine) else None,
+        "sessions": len(_SESSIONS),
+        "max_sessions": ASR_MAX_SESSIONS,
+        "requests": dict(_STATS),
+        "scheduler": _SCHED.stats(),
+        "decode_s": {kind: _M_DECODE.labels(kind).stats() for kind in ("partial", "final", "transcribe")},
+        "tracing": tracing.stats(),
+    }
+
+
+@app.post("/asr/transcribe")
+async def transcribe(request: Request, sample_rate: int = SAMPLE_RATE, prompt: str = "",
+                     x_request_id: Optional[str] = Header(None), traceparent: Optional[str] = Header(None)):
+    engine = _engine()
+    pcm = await _pcm(request, sample_rate)
+    sp = _trace(x_request_id, traceparent, "asr.transcribe", audio_s=round(pcm.size / sample_rate, 2))
+    try:
+        segs = await _run("transcribe", x_request_id or "", "interactive", engine.decode, pcm, sample_rate, prompt)
+    except QueueFull as e:
+        _M_REQUESTS.inc("transcribe", "429")
+        raise _queue_full(e)
+    finally:
+        sp.end()
+    _STATS["transcribes"] += 1
+    _M_REQUESTS.inc("transcribe", "200")
+    text = ""
+    for s in segs:
+        text = join_text(text, s.text)
+    return {"text": text.strip(), "segments": [{"start": s.start, "end": s.end, "text": s.text} for s in segs],
+            "audio_s": round(pcm.size / sample_rate, 3)}
+
+
+def _session(sid: str, sample_rate: int, offset: int) -> _Session:
+    """offset 为 0 时可新建；否则必须与服务端已收到的样本数对得上，对不上 409 让客户端整句重送"""
+    s = _SESSIONS.get(sid)
+    if s is None:
+        if offset:
+            raise HTTPException(status_code=409, detail="会话不存在（已过期或服务重启）")
+        if len(_SESSIONS) >= ASR_MAX_SESSIONS:
+            raise HTTPException(status_code=429, detail="识别会话过多", headers={"Retry-After": "1"})
+        s = _SESSIONS[sid] = _Session(_engine().session(sample_rate))
+    elif s.stream.sample_rate != sample_rate:
+        raise HTTPException(status_code=409, detail="采样率与会话不一致")
+    s.touched = time.monotonic()
+    return s
+
+
+@app.post("/asr/sessions/{sid}/audio")
+async def session_audio(sid: str, request: Request, sample_rate: int = SAMPLE_RATE, offset: int = 0,
+                        force: bool = False, x_request_id: Optional[str] = Header(None),
+                        traceparent: Optional[str] = Header(None)):
+    pcm = await _pcm(request, sample_rate)
+    s = _session(sid, sample_rate, offset)
+    async with s.lock:
+        st = s.stream
+        if offset != st.total:
+            raise HTTPException(status_code=409, detail=f"offset {offset} 与已收到的 {st.total} 不一致")
+        if st.total + pcm.size > ASR_MAX_AUDIO_S * sample_rate:
+            raise HTTPException(status_code=413, detail=f"音频超过 {ASR_MAX_AUDIO_S:g} 秒")
+        st.feed(pcm)
+        text = None
+        if st.due(force):
+            sp = _trace(x_request_id, traceparent, "asr.partial", audio_s=round(st.total / sample_rate, 2))
+            try:
+                text = await _run("partial", sid, "background", st.partial, force)
+                _STATS["partials"] += 1
+            except QueueFull:
+                _STATS["partials_skipped"] += 1   # 忙时跳过这一步，下一块音频来了再试
+            finally:
+                sp.end()
+        s.touched = time.monotonic()
+    _M_REQUESTS.inc("audio", "200")
+    return {"text": text, "decodes": st.decodes, "received": st.total}
+
+
+@app.post("/asr/sessions/{sid}/final")
+async def session_final(sid: str, request: Request, sample_rate: int = SAMPLE_RATE, offset: int = 0,
+                        end: Optional[int] = None, x_request_id: Optional[str] = Header(None),
+                        traceparent: Optional[str] = Header(None)):
+    pcm = await _pcm(request, sample_rate)
+    s = _session(sid, sample_rate, offset)
+    async with s.lock:
+        st = s.stream
+        if offset > st.total:
+            raise HTTPException(status_code=409, detail=f"offset {offset} 超过已收到的 {st.total}")
+        # 客户端可能多送过结尾静音：按 offset 截断后接上这一块，再按 end 裁到整句长度
+        full = np.concatenate((st.audio()[:offset], pcm))
+        if end is not None:
+            full = full[:end]
+        decodes = st.decodes
+        sp = _trace(x_request_id, traceparent, "asr.final", audio_s=round(full.size / sample_rate, 2))
+        try:
+            text = await _run("final", sid, "interactive", st.finalize, full)
+        except QueueFull as e:
+            _M_REQUESTS.inc("final", "429")
+            raise _queue_full(e)
+        finally:
+            sp.set(reused=st.decodes == decodes)
+            sp.end()
+        _SESSIONS.pop(sid, None)
+    _STATS["finals"] += 1
+    _STATS["finals_reused"] += st.decodes == decodes
+    _M_REQUESTS.inc("final", "200")
+    return {"text": text, "decodes": st.decodes, "reused": st.decodes == decodes}
+
+
+@app.delete("/asr/sessions/{sid}")
+async def session_delete(sid: str):
+    return {"deleted": _SESSIONS.pop(sid, None) is not None}
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=ASR_SERVER_HOST, port=ASR_SERVER_PORT, reload=False, workers=1)
@@ -0,0 +1,355 @@
+# backend/audio_capture.py
+"""
+常驻麦克风采集：设备只打开一次，后台线程持续把 16kHz/16bit 单声道 PCM 写进预分配的 numpy 环形缓冲区，
+逐帧做 VAD 切出一句句话。每轮说话不再打开/关闭设备，也不再花 1 秒做噪声校准。
+
+- 噪声底噪持续跟踪：非语音帧上做非对称 EWMA（环境变安静时快速下调，变吵时慢慢上调）；
+- VAD：有 webrtcvad 时用它（VAD_BACKEND=auto/webrtc），否则用能量 + 过零率；
+- 端点：连续 VAD_START_MS 语音帧判为开始（向前补 VAD_PRE_ROLL_MS，不丢字头），
+  之后连续 VAD_END_MS 静音判为结束，超过 max_seconds 强制结束；
+- 一句话 = 缓冲区里的一段 [start, end) 样本，按绝对样本序号索引，取用时才拷贝；
+- 自己在播报时（muted() 为真，再加 MIC_MUTE_TAIL_MS 的回声尾巴）不做端点检测、不更新底噪，
+  说到一半的那句作废，免得把 TTS 的声音当成用户说话。
+
+用法：
+    cap = MicCapture(); cap.start()
+    utt = cap.listen(max_seconds=12)     # 阻塞到下一句说完
+    pcm = utt.pcm                        # np.int16
+"""
+from __future__ import annotations
+import os
+import time
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+
+SAMPLE_RATE = int(os.getenv("MIC_SAMPLE_RATE", "16000"))
+FRAME_MS = int(os.getenv("MIC_FRAME_MS", "30"))            # webrtcvad 只接受 10/20/30ms
+RING_SECONDS = float(os.getenv("MIC_RING_SECONDS", "60"))
+MIC_DEVICE_INDEX = os.getenv("MIC_DEVICE_INDEX")            # 为空时用系统默认输入设备
+
+VAD_BACKEND = os.getenv("VAD_BACKEND", "auto").lower()      # auto | webrtc | energy
+VAD_WEBRTC_MODE = int(os.getenv("VAD_WEBRTC_MODE", "2"))    # 0~3，越大越严格
+VAD_ENERGY_RATIO = float(os.getenv("VAD_ENERGY_RATIO", "3.0"))  # 超过底噪的倍数才算语音
+VAD_MIN_RMS = float(os.getenv("VAD_MIN_RMS", "120"))        # 绝对下限，安静房间里底噪接近 0 时防误触
+VAD_ZCR_MAX = float(os.getenv("VAD_ZCR_MAX", "0.35"))       # 过零率过高（嘶嘶声、风扇）不算语音
+VAD_START_MS = int(os.getenv("VAD_START_MS", "90"))
+VAD_END_MS = int(os.getenv("VAD_END_MS", "600"))
+VAD_PRE_ROLL_MS = int(os.getenv("VAD_PRE_ROLL_MS", "300"))
+MIC_MUTE_TAIL_MS = int(os.getenv("MIC_MUTE_TAIL_MS", "300"))    # 播报停下后再忽略这么久（房间回声）
+
+
+def frame_rms(frame: np.ndarray) -> float:
+    x = frame.astype(np.float32)
+    return float(np.sqrt(np.mean(x * x))) if x.size else 0.0
+
+
+def frame_zcr(frame: np.ndarray) -> float:
+    """过零率：相邻样本符号变化的比例"""
+    if frame.size < 2:
+        return 0.0
+    s = np.signbit(frame)
+    return float(np.count_nonzero(s[1:] != s[:-1])) / (frame.size - 1)
+
+
+class NoiseFloor:
+    """非语音帧上跟踪底噪 RMS；前 warmup 帧直接取均值作为初值"""
+
+    def __init__(self, up: float = 0.02, down: float = 0.3, warmup: int = 10):
+        self.up, self.down, self.warmup = up, down, warmup
+        self.value = 0.0
+        self._n = 0
+
+    def update(self, rms: float) -> None:
+        self._n += 1
+        if self._n <= self.warmup:
+            self.value += (rms - self.value) / self._n
+            return
+        alpha = self.up if rms > self.value else self.down
+        self.value += alpha * (rms - self.value)
+
+
+class EnergyVAD:
+    """能量 + 过零率：能量超过底噪 VAD_ENERGY_RATIO 倍且过零率不过高；能量再高一倍时不看过零率（清辅音）"""
+    name = "energy"
+
+    def __init__(self, ratio: float = VAD_ENERGY_RATIO, min_rms: float = VAD_MIN_RMS, zcr_max: float = VAD_ZCR_MAX):
+        self.ratio, self.min_rms, self.zcr_max = ratio, min_rms, zcr_max
+
+    def is_speech(self, frame: np.ndarray, rms: float, floor: float) -> bool:
+        threshold = max(floor * self.ratio, self.min_rms)
+        if rms < threshold:
+            return False
+        return rms >= 2 * threshold or frame_zcr(frame) <= self.zcr_max
+
+
+class WebRTCVAD:
+    """webrtcvad（GMM）；太小声的帧（低于绝对下限）直接判静音，减少空调声误触"""
+    name = "webrtc"
+
+    def __init__(self, mode: int = VAD_WEBRTC_MODE, sample_rate: int = SAMPLE_RATE, min_rms: float = VAD_MIN_RMS):
+        import webrtcvad
+        self._vad = webrtcvad.Vad(mode)
+        self.sample_rate, self.min_rms = sample_rate, min_rms
+
+    def is_speech(self, frame: np.ndarray, rms: float, floor: float) -> bool:
+        if rms < self.min_rms:
+            return False
+        return self._vad.is_speech(frame.tobytes(), self.sample_rate)
+
+
+def make_vad(backend: str = VAD_BACKEND):
+    if backend in ("auto", "webrtc"):
+        try:
+            return WebRTCVAD()
+        except ImportError:
+            if backend == "webrtc":
+                raise
+    return EnergyVAD()
+
+
+@dataclass
+class Utterance:
+    start: int            # 绝对样本序号（含前补）
+    end: int
+    pcm: np.ndarray       # int16，拷贝出来的这段音频
+    sample_rate: int = SAMPLE_RATE
+    ended_at: float = 0.0  # time.monotonic()，端点判定的时刻
+    truncated: bool = False  # 因 max_seconds 强制结束
+
+    @property
+    def duration(self) -> float:
+        return (self.end - self.start) / self.sample_rate
+
+    def to_bytes(self) -> bytes:
+        return self.pcm.tobytes()
+
+
+class RingBuffer:
+    """预分配的 int16 环形缓冲区，按绝对样本序号读写；读已被覆盖的部分时从仍在缓冲区里的最早样本开始"""
+
+    def __init__(self, capacity: int):
+        self.buf = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.total = 0                  # 已写入的样本总数（= 下一个样本的绝对序号）
+        self._lock = threading.Lock()
+
+    def write(self, samples: np.ndarray) -> None:
+        n = samples.size
+        if n >= self.capacity:
+            samples, n = samples[-self.capacity:], self.capacity
+        with self._lock:
+            i = self.total % self.capacity
+            first = min(n, self.capacity - i)
+            self.buf[i:i + first] = samples[:first]
+            if first < n:
+                self.buf[:n - first] = samples[first:]
+            self.total += samples.size
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        with self._lock:
+            start = max(start, self.total - self.capacity, 0)
+            end = min(end, self.total)
+            n = end - start
+            if n <= 0:
+                return np.zeros(0, dtype=np.int16)
+            i = start % self.capacity
+            if i + n <= self.capacity:
+                return self.buf[i:i + n].copy()
+            return np.concatenate((self.buf[i:], self.buf[:i + n - self.capacity]))
+
+
+class MicCapture:
+    """
+    常驻采集线程 + 端点检测。listen() 等下一句说完；speech_start / total 供流式识别读取说话中的音频。
+    source 为返回 int16 帧的函数（测试或别的音源），缺省时用 pyaudio 打开麦克风。
+    muted 返回 True 时（如 TTS 正在播报）暂停端点检测，缓冲区照写。
+    """
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, frame_ms: int = FRAME_MS, ring_seconds: float = RING_SECONDS,
+                 vad=None, source: Optional[Callable[[int], np.ndarray]] = None,
+                 muted: Optional[Callable[[], bool]] = None):
+        self.sample_rate = sample_rate
+        self.frame = sample_rate * frame_ms // 1000
+        self.frame_ms = frame_ms
+        self.ring = RingBuffer(int(sample_rate * ring_seconds))
+        self.vad = vad or make_vad()
+        self.noise = NoiseFloor()
+        self._source = source
+        self._stream = None
+        self._pa = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._utterances: "queue.Queue[Utterance]" = queue.Queue()
+        self._frames = threading.Condition()
+        self.max_seconds: Optional[float] = None
+        self.muted = muted
+        self._muted_until = 0.0
+        self.muted_frames = 0                       # 因播报而跳过端点检测的帧数
+        # 端点状态（只在采集线程里改）
+        self.speech_start: Optional[int] = None    # 说话中时为这句话的起点，否则 None
+        self._run_speech = 0
+        self._run_silence = 0
+        self.dropped = 0                            # 读设备溢出次数
+
+    # ---------- 生命周期 ----------
+    def start(self) -> "MicCapture":
+        if self._thread is not None:
+            return self
+        if self._source is None:
+            self._open_device()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mic-capture", daemon=True)
+        self._thread.start()
+        return self
+
+    def _open_device(self) -> None:
+        import pyaudio
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(
+            format=pyaudio.paInt16, channels=1, rate=self.sample_rate, input=True,
+            frames_per_buffer=self.frame,
+            input_device_index=int(MIC_DEVICE_INDEX) if MIC_DEVICE_INDEX else None,
+        )
+
+    def _read_frame(self) -> np.ndarray:
+        if self._source is not None:
+            return self._source(self.frame)
+        data = self._stream.read(self.frame, exception_on_overflow=False)
+        return np.frombuffer(data, dtype=np.int16)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._pa is not None:
+            self._pa.terminate()
+            self._pa = None
+
+    def __enter__(self) -> "MicCapture":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # ---------- 采集线程 ----------
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                frame = self._read_frame()
+            except Exception as e:
+                self.dropped += 1
+                print(f"[mic] 读取失败: {type(e).__name__}: {e}")
+                time.sleep(self.frame_ms / 1000)
+                continue
+            if frame is None or not frame.size:
+                continue
+            self.ring.write(frame)
+            self._on_frame(frame)
+            with self._frames:
+                self._frames.notify_all()
+
+    def _is_muted(self) -> bool:
+        now = time.monotonic()
+        if self.muted is not None and self.muted():
+            self._muted_until = now + MIC_MUTE_TAIL_MS / 1000
+            return True
+        return now < self._muted_until
+
+    def _on_frame(self, frame: np.ndarray) -> None:
+        if self._is_muted():
+            # 听到的是自己的播报：不算说话，也不计入底噪；已经开始的这句作废
+            self.muted_frames += 1
+            self.speech_start = None
+            self._run_speech = self._run_silence = 0
+            return
+        rms = frame_rms(frame)
+        speech = self.vad.is_speech(frame, rms, self.noise.value)
+        end = self.ring.total
+        if self.speech_start is None:
+            if speech:
+                self._run_speech += 1
+                if self._run_speech * self.frame_ms >= VAD_START_MS:
+                    pre = VAD_PRE_ROLL_MS * self.sample_rate // 1000
+                    self.speech_start = max(end - self._run_speech * frame.size - pre, 0)
+                    self._run_silence = 0
+            else:
+                self._run_speech = 0
+                self.noise.update(rms)
+            return
+        self._run_silence = 0 if speech else self._run_silence + 1
+        too_long = (self.max_seconds is not None
+                    and end - self.speech_start >= self.max_seconds * self.sample_rate)
+        if self._run_silence * self.frame_ms >= VAD_END_MS or too_long:
+            # 结尾的静音只保留一小段（与前补对称），识别更快
+            tail = max(self._run_silence * frame.size - VAD_PRE_ROLL_MS * self.sample_rate // 1000, 0)
+            self._finish(end - tail, truncated=too_long and self._run_silence * self.frame_ms < VAD_END_MS)
+
+    def _finish(self, end: int, truncated: bool) -> None:
+        start = self.speech_start
+        self.speech_start = None
+        self._run_speech = self._run_silence = 0
+        self._utterances.put(Utterance(start, end, self.ring.read(start, end), self.sample_rate,
+                                       time.monotonic(), truncated))
+
+    # ---------- 读取 ----------
+    @property
+    def total(self) -> int:
+        return self.ring.total
+
+    @property
+    def in_speech(self) -> bool:
+        return self.speech_start is not None
+
+    @property
+    def silence_ms(self) -> int:
+        """说话中末尾已连续静音的毫秒数；不在说话时为 0"""
+        return self._run_silence * self.frame_ms if self.in_speech else 0
+
+    def read(self, start: int, end: Optional[int] = None) -> np.ndarray:
+        return self.ring.read(start, self.ring.total if end is None else end)
+
+    def wait_frames(self, timeout: float) -> None:
+        """阻塞到采集线程写入下一帧（或超时）"""
+        with self._frames:
+            self._frames.wait(timeout)
+
+    def clear(self) -> None:
+        """丢掉之前说完、还没取走的话（按下按钮之前的说话不算）"""
+        while True:
+            try:
+                self._utterances.get_nowait()
+            except queue.Empty:
+                return
+
+    def next_utterance(self, timeout: Optional[float] = None) -> Optional[Utterance]:
+        try:
+            return self._utterances.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def listen(self, timeout: Optional[float] = None, max_seconds: Optional[float] = None) -> Optional[Utterance]:
+        """清掉旧的话，等下一句说完；timeout 秒内没人开口返回 None（已经开口的等它说完）"""
+        self.start()
+        self.clear()
+        self.max_seconds = max_seconds
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            utt = self.next_utterance(0.05)
+            if utt is not None:
+                return utt
+            if deadline is not None and time.monotonic() >= deadline and not self.in_speech:
+                return None
+
+    def stats(self) -> dict:
+        return {"vad": self.vad.name, "noise_floor_rms": round(self.noise.value, 1), "in_speech": self.in_speech,
+                "buffered_s": round(min(self.ring.total, self.ring.capacity) / self.sample_rate, 2),
+                "dropped": self.dropped, "muted_frames": self.muted_frames}
@@ -0,0 +1,139 @@
+# backend/grammar.py
+"""
+受约束输出：把期望的 JSON 结构作为 JSON Schema 发给上游，让模型第一次就输出合法 JSON。
+
+- react：主对话的 {"thought", "action", "observation", "answer"}，action 为 null、
+  某个工具 {"name": 常量, "args": 该工具签名生成的参数 schema}（见 tool_registry），
+  或最多 ACTIONS_MAX 个这样的对象组成的列表（每项可带 "id" 与 "after"，见 backend/actions.py）；
+- cot_step：CoT 助手每步的 {"thought", "action"}，action 取自 cot_assistant/schemas.py 的 Action 模型。
+
+llama.cpp 收到 schema 后会自行转成 GBNF 语法做约束解码（/v1/chat/completions 的 response_format，
+/completion 的 json_schema 字段）；OpenAI 兼容云端按上游能力用 json_schema 或 json_object。
+属性顺序即生成顺序：action 在 answer 之前，投机式工具派发照常生效。
+"""
+from __future__ import annotations
+import os
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+from backend.actions import ACTIONS_MAX
+from backend.tool_registry import ToolSpec, build_specs
+
+CONSTRAINED_OUTPUT = os.getenv("CONSTRAINED_OUTPUT", "true").lower() in ("1", "true", "yes")
+
+SCHEMA_REACT = "react"
+SCHEMA_COT_STEP = "cot_step"
+SCHEMA_NONE = "none"
+SCHEMA_NAMES = (SCHEMA_REACT, SCHEMA_COT_STEP, SCHEMA_NONE)
+
+FORMAT_JSON_SCHEMA = "json_schema"
+FORMAT_JSON_OBJECT = "json_object"
+FORMAT_NONE = "none"
+
+
+def action_schema(spec: ToolSpec) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {"name": {"const": spec.name}, "args": spec.parameters},
+        "required": ["name", "args"],
+        "additionalProperties": False,
+    }
+
+
+def plan_item_schema(spec: ToolSpec) -> Dict[str, Any]:
+    """列表里的一项：工具调用 + 可选的 id / after"""
+    schema = action_schema(spec)
+    props = dict(schema["properties"], id={"type": "string"}, after={"type": "array", "items": {"type": "string"}})
+    return dict(schema, properties=props)
+
+
+def react_schema(specs: List[ToolSpec]) -> Dict[str, Any]:
+    many = {"type": "array", "items": {"anyOf": [plan_item_schema(s) for s in specs]},
+            "minItems": 1, "maxItems": ACTIONS_MAX}
+    return {
+        "type": "object",
+        "properties": {
+            "thought": {"type": "string"},
+            "action": {"anyOf": [{"type": "null"}] + [action_schema(s) for s in specs] + [many]},
+            "observation": {"type": "string"},
+            "answer": {"type": "string"},
+        },
+        "required": ["thought", "action", "observation", "answer"],
+        "additionalProperties": False,
+    }
+
+
+def cot_step_schema() -> Dict[str, Any]:
+    from cot_assistant.schemas import Action
+    action = Action.model_json_schema()
+    defs = action.pop("$defs", {})
+    schema: Dict[str, Any] = {
+        "type": "object",
+        "properties": {"thought": {"type": "string"}, "action": action},
+        "required": ["thought", "action"],
+        "additionalProperties": False,
+    }
+    if defs:
+        schema["$defs"] = defs
+    return schema
+
+
+class OutputSchemas:
+    """按名字取 schema；cot_step 首次用到时才生成"""
+
+    def __init__(self, function_map: Mapping[str, Callable]):
+        self._function_map = function_map
+        self._cache: Dict[str, Dict[str, Any]] = {}
+
+    def get(self, name: Optional[str]) -> Optional[Dict[str, Any]]:
+        name = name or SCHEMA_REACT
+        if not CONSTRAINED_OUTPUT or name == SCHEMA_NONE:
+            return None
+        if name not in self._cache:
+            if name == SCHEMA_REACT:
+                self._cache[name] = react_schema(build_specs(self._function_map))
+            elif name == SCHEMA_COT_STEP:
+                self._cache[name] = cot_step_schema()
+            else:
+                raise ValueError(f"未知的输出 schema: {name}")
+        return self._cache[name]
+
+
+def response_format(name: str, schema: Optional[Dict[str, Any]], mode: str,
+                    strict: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    OpenAI 兼容的 response_format 字段；mode 为上游支持的约束方式。
+    strict 只对 llama.cpp 开：这里的 schema 有不在 required 里的可选属性（plan 项的 id/after、工具的可选参数），
+    还用了 minItems/maxItems，OpenAI 的 strict 模式会直接 400；不带 strict 时云端按 schema 尽量遵守
+    """
+    if schema is None or mode == FORMAT_NONE:
+        return None
+    if mode == FORMAT_JSON_OBJECT:
+        return {"type": "json_object"}
+    body: Dict[str, Any] = {"name": name, "schema": schema}
+    if strict:
+        body["strict"] = True
+    return {"type": "json_schema", "json_schema": body}
+
+
+class ParseStats:
+    """按 schema 统计输出解析结果：json（一次通过）/ repaired（靠修复）/ failed"""
+
+    OUTCOMES = ("json", "repaired", "failed")
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, schema_name: str, outcome: str) -> None:
+        bucket = self._counts.setdefault(schema_name, {k: 0 for k in self.OUTCOMES})
+        bucket[outcome] += 1
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """{schema: {outcome: 次数}} 的副本（/metrics 用）"""
+        return {name: dict(c) for name, c in self._counts.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"constrained": CONSTRAINED_OUTPUT}
+        for name, c in self._counts.items():
+            total = sum(c.values())
+            out[name] = dict(c, failure_rate=round((c["repaired"] + c["failed"]) / total, 4) if total else 0.0)
+        return out
@@ -0,0 +1,219 @@
+# backend/history.py
+"""
+对话历史管理：按 token 预算裁剪 LLMClient 要发送的消息。
+
+- system prompt 固定在最前；
+- 最近若干轮原样保留（滑动窗口）；
+- 超出预算时，把最老的一批对话移出窗口，在后台线程里并入一段摘要，
+  摘要作为第二条 system 消息发送。
+
+为了配合 llama.cpp 的前缀缓存，裁剪是“成批”的：超过预算才一次性裁到低水位，
+之后几轮窗口起点不变，前缀依然可以复用。
+"""
+from __future__ import annotations
+import os
+import json
+import threading
+from typing import Callable, Dict, List, Optional
+
+# 各模型的上下文预算（token，已扣除余量）；HISTORY_BUDGETS='{"qwen2.5-3b-instruct": 3000}' 可覆盖
+MODEL_BUDGETS: Dict[str, int] = {
+    "qwen2.5-3b-instruct": 3072,
+    "qwen2.5-7b-instruct": 6144,
+    "qwen2.5-7b-cot": 6144,
+    "qwen-max": 24000,
+    "deepseek-chat": 48000,
+}
+DEFAULT_BUDGET = int(os.getenv("HISTORY_BUDGET", "3072"))
+HISTORY_LOW_WATERMARK = float(os.getenv("HISTORY_LOW_WATERMARK", "0.6"))  # 裁剪后占预算的比例
+HISTORY_MIN_TURNS = int(os.getenv("HISTORY_MIN_TURNS", "2"))              # 至少保留的最近消息条数
+SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+SUMMARY_PREFIX = "此前对话摘要："
+
+Summarizer = Callable[[str, List[Dict[str, str]]], str]
+
+
+def budget_for(model: str) -> int:
+    budgets = dict(MODEL_BUDGETS)
+    raw = os.getenv("HISTORY_BUDGETS")
+    if raw:
+        try:
+            budgets.update({k: int(v) for k, v in json.loads(raw).items()})
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"[Warn] HISTORY_BUDGETS 解析失败: {e}")
+    return budgets.get(model, DEFAULT_BUDGET)
+
+
+def approx_tokens(text: str) -> int:
+    """
+    快速估算 token 数（不加载分词器）：中日韩字符约 1 字 1 token，
+    其余非空白字符约 3.5 个 1 token。对 Qwen/DeepSeek 的 BPE 误差在 ±20% 左右。
+    """
+    cjk = other = 0
+    for ch in text:
+        if ch > "⹿":
+            cjk += 1
+        elif not ch.isspace():
+            other += 1
+    return cjk + int(other / 3.5 + 0.999)
+
+
+def message_tokens(m: Dict[str, str]) -> int:
+    return approx_tokens(m["content"]) + 4  # 角色标记等模板开销
+
+
+def extractive_summary(prev: str, messages: List[Dict[str, str]],
+                       max_tokens: int = SUMMARY_MAX_TOKENS) -> str:
+    """默认摘要：每条消息截取开头，拼在旧摘要后面；超出上限时丢掉最老的行"""
+    lines = [l for l in prev.splitlines() if l.strip()]
+    for m in messages:
+        who = "用户" if m["role"] == "user" else "助手"
+        text = " ".join(m["content"].split())
+        lines.append(f"{who}：{text[:60]}{'…' if len(text) > 60 else ''}")
+    while len(lines) > 1 and approx_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def make_llm_summarizer(endpoint: str, timeout: float = 30.0) -> Summarizer:
+    """用后端 /llm 生成摘要（关闭快速路由/缓存、按 background 优先级排队，且要求 action 为 null）；失败时退回抽取式摘要"""
+    import requests
+
+    def summarize(prev: str, messages: List[Dict[str, str]]) -> str:
+        transcript = "\n".join(f'{m["role"]}: {m["content"]}' for m in messages)
+        prompt = (f"已有摘要：\n{prev or '（无）'}\n\n新增对话：\n{transcript}\n\n"
+                  f"请把两者合并成不超过 {SUMMARY_MAX_TOKENS} 字的中文摘要，保留人名、时间、邮箱、待办等事实。")
+        payload = {
+            "messages": [
+                {"role": "system", "content": '只输出 JSON：{"thought": "", "action": null, "observation": "", "answer": "<摘要>"}'},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": 0.2, "max_tokens": SUMMARY_MAX_TOKENS * 2,
+            "fastpath": False, "response_cache": False, "speculative": False,
+            "priority": "background",  # 后台摘要，调度时让位于语音对话
+        }
+        try:
+            r = requests.post(endpoint, json=payload, timeout=timeout)
+            r.raise_for_status()
+            text = (r.json().get("text") or "").strip()
+            if text and not text.startswith("[LLM 调用失败]"):
+                return text
+        except Exception as e:
+            print(f"[History] LLM 摘要失败，改用抽取式摘要: {e}")
+        return extractive_summary(prev, messages)
+
+    return summarize
+
+
+class HistoryManager:
+    def __init__(self, model: str, budget: Optional[int] = None, reserve: int = 512,
+                 summarizer: Optional[Summarizer] = None):
+        self.budget = budget if budget is not None else budget_for(model)
+        self.reserve = reserve                  # 留给模型回复的 token
+        self.summarizer = summarizer or extractive_summary
+        self.summary_max = min(SUMMARY_MAX_TOKENS, self.budget // 4)
+        self.system: Optional[Dict[str, str]] = None
+        self.summary = ""
+        self.turns: List[Dict[str, str]] = []
+        self._turn_tokens: List[int] = []
+        self._pending: List[Dict[str, str]] = []  # 已移出窗口、等待并入摘要的消息
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    # ---------- 写入 ----------
+    def set_system(self, content: str) -> None:
+        self.system = {"role": "system", "content": content}
+
+    def add(self, role: str, content: str) -> None:
+        with self._lock:
+            m = {"role": role, "content": content}
+            self.turns.append(m)
+            self._turn_tokens.append(message_tokens(m))
+            self._trim_locked()
+
+    # ---------- 读取 ----------
+    def build(self) -> List[Dict[str, str]]:
+        """要发送的消息：system + 摘要 + 窗口内的最近对话（返回新列表，元素不可修改）"""
+        with self._lock:
+            out: List[Dict[str, str]] = []
+            if self.system:
+                out.append(self.system)
+            if self.summary:
+                out.append({"role": "system", "content": SUMMARY_PREFIX + self.summary})
+            out.extend(self.turns)
+            return out
+
+    def tokens(self) -> int:
+        with self._lock:
+            return self._fixed_tokens_locked() + sum(self._turn_tokens)
+
+    # ---------- 裁剪与摘要 ----------
+    def _fixed_tokens_locked(self) -> int:
+        fixed = message_tokens(self.system) if self.system else 0
+        if self.summary:
+            fixed += approx_tokens(self.summary) + 8
+        return fixed
+
+    def _trim_locked(self) -> None:
+        limit = self.budget - self.reserve
+        fixed = self._fixed_tokens_locked()
+        if fixed + sum(self._turn_tokens) <= limit:
+            return
+        # 一次裁到低水位，之后几轮窗口起点不动（前缀缓存友好）
+        target = max(limit * HISTORY_LOW_WATERMARK - fixed, 0)
+        total = sum(self._turn_tokens)
+        cut = 0
+        while len(self.turns) - cut > HISTORY_MIN_TURNS and total > target:
+            total -= self._turn_tokens[cut]
+            cut += 1
+        # 不从 assistant 回复开始窗口，保持 user/assistant 成对
+        while cut < len(self.turns) - HISTORY_MIN_TURNS and self.turns[cut]["role"] != "user":
+            cut += 1
+        if cut == 0:
+            return
+        self._pending.extend(self.turns[:cut])
+        del self.turns[:cut]
+        del self._turn_tokens[:cut]
+        self._schedule_summary_locked()
+
+    def _schedule_summary_locked(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return  # 正在摘要的线程结束前会再检查一次 _pending
+        self._worker = threading.Thread(target=self._summarize_loop, daemon=True)
+        self._worker.start()
+
+    def _summarize_loop(self) -> None:
+        while True:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                prev = self.summary
+                if not batch:
+                    self._worker = None
+                    return
+            try:
+                summary = self.summarizer(prev, batch)
+            except Exception as e:
+                print(f"[History] 摘要失败: {e}")
+                summary = extractive_summary(prev, batch)
+            summary = self._clip(summary)
+            with self._lock:
+                self.summary = summary
+                if not self._pending:
+                    self._worker = None
+                    return
+
+    def _clip(self, summary: str) -> str:
+        """摘要不超过 summary_max：先按行丢最老的，只剩一行时从头部截断"""
+        lines = summary.splitlines()
+        while len(lines) > 1 and approx_tokens("\n".join(lines)) > self.summary_max:
+            lines.pop(0)
+        text = "\n".join(lines)
+        while text and approx_tokens(text) > self.summary_max:
+            text = text[len(text) // 4 + 1:]
+        return text
+
+    def wait_summary(self, timeout: Optional[float] = None) -> None:
+        """等待后台摘要完成（测试/退出前用）"""
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
@@ -0,0 +1,247 @@
+# backend/idem_cache.py
+"""
+幂等缓存：x-idempotency-key -> /llm 响应。
+
+- MemoryIdemCache：OrderedDict 实现的 LRU + TTL，读写与淘汰都是 O(1)，按条数和字节数双重限额；
+- SqliteIdemCache：SQLite（WAL）持久化，重启后仍可重放，多个 uvicorn worker 共享同一个库文件。
+  读写是阻塞调用（忙时最多等 5 秒锁），aget / aset 把它们放到线程里执行，不占事件循环；
+  过期与限额清理由 sweep_loop 在后台定期做（lifespan 启动），不在请求路径上。
+
+两者都统计 hits / misses / evictions / expired。请求路径上用 aget / aset。
+"""
+from __future__ import annotations
+import os
+import abc
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+IDEM_BACKEND = os.getenv("IDEM_BACKEND", "memory")            # memory | sqlite
+IDEM_TTL = float(os.getenv("IDEM_TTL", "600"))
+IDEM_MAX_ENTRIES = int(os.getenv("IDEM_MAX_ENTRIES", "2048"))
+IDEM_MAX_BYTES = int(os.getenv("IDEM_MAX_BYTES", str(16 * 1024 * 1024)))
+IDEM_DB_PATH = os.getenv("IDEM_DB_PATH", os.path.join("data", "idem.db"))
+IDEM_SWEEP_INTERVAL = float(os.getenv("IDEM_SWEEP_INTERVAL", "30"))   # SQLite 后台清理间隔（秒）
+
+
+def _size(value: Dict[str, Any]) -> Tuple[str, int]:
+    raw = json.dumps(value, ensure_ascii=False)
+    return raw, len(raw.encode("utf-8"))
+
+
+class IdemCache(abc.ABC):
+    sweep_interval = 0.0            # >0 时需要 sweep_loop 在后台定期清理
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        ...
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """事件循环里用；默认直接调 get（内存实现是 O(1) 的字典操作），有阻塞 IO 的子类放到线程里"""
+        return self.get(key)
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        self.set(key, value)
+
+    def sweep(self) -> None:
+        """清理过期条目、回到限额以内；在后台线程里调用"""
+
+    async def sweep_loop(self) -> None:
+        """lifespan 中后台运行，每 sweep_interval 秒在线程里做一次 sweep"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                print(f"[idem] 清理失败: {type(e).__name__}: {e}")
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class MemoryIdemCache(IdemCache):
+    def __init__(self, ttl: float = IDEM_TTL, max_entries: int = IDEM_MAX_ENTRIES,
+                 max_bytes: int = IDEM_MAX_BYTES):
+        super().__init__(ttl, max_entries, max_bytes)
+        # key -> (写入时间, 字节数, 值)；顺序即 LRU 顺序，队首最久未用
+        self._data: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        if time.time() - item[0] > self.ttl:
+            self._pop(key)
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[2]
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        if key in self._data:
+            self._pop(key)
+        _, size = _size(value)
+        now = time.time()
+        self._data[key] = (now, size, value)
+        self._bytes += size
+        # 顺带清掉队首已过期的条目；其余过期条目在访问时惰性删除
+        while self._data:
+            head_key, (ts, _, _) = next(iter(self._data.items()))
+            if head_key == key or now - ts <= self.ttl:
+                break
+            self._pop(head_key)
+            self.expired += 1
+        while len(self._data) > self.max_entries or (self._bytes > self.max_bytes and len(self._data) > 1):
+            self._pop(next(iter(self._data)))
+            self.evictions += 1
+
+    def _pop(self, key: str) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(super().stats(), entries=len(self._data), bytes=self._bytes)
+
+
+class SqliteIdemCache(IdemCache):
+    def __init__(self, path: str = IDEM_DB_PATH, ttl: float = IDEM_TTL,
+                 max_entries: int = IDEM_MAX_ENTRIES, max_bytes: int = IDEM_MAX_BYTES,
+                 sweep_interval: float = IDEM_SWEEP_INTERVAL):
+        super().__init__(ttl, max_entries, max_bytes)
+        self.path = path
+        self.sweep_interval = sweep_interval
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._lock = threading.RLock()
+        # 上次清理后的条数/字节数：/health 直接读，不在事件循环里查库
+        self._entries = 0
+        self._bytes = 0
+        self.sweeps = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+            self._conn.execute("PRAGMA synchronous=NORMAL;")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS idem(
+              key TEXT PRIMARY KEY,
+              created REAL,
+              accessed REAL,
+              size INTEGER,
+              value_json TEXT
+            );
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_idem_accessed ON idem(accessed);")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_idem_created ON idem(created);")
+            self._sweep(time.time())            # 启动时先清一遍上次留下的过期条目
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT created, value_json FROM idem WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if now - row[0] > self.ttl:
+                self._conn.execute("DELETE FROM idem WHERE key=?", (key,))
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE idem SET accessed=? WHERE key=?", (now, key))
+            self.hits += 1
+        return json.loads(row[1])
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        raw, size = _size(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idem(key,created,accessed,size,value_json) VALUES(?,?,?,?,?)",
+                (key, now, now, size, raw))
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.set, key, value)
+
+    def sweep(self) -> None:
+        with self._lock:
+            self._sweep(time.time())
+            self.sweeps += 1
+
+    def _sweep(self, now: float) -> None:
+        cur = self._conn.execute("DELETE FROM idem WHERE created < ?", (now - self.ttl,))
+        self.expired += max(cur.rowcount, 0)
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size),0) FROM idem").fetchone()
+        over = count - self.max_entries
+        if over > 0:
+            cur = self._conn.execute(
+                "DELETE FROM idem WHERE key IN (SELECT key FROM idem ORDER BY accessed LIMIT ?)", (over,))
+            self.evictions += max(cur.rowcount, 0)
+            total = self._conn.execute("SELECT COALESCE(SUM(size),0) FROM idem").fetchone()[0]
+        # 字节超限时按 LRU 顺序一批批删，直到回到限额以内
+        while total > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM idem ORDER BY accessed LIMIT 32").fetchall()
+            if len(rows) <= 1:
+                break
+            victims = []
+            for k, size in rows[:-1]:
+                if total <= self.max_bytes:
+                    break
+                victims.append((k,))
+                total -= size
+            self._conn.executemany("DELETE FROM idem WHERE key=?", victims)
+            self.evictions += len(victims)
+        self._entries, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size),0) FROM idem").fetchone()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(super().stats(), entries=self._entries, bytes=self._bytes, path=self.path,
+                    sweeps=self.sweeps, sweep_interval=self.sweep_interval)
+
+
+def make_idem_cache() -> IdemCache:
+    """按 IDEM_BACKEND 创建缓存实例"""
+    if IDEM_BACKEND.lower() == "sqlite":
+        return SqliteIdemCache()
+    return MemoryIdemCache()
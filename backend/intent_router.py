@@ -0,0 +1,163 @@
+# backend/intent_router.py
+"""
+本地意图快速路由：高置信度的简单指令（播放音乐、打开常用网站、搜索、查看日程）
+直接在本地解析成 action，不走 LLM。INTENT_FASTPATH=true 开启，默认关闭。
+
+做法：把触发词和网站别名都放进一棵字符 Trie，对归一化后的用户话扫描一遍取所有命中，
+再按“命中片段 + 槽位覆盖了整句的多少”算置信度。多个意图同时命中（有歧义）或置信度不够时，
+返回 None，交给 LLM 处理。
+"""
+from __future__ import annotations
+import os
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.text_utils import normalize_utterance, TAIL_FILLERS
+from function_call.Search_the_web import WEBSITE_MAP
+
+INTENT_FASTPATH = os.getenv("INTENT_FASTPATH", "false").lower() in ("1", "true", "yes")
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.8"))
+
+# 意图 -> 触发词（均为归一化后的形式）
+# play_music 是播放/暂停切换，不知道当前状态，所以“暂停”“停止”类说法不放进来（否则可能反而开始播放），交给 LLM
+PLAY_MUSIC = "play_music"
+OPEN_SITE = "open_site"
+SEARCH = "search"
+LIST_EVENTS = "list_events"
+
+_TRIGGERS: Dict[str, Tuple[str, ...]] = {
+    PLAY_MUSIC: ("播放音乐", "放音乐", "放首歌", "放一首歌", "来首歌", "来一首歌", "听歌", "我想听歌",
+                 "继续播放", "切换播放"),
+    OPEN_SITE: ("打开", "进入", "访问", "上"),
+    SEARCH: ("搜索", "搜一下", "搜一搜", "搜搜", "查一下", "查查", "百度一下", "搜索一下"),
+    LIST_EVENTS: ("今天有什么安排", "有什么安排", "我有什么安排", "今天的安排", "查看日程", "看看日程",
+                  "接下来的日程", "接下来的安排", "有什么日程", "日程安排", "我的日程"),
+}
+_SITE = "site"
+_PUNCT = " \t，,。.！!？?：:；;、"
+
+
+@dataclass
+class IntentMatch:
+    intent: str
+    action: Dict[str, Any]
+    answer: str
+    confidence: float
+
+
+class _Trie:
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+
+    def insert(self, word: str, payload: Tuple[str, str]) -> None:
+        node = self.root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node.setdefault("$", []).append(payload)
+
+    def scan(self, text: str) -> List[Tuple[int, int, str, str]]:
+        """返回所有命中 (start, end, kind, 原词)"""
+        hits = []
+        for i in range(len(text)):
+            node = self.root
+            for j in range(i, len(text)):
+                node = node.get(text[j])
+                if node is None:
+                    break
+                for kind, word in node.get("$", ()):
+                    hits.append((i, j + 1, kind, word))
+        return hits
+
+
+class IntentRouter:
+    def __init__(self, min_confidence: float = INTENT_MIN_CONFIDENCE,
+                 website_map: Optional[Dict[str, str]] = None):
+        self.min_confidence = min_confidence
+        self._trie = _Trie()
+        for intent, words in _TRIGGERS.items():
+            for w in words:
+                self._trie.insert(w, (intent, w))
+        for alias in (website_map if website_map is not None else WEBSITE_MAP):
+            self._trie.insert(normalize_utterance(alias), (_SITE, alias))
+        self.hits: Dict[str, int] = {k: 0 for k in _TRIGGERS}
+        self.fallbacks = {"no_match": 0, "ambiguous": 0, "low_confidence": 0}
+
+    def match(self, utterance: str) -> Optional[IntentMatch]:
+        text = normalize_utterance(utterance)
+        if not text:
+            self.fallbacks["no_match"] += 1
+            return None
+        hits = self._trie.scan(text)
+        # 同一位置只保留最长的触发词（如“搜索一下”优先于“搜索”）
+        hits.sort(key=lambda h: (h[0], -(h[1] - h[0])))
+        intents = {h[2] for h in hits if h[2] != _SITE}
+        sites = [h for h in hits if h[2] == _SITE]
+
+        if sites and OPEN_SITE in intents:
+            intents.discard(SEARCH)  # “打开百度”优先按打开网站理解
+        elif OPEN_SITE in intents:
+            intents.discard(OPEN_SITE)  # 只有“打开”没有网站名，信息不足
+        if not intents:
+            self.fallbacks["no_match"] += 1
+            return None
+        if len(intents) > 1:
+            self.fallbacks["ambiguous"] += 1
+            return None
+
+        intent = intents.pop()
+        trig = next(h for h in hits if h[2] == intent)
+        m = self._build(intent, utterance, text, trig, sites)
+        if m is None or m.confidence < self.min_confidence:
+            self.fallbacks["low_confidence"] += 1
+            return None
+        self.hits[intent] += 1
+        return m
+
+    def _build(self, intent: str, utterance: str, text: str, trig: Tuple[int, int, str, str],
+               sites: List[Tuple[int, int, str, str]]) -> Optional[IntentMatch]:
+        start, end, _, _ = trig
+        n = len(text)
+        if intent == PLAY_MUSIC:
+            return IntentMatch(intent, {"name": "play_music", "args": {}},
+                               "好的，已为你切换音乐的播放状态。", (end - start) / n)
+        if intent == LIST_EVENTS:
+            return IntentMatch(intent, {"name": "list_upcoming_events", "args": {}},
+                               "好的，我来查看你接下来的日程。", (end - start) / n)
+        if intent == OPEN_SITE:
+            # 网站名需紧跟在“打开”之后，且只能有一个
+            after = [s for s in sites if s[0] == end]
+            if len(after) != 1 or len({s[3] for s in sites}) > 1:
+                return None
+            s_start, s_end, _, alias = after[0]
+            return IntentMatch(intent, {"name": "open_website_or_search", "args": {"site_name": alias}},
+                               f"好的，正在为你打开{alias}。", (s_end - start) / n)
+        if intent == SEARCH:
+            # 触发词在句首，其后全部作为搜索词
+            query = text[end:]
+            if start != 0 or not query:
+                return None
+            raw_query = self._raw_tail(utterance, trig[3]) or query
+            return IntentMatch(intent, {"name": "open_website_or_search", "args": {"search_query": raw_query}},
+                               f"好的，正在为你搜索：{raw_query}", 1.0)
+        return None
+
+    @staticmethod
+    def _raw_tail(utterance: str, trigger: str) -> str:
+        """从原话里取触发词之后的部分，保留 “C++”“C#” 这类符号和大小写"""
+        raw = unicodedata.normalize("NFKC", utterance or "").strip()
+        idx = raw.lower().find(trigger)
+        if idx < 0:
+            return ""
+        return TAIL_FILLERS.sub("", raw[idx + len(trigger):].strip(_PUNCT)).strip(_PUNCT)
+
+    def stats(self) -> Dict[str, Any]:
+        routed = sum(self.hits.values())
+        fallback = sum(self.fallbacks.values())
+        total = routed + fallback
+        return {
+            "hits": dict(self.hits),
+            "fallbacks": dict(self.fallbacks),
+            "routed_ratio": round(routed / total, 4) if total else 0.0,
+            "min_confidence": self.min_confidence,
+        }
@@ -0,0 +1,244 @@
+# backend/json_repair.py
+"""
+容错 JSON 解析：LLM 输出不是标准 JSON 时，一遍线性扫描尽量把它读出来。
+
+能处理：
+- 前后的废话、```json 代码块标记（从第一个 { 或 [ 开始读，顶层值结束后的内容忽略）；
+- 尾逗号、多余逗号、缺冒号；
+- 单引号字符串、未加引号的键、Python 的 True/False/None；
+- 字符串里未转义的换行/制表符、未转义的内层双引号（后面紧跟的不是 , } ] : 就当作内容）；
+- // 与 /* */ 注释（模型常照抄提示词里的 "// 留空"）；
+- 被 max_tokens 截断：字符串、对象、数组在末尾自动闭合，没写完的键丢弃。
+
+嵌套深到解释器递归上限（json.loads 和扫描器都会 RecursionError）时按读不出来处理，抛 JSONRepairError。
+
+合法 JSON 先走 json.loads（C 实现，最快），失败才进入扫描器。
+"""
+from __future__ import annotations
+import re
+import json
+from json.decoder import scanstring
+from typing import Any, Dict, List, Tuple
+
+_WS = " \t\r\n\ufeff"
+_SKIP = re.compile(r"(?:[ \t\r\n\ufeff]+|//[^\n]*|/\*[\s\S]*?(?:\*/|\Z))*")
+_CLOSES = re.compile(r"[ \t]*(?:[,}\]:\r\n]|\Z)")
+_BARE_KEY = re.compile(r"[^:,}\s]+")
+_DECODER = json.JSONDecoder()
+_NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_WORD = re.compile(r"[A-Za-z_$][\w$-]*")
+_RUN = {'"': re.compile(r'[^"\\]+'), "'": re.compile(r"[^'\\]+")}
+_WORDS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_TOO_DEEP = "嵌套过深"
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/", "\\": "\\", '"': '"', "'": "'"}
+
+
+class JSONRepairError(ValueError):
+    pass
+
+
+class _Scanner:
+    def __init__(self, text: str):
+        self.s = text
+        self.n = len(text)
+        self.i = 0
+
+    # ---------- 值 ----------
+    def value(self) -> Any:
+        i = self.i = _SKIP.match(self.s, self.i).end()
+        if i >= self.n:
+            return None
+        c = self.s[i]
+        if c == "{":
+            return self.obj()
+        if c == "[":
+            return self.arr()
+        if c in "\"'":
+            return self.string(c)
+        m = _NUMBER.match(self.s, self.i)
+        if m:
+            self.i = m.end()
+            raw = m.group().lstrip("+")
+            try:
+                return int(raw) if raw.lstrip("-").isdigit() else float(raw)
+            except ValueError:
+                return raw
+        m = _WORD.match(self.s, self.i)
+        if m and m.group() in _WORDS:
+            self.i = m.end()
+            return _WORDS[m.group()]
+        return self.bare()
+
+    def bare(self) -> str:
+        """没加引号的文本：读到分隔符为止，当作字符串"""
+        s, n, i = self.s, self.n, self.i
+        j = i
+        while j < n and s[j] not in ",}]\n":
+            j += 1
+        self.i = j if j > i else j + 1
+        return s[i:j].strip()
+
+    def string(self, q: str) -> str:
+        s, n = self.s, self.n
+        if q == '"':
+            # 快速路径：json 自带的 C 实现，strict=False 允许字符串里有裸换行
+            try:
+                value, end = scanstring(s, self.i + 1, False)
+                if _CLOSES.match(s, end) is not None:  # 后面像是字符串结束，否则是内层引号
+                    self.i = end
+                    return value
+            except ValueError:
+                pass  # 截断或非法转义，走下面的逐段扫描
+        run = _RUN[q]
+        i = self.i + 1
+        parts: List[str] = []
+        while i < n:
+            m = run.match(s, i)
+            if m:
+                parts.append(m.group())
+                i = m.end()
+                if i >= n:
+                    break
+            c = s[i]
+            if c == "\\":
+                if i + 1 >= n:
+                    i += 1
+                    break
+                e = s[i + 1]
+                if e == "u" and i + 6 <= n:
+                    try:
+                        parts.append(chr(int(s[i + 2:i + 6], 16)))
+                        i += 6
+                        continue
+                    except ValueError:
+                        pass
+                parts.append(_ESCAPES.get(e, e))
+                i += 2
+            elif c == q:
+                if _CLOSES.match(s, i + 1) is not None:
+                    i += 1
+                    self.i = i
+                    return "".join(parts)
+                parts.append(c)  # 未转义的内层引号
+                i += 1
+        self.i = n  # 截断：字符串在末尾自动闭合
+        return "".join(parts)
+
+    def key(self) -> str:
+        c = self.s[self.i]
+        if c in "\"'":
+            return self.string(c)
+        m = _BARE_KEY.match(self.s, self.i)
+        if m is None:
+            self.i += 1
+            return ""
+        self.i = m.end()
+        return m.group()
+
+    def obj(self) -> Dict[str, Any]:
+        s, n, skip = self.s, self.n, _SKIP.match
+        self.i += 1
+        out: Dict[str, Any] = {}
+        while True:
+            i = self.i = skip(s, self.i).end()
+            if i >= n:
+                return out
+            c = s[i]
+            if c == "}" or c == "]":  # ] 为括号错配，也当作对象结束
+                self.i = i + 1
+                return out
+            if c == "," or c == ";":
+                self.i = i + 1
+                continue
+            k = self.key()
+            i = self.i = skip(s, self.i).end()
+            if i >= n:
+                return out  # 截断在键之后：丢弃这个键
+            if s[i] == ":" or s[i] == "=":
+                i = self.i = skip(s, i + 1).end()
+                if i >= n:
+                    return out
+            if s[i] == "," or s[i] == "}":
+                out[k] = None
+                continue
+            out[k] = self.value()
+
+    def arr(self) -> List[Any]:
+        s, n, skip = self.s, self.n, _SKIP.match
+        self.i += 1
+        out: List[Any] = []
+        while True:
+            i = self.i = skip(s, self.i).end()
+            if i >= n:
+                return out
+            c = s[i]
+            if c == "]" or c == "}":
+                self.i = i + 1
+                return out
+            if c == ",":
+                self.i = i + 1
+                continue
+            out.append(self.value())
+
+
+def scan(text: str, objects_only: bool = False) -> Any:
+    """
+    只用容错扫描器解析（不先试 json.loads）。从第一个 { 或 [ 开始读；
+    objects_only=True 时只从 { 开始（跳过 “[注意]” 这类前缀）。找不到起点时抛 JSONRepairError
+    """
+    text = text or ""
+    sc = _Scanner(text)
+    sc.i = _start(text, objects_only)
+    return sc.value()
+
+
+def _start(text: str, objects_only: bool) -> int:
+    starts = [p for p in (text.find("{"), -1 if objects_only else text.find("[")) if p >= 0]
+    if not starts:
+        raise JSONRepairError("输出里没有 JSON 对象" if objects_only else "输出里没有 JSON 对象或数组")
+    return min(starts)
+
+
+def _extract(text: str, objects_only: bool) -> Any:
+    """json.loads 失败之后：先试从第一个 { 起用 C 解码器读一个完整值（只有前后废话/代码块的情况），再容错扫描"""
+    text = text or ""
+    start = _start(text, objects_only)
+    try:
+        return _DECODER.raw_decode(text, start)[0]
+    except json.JSONDecodeError:
+        pass
+    except RecursionError:
+        raise JSONRepairError(_TOO_DEEP) from None
+    sc = _Scanner(text)
+    sc.i = start
+    try:
+        return sc.value()
+    except RecursionError:
+        raise JSONRepairError(_TOO_DEEP) from None
+
+
+def tolerant_loads(text: str) -> Tuple[Any, bool]:
+    """返回 (解析结果, 是否经过修复)；完全读不出来时抛 JSONRepairError"""
+    try:
+        return json.loads(text), False
+    except (json.JSONDecodeError, TypeError):
+        pass
+    except RecursionError:
+        raise JSONRepairError(_TOO_DEEP) from None
+    return _extract(text, objects_only=False), True
+
+
+def loads_object(text: str) -> Tuple[Dict[str, Any], bool]:
+    """期望顶层是对象，返回 (对象, 是否经过修复)；读不出对象时抛 JSONRepairError"""
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data, False
+    except (json.JSONDecodeError, TypeError):
+        pass
+    except RecursionError:
+        raise JSONRepairError(_TOO_DEEP) from None
+    data = _extract(text, objects_only=True)
+    if not isinstance(data, dict):
+        raise JSONRepairError(f"顶层不是对象，而是 {type(data).__name__}")
+    return data, True
@@ -2,18 +2,37 @@ from __future__ import annotations
 import os
 import time
 import json
-import traceback
-import ast
-from typing import List, Dict, Optional, Tuple
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from typing import List, Dict, Literal, Optional, Set, Tuple, Any, AsyncIterator, Iterator
 
 import httpx
 import uvicorn
-from fastapi import FastAPI, Header
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 # 你的工具注册表（保持不变）
 from function_call.function_call_register import function_map
+from backend.react_stream import ReActStreamParser
+from backend.json_repair import JSONRepairError, loads_object
+from backend.tool_executor import ToolExecutor
+from backend.idem_cache import IdemCache, make_idem_cache
+from backend.response_cache import ResponseCache, RESPONSE_CACHE
+from backend.intent_router import IntentRouter, IntentMatch, INTENT_FASTPATH
+from backend.prefix_cache import PrefixStats, stabilize_messages, slot_for, LLAMA_SLOTS
+from backend.singleflight import SingleFlight, SINGLEFLIGHT, fingerprint
+from backend.upstreams import Upstream, UpstreamPool, NoUpstreamAvailable, load_upstreams
+from backend.grammar import (OutputSchemas, ParseStats, response_format, FORMAT_JSON_SCHEMA,
+                             SCHEMA_REACT, SCHEMA_NONE)
+from backend.scheduler import AdmissionScheduler, QueueFull, PRIORITIES, make_scheduler
+from backend.tool_registry import ToolRegistry, NativeReActStream, expand_tools, react_from_message
+from backend.react_loop import (Budget, LoopStats, StepTimeout, observation_messages, step_record,
+                                STOP_DONE, STOP_ERROR, STOP_TIME_BUDGET)
+from backend.actions import action_list, plan, run_plan
+from backend import tracing
+from backend.metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE
 
 # ================== 运行模式开关 ==================
 # true/false/yes/1 皆可；默认云端
@@ -37,15 +56,212 @@ LLAMA_BASE = os.getenv("LLAMA_BASE", LOCAL_LLAMA_BASE_DEFAULT if USE_LOCAL_MODEL
 LLAMA_MODEL = os.getenv("LLAMA_MODEL", LOCAL_LLAMA_MODEL_DEFAULT if USE_LOCAL_MODEL else CLOUD_MODEL_DEFAULT)
 LLAMA_TIMEOUT = float(os.getenv("LLAMA_TIMEOUT", "30"))
 
+# ================== 投机式工具派发 ==================
+# 开启后 /llm 也走上游流式：action 对象一解析完就在工作线程里启动工具，
+# 与模型继续生成 answer 的时间重叠；默认关闭（工具先于模型输出完成就执行，出错也撤不回），
+# 请求体 speculative 字段可逐请求开启
+SPECULATIVE_TOOLS = os.getenv("SPECULATIVE_TOOLS", "false").lower() in ("1", "true", "yes")
+
+# ================== 上游连接池 ==================
+# 整个进程共用一个 AsyncClient：复用 TCP/TLS 连接，云端走 HTTP/2 多路复用
+HTTP2_ENABLED = os.getenv("LLAMA_HTTP2", "true").lower() in ("1", "true", "yes")
+POOL_MAX_CONNECTIONS = int(os.getenv("LLAMA_POOL_MAX_CONNECTIONS", "32"))
+POOL_MAX_KEEPALIVE = int(os.getenv("LLAMA_POOL_MAX_KEEPALIVE", "16"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLAMA_POOL_KEEPALIVE_EXPIRY", "60"))
+POOL_CONNECT_TIMEOUT = float(os.getenv("LLAMA_CONNECT_TIMEOUT", "5"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("LLAMA_POOL_TIMEOUT", "10"))
+
+_HTTP: Optional[httpx.AsyncClient] = None
+_TOOLS: Optional[ToolExecutor] = None
+_HTTP_STATS = {"requests": 0, "in_flight": 0, "errors": 0}
+
+def _http2_available() -> bool:
+    # http2=True 需要 h2 包（pip install "httpx[http2]"）；缺失时退回 HTTP/1.1 keep-alive
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _make_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLAMA_TIMEOUT, connect=POOL_CONNECT_TIMEOUT, pool=POOL_ACQUIRE_TIMEOUT),
+    )
+
+def _http() -> httpx.AsyncClient:
+    """返回进程级共享 client；未经 lifespan 启动（如被其它模块直接调用）时懒创建"""
+    global _HTTP
+    if _HTTP is None or _HTTP.is_closed:
+        _HTTP = _make_http_client()
+    return _HTTP
+
+async def _post(url: str, **kwargs) -> httpx.Response:
+    _HTTP_STATS["requests"] += 1
+    _HTTP_STATS["in_flight"] += 1
+    try:
+        return await _http().post(url, **kwargs)
+    except Exception:
+        _HTTP_STATS["errors"] += 1
+        raise
+    finally:
+        _HTTP_STATS["in_flight"] -= 1
+
+def _tools() -> ToolExecutor:
+    global _TOOLS
+    if _TOOLS is None:
+        _TOOLS = ToolExecutor(function_map)
+    return _TOOLS
+
+def _pool_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = {
+        "http2": _http2_available(),
+        "max_connections": POOL_MAX_CONNECTIONS,
+        "max_keepalive": POOL_MAX_KEEPALIVE,
+        "keepalive_expiry": POOL_KEEPALIVE_EXPIRY,
+        **_HTTP_STATS,
+    }
+    # httpx 没有公开连接池统计，这里尽力读取 httpcore 的连接列表
+    pool = getattr(getattr(_HTTP, "_transport", None), "_pool", None)
+    conns = list(getattr(pool, "connections", []) or [])
+    stats["connections"] = len(conns)
+    stats["idle"] = sum(1 for c in conns if getattr(c, "is_idle", lambda: False)())
+    return stats
+
 # ================== 幂等缓存 ==================
-_IDEM: Dict[str, Tuple[float, Dict]] = {}
-IDEM_TTL = 600.0
+# LRU + TTL，有条数/字节上限；IDEM_BACKEND=sqlite 时落盘（WAL），重启与多 worker 间共享，读写放到线程里、后台定期清理
+_IDEM: IdemCache = make_idem_cache()
+_IDEM_SWEEP_TASK: Optional[asyncio.Task] = None
+
+# ================== 并发请求合并 ==================
+# 相同幂等键 / 相同请求体的并发 /llm 只执行一次，其余等同一个结果；SINGLEFLIGHT=false 关闭
+_FLIGHTS = SingleFlight()
+
+# ================== 响应缓存（可选） ==================
+# RESPONSE_CACHE=true 开启；相同/相似的语音指令直接复用上次的 action + answer
+_RESP_CACHE = ResponseCache()
+
+# ================== 本地意图快速路由 ==================
+# 高置信度的简单指令在本地解析，不请求 LLM；INTENT_FASTPATH=true 开启（默认关闭）
+_INTENTS = IntentRouter()
+FASTPATH_MODEL = "local:intent"
+
+# ================== 提示前缀缓存 ==================
+# 本地 llama.cpp：cache_prompt + 按 session_id 固定 id_slot（LLAMA_SLOTS>0 时），统计前缀复用率
+_PREFIX = PrefixStats()
+
+# ================== 多上游路由 ==================
+# LLM_UPSTREAMS 配置多个上游（JSON 列表）时按 EWMA 延迟 + 在途数挑选，带熔断、健康探测与对冲请求；
+# 未配置时只有下面这个默认上游，行为与原来的单上游一致
+_UPSTREAMS: UpstreamPool = load_upstreams(Upstream(
+    name="default", base=LLAMA_BASE, model=LLAMA_MODEL, local=USE_LOCAL_MODEL,
+    api_key=LLM_API_KEY, auth_scheme=LLM_AUTH_SCHEME, slots=LLAMA_SLOTS,
+    response_format=os.getenv("LLM_RESPONSE_FORMAT", ""),
+    native_tools=os.getenv("LLM_NATIVE_TOOLS", "false").lower() in ("1", "true", "yes"),
+))
+_PROBE_TASK: Optional[asyncio.Task] = None
 
-def _gc_idem():
-    now = time.time()
-    for k, (ts, _) in list(_IDEM.items()):
-        if now - ts > IDEM_TTL:
-            _IDEM.pop(k, None)
+# ================== 准入调度（本地模型） ==================
+# 在途请求数按 llama-server 槽位数放行，interactive 优先于 background，同级按 session 轮转；
+# 队列满返回 429 + Retry-After。槽位数取 SCHED_SLOTS，否则为各本地上游 slots（未配置时取 max_inflight）之和。
+# 只有选中本地上游的调用才排队，云端上游不受限；本地排队超过对冲时间时照常对冲到云端，本地队列满时换云端重试
+_SCHED: Optional[AdmissionScheduler] = make_scheduler(
+    sum(u.slots or u.max_inflight for u in _UPSTREAMS.upstreams if u.local))
+
+# ================== 受约束输出 ==================
+# 按工具签名 / CoT Action 模型生成 JSON Schema 随请求发给上游（llama.cpp 转成 GBNF 约束解码）；
+# CONSTRAINED_OUTPUT=false 关闭。解析结果（一次通过/修复/失败）按 schema 计数
+_SCHEMAS = OutputSchemas(function_map)
+_PARSE = ParseStats()
+
+# ================== 工具说明 ==================
+# system prompt 里的 {{tools}} 按函数签名/docstring 生成，只放与本轮用户这句话相关的工具（BM25 top-k），追加在消息末尾；
+# 支持 function calling 的上游（native_tools）改走 tools 参数
+_REGISTRY = ToolRegistry(function_map)
+
+# ================== 多步 ReAct ==================
+# 工具结果作为“观察结果”注入对话再问模型，直到 action 为 null；REACT_MAX_STEPS / REACT_TIME_BUDGET 限制步数与总时长
+_LOOP = LoopStats()
+
+# ================== 分阶段追踪 ==================
+# 每个请求一条 trace（客户端带 x-request-id / traceparent 时沿用），排队/首字/生成/解析/工具各记一个 span，写入 TRACE_FILE
+tracing.set_service("llm-backend")
+
+# ================== Prometheus 指标 ==================
+# 请求路径上只更新下面几个计数器/直方图；其它模块已有的计数在抓取 /metrics 时才读取
+_M_REQUESTS = REGISTRY.counter("llm_requests", "接口请求数", ("endpoint", "status"))
+_M_REQUEST_TIME = REGISTRY.histogram("llm_request_seconds", "接口总耗时（流式为整条流）", ("endpoint",))
+_M_IN_FLIGHT = REGISTRY.gauge("llm_requests_in_flight", "正在处理的接口请求", ("endpoint",))
+_M_TTFB = REGISTRY.histogram("llm_upstream_ttfb_seconds", "上游流式首个增量的到达时间", ("upstream",))
+_M_UPSTREAM_TIME = REGISTRY.histogram("llm_upstream_request_seconds", "上游调用总耗时", ("upstream", "mode"))
+_M_TOKENS = REGISTRY.counter("llm_tokens", "上游报告的 token 数（prompt 含 cached）", ("upstream", "kind"))
+_M_TOOL_TIME = REGISTRY.histogram("llm_tool_duration_seconds", "工具执行耗时（含等待并发名额）", ("tool",))
+REGISTRY.collect("counter", "llm_idempotency_lookups", "幂等缓存查询", ("result",),
+                 lambda: [(("hit",), _IDEM.hits), (("miss",), _IDEM.misses)])
+REGISTRY.collect("gauge", "llm_idempotency_hit_ratio", "幂等缓存命中率", (),
+                 lambda: [((), _IDEM.hits / max(_IDEM.hits + _IDEM.misses, 1))])
+REGISTRY.collect("counter", "llm_output_parse", "LLM 输出解析结果：json / repaired / failed", ("schema", "outcome"),
+                 lambda: [((schema, k), v) for schema, c in _PARSE.counts().items() for k, v in c.items()])
+REGISTRY.collect("counter", "llm_tool_calls", "工具调用结果：calls 为总次数，其余为 ok/error/timeout/busy", ("tool", "result"),
+                 lambda: [((tool, k), v) for tool, c in _tools().counts().items() for k, v in c.items()])
+REGISTRY.collect("gauge", "llm_upstream_in_flight", "各上游的在途请求", ("upstream",),
+                 lambda: [((u.name,), u.inflight) for u in _UPSTREAMS.upstreams])
+REGISTRY.collect("gauge", "llm_http_in_flight", "共享 httpx client 上的在途请求", (),
+                 lambda: [((), _HTTP_STATS["in_flight"])])
+REGISTRY.collect("gauge", "llm_scheduler_slots", "调度槽位：active 为占用中，queued 为排队中", ("state",),
+                 lambda: [] if _SCHED is None else [(("active",), _SCHED.active), (("queued",), _SCHED.stats()["queued"])])
+
+def _usage_tokens(data: Dict[str, Any]) -> Tuple[int, int, int]:
+    """上游响应里的 (prompt, completion, cached) token 数；llama.cpp 的 timings 优先，其次 OpenAI usage、旧 /completion 字段"""
+    timings = data.get("timings") or {}
+    if "prompt_n" in timings:
+        cached = int(timings.get("cache_n") or 0)
+        return int(timings.get("prompt_n") or 0) + cached, int(timings.get("predicted_n") or 0), cached
+    usage = data.get("usage") or {}
+    if usage:
+        cached = int(usage.get("prompt_cache_hit_tokens")
+                     or (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+        return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0), cached
+    if "tokens_evaluated" in data:
+        return (int(data.get("tokens_evaluated") or 0), int(data.get("tokens_predicted") or 0),
+                int(data.get("tokens_cached") or 0))
+    return 0, 0, 0
+
+def _observe_response(data: Dict[str, Any], up: Upstream) -> None:
+    """前缀缓存统计 + token 计数"""
+    _PREFIX.observe_response(data)
+    prompt, completion, cached = _usage_tokens(data)
+    if prompt or completion:
+        _M_TOKENS.inc(up.name, "prompt", amount=prompt)
+        _M_TOKENS.inc(up.name, "completion", amount=completion)
+        _M_TOKENS.inc(up.name, "cached", amount=cached)
+
+@contextmanager
+def _observe_request(endpoint: str) -> Iterator[None]:
+    """在途数、请求数（按状态）与总耗时"""
+    _M_IN_FLIGHT.inc(endpoint)
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    except HTTPException as e:
+        status = str(e.status_code)
+        raise
+    except (GeneratorExit, asyncio.CancelledError):
+        status = "cancelled"   # 客户端断开
+        raise
+    finally:
+        _M_IN_FLIGHT.dec(endpoint)
+        _M_REQUESTS.inc(endpoint, status)
+        _M_REQUEST_TIME.observe(time.perf_counter() - t0, endpoint)
 
 # ================== Pydantic ==================
 class Msg(BaseModel):
@@ -57,20 +273,60 @@ class ChatReq(BaseModel):
     session_id: Optional[str] = None
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 512
+    speculative: Optional[bool] = Field(None, description="是否投机派发工具；None 取 SPECULATIVE_TOOLS")
+    response_cache: Optional[bool] = Field(None, description="是否使用响应缓存；None 取 RESPONSE_CACHE")
+    fastpath: Optional[bool] = Field(None, description="是否启用本地意图快速路由；None 取 INTENT_FASTPATH")
+    priority: Optional[str] = Field(None, description=f"调度优先级：{' / '.join(PRIORITIES)}；None 为 interactive")
+    response_schema: Optional[Literal["react", "cot_step", "none"]] = Field(
+        None, description="输出约束：react（默认，主对话 JSON-ReAct）/ cot_step（CoT 助手单步）/ none；"
+                          "非 react 时 /llm 原样返回模型输出，不执行工具")
+    max_steps: Optional[int] = Field(None, ge=1, description="多步 ReAct 的最大步数；None 取 REACT_MAX_STEPS，1 为单步")
 
 class ChatResp(BaseModel):
     text: str
     model: str
     cached: bool = False
+    tool: Optional[Dict[str, Any]] = Field(None, description="最后一个工具执行结果：name/ok/result/error/timed_out/elapsed_ms")
+    steps: Optional[List[Dict[str, Any]]] = Field(None, description="每步的 actions/ok/llm_ms/tool_ms/wait_ms/tools")
+    stop_reason: Optional[str] = Field(None, description="多步停止原因：done/max_steps/time_budget/error")
 
 # ================== FastAPI ==================
-app = FastAPI(title="LLM Module (local/cloud switch)", version="0.4.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _HTTP, _TOOLS, _PROBE_TASK, _IDEM_SWEEP_TASK
+    _HTTP = _make_http_client()
+    _TOOLS = ToolExecutor(function_map)
+    if len(_UPSTREAMS.upstreams) > 1:
+        # 只有一个上游时探测没有意义（无处可切），不额外打请求
+        _PROBE_TASK = asyncio.create_task(_UPSTREAMS.probe_loop(_http))
+    if _IDEM.sweep_interval > 0:
+        _IDEM_SWEEP_TASK = asyncio.create_task(_IDEM.sweep_loop())
+    try:
+        yield
+    finally:
+        for task in (_PROBE_TASK, _IDEM_SWEEP_TASK):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        _PROBE_TASK = _IDEM_SWEEP_TASK = None
+        await _HTTP.aclose()
+        _HTTP = None
+        _TOOLS.shutdown()
+        _TOOLS = None
+        _IDEM.close()
+
+app = FastAPI(title="LLM Module (local/cloud switch)", version="0.4.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
 )
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式的指标"""
+    return Response(content=REGISTRY.exposition(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.get("/health")
 async def health():
     return {
@@ -80,143 +336,786 @@ async def health():
         "llama_model": LLAMA_MODEL,
         "legacy_fallback": USE_LEGACY_FALLBACK if USE_LOCAL_MODEL else False,
         "api_key_present": bool(LLM_API_KEY) if not USE_LOCAL_MODEL else None,
+        "pool": _pool_stats(),
+        "tools": _tools().stats(),
+        "idempotency": _IDEM.stats(),
+        "singleflight": _FLIGHTS.stats() if SINGLEFLIGHT else None,
+        "response_cache": _RESP_CACHE.stats() if RESPONSE_CACHE else None,
+        "intent_fastpath": _INTENTS.stats() if INTENT_FASTPATH else None,
+        "prefix_cache": _PREFIX.stats(),
+        "upstreams": _UPSTREAMS.stats(),
+        "scheduler": _SCHED.stats() if _SCHED is not None else None,
+        "output_parse": _PARSE.stats(),
+        "tool_prompt": _REGISTRY.stats(),
+        "react": _LOOP.stats(),
+        "tracing": tracing.stats(),
     }
 
 # ================== 调用适配 ==================
-async def _chat_via_openai_compat(req: ChatReq) -> Tuple[str, str]:
-    """
-    兼容：本地 llama.cpp 或云端 DeepSeek 的 /v1/chat/completions
-    """
-    url = f"{LLAMA_BASE.rstrip('/')}/chat/completions" if LLAMA_BASE.endswith("/v1") else f"{LLAMA_BASE.rstrip('/')}/v1/chat/completions"
-    payload = {
-        "model": LLAMA_MODEL,
-        "messages": [m.model_dump() for m in req.messages],
+def _tool_names(req: ChatReq) -> List[str]:
+    """本轮相关的工具；上一轮 assistant 在追问时，把追问也算进检索（用户可能只回答了“明天下午三点”）"""
+    _, last_user, last_assistant = _dialog_parts(req)
+    context = last_assistant if last_assistant.rstrip().endswith(("?", "？")) else ""
+    return _REGISTRY.select(last_user, context)
+
+def _use_native_tools(req: ChatReq, up: Upstream, legacy: bool = False) -> bool:
+    return up.native_tools and not legacy and _schema_name(req) == SCHEMA_REACT
+
+def _prepared_messages(req: ChatReq, up: Upstream, observe: bool = True,
+                       legacy: bool = False) -> List[Dict[str, str]]:
+    """保证 system prompt 前缀稳定（日期挪到末尾、本轮工具说明追加在末尾），并记录本轮的前缀复用情况"""
+    messages = stabilize_messages([m.model_dump() for m in req.messages])
+    if _schema_name(req) == SCHEMA_REACT:
+        native = _use_native_tools(req, up, legacy)
+        messages = expand_tools(messages, None if native else _REGISTRY.section(_tool_names(req)))
+    if observe:
+        slot = slot_for(req.session_id, up.slots) if up.local else None
+        key = f"slot:{slot}" if slot is not None else f"session:{req.session_id}"
+        _PREFIX.observe_request(f"{up.name}/{key}", messages)
+    return messages
+
+def _schema_name(req: ChatReq) -> str:
+    return req.response_schema or SCHEMA_REACT
+
+def _openai_request(req: ChatReq, up: Upstream, stream: bool) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    payload: Dict[str, Any] = {
+        "model": up.model,
+        "messages": _prepared_messages(req, up),
         "temperature": req.temperature or 0.7,
         "max_tokens": req.max_tokens or 512,
-        "stream": False,
+        "stream": stream,
     }
-    headers = {"Content-Type": "application/json"}
-    if not USE_LOCAL_MODEL:
-        headers["Authorization"] = f"{LLM_AUTH_SCHEME} {LLM_API_KEY}"
-
-    async with httpx.AsyncClient(timeout=LLAMA_TIMEOUT) as client:
-        r = await client.post(url, json=payload, headers=headers)
-        if r.status_code == 404 and USE_LOCAL_MODEL:
-            raise FileNotFoundError("/v1/chat/completions not found (local)")
-        if r.status_code in (401, 403):
-            raise PermissionError(f"auth failed: {r.status_code} {r.text}")
-        r.raise_for_status()
-        data = r.json()
-        text = (data.get("choices", [{}])[0].get("message", {}).get("content") or "").strip()
-        used_model = data.get("model", LLAMA_MODEL)
-        return text, used_model
-
-def _to_legacy_prompt(messages: List[Msg]) -> str:
-    sys = next((m.content for m in messages if m.role == "system"), "")
+    if _use_native_tools(req, up):
+        # 与 response_format 约束互斥：动作由 tool_calls 给出，content 只是回答
+        payload["tools"] = _REGISTRY.openai_tools(_tool_names(req))
+        payload["tool_choice"] = "auto"
+    else:
+        fmt = response_format(_schema_name(req), _SCHEMAS.get(_schema_name(req)), up.output_format, strict=up.local)
+        if fmt is not None:
+            payload["response_format"] = fmt
+    if up.local:
+        # llama.cpp 扩展参数：复用上一轮的 KV；同一会话固定槽位
+        payload["cache_prompt"] = True
+        slot = slot_for(req.session_id, up.slots)
+        if slot is not None:
+            payload["id_slot"] = slot
+    elif stream:
+        payload["stream_options"] = {"include_usage": True}
+    return payload, up.headers()
+
+def _check_openai_status(r: httpx.Response, up: Upstream, body: str = "") -> None:
+    if r.status_code == 404 and up.local:
+        raise FileNotFoundError("/v1/chat/completions not found (local)")
+    if r.status_code in (401, 403):
+        raise PermissionError(f"auth failed: {r.status_code} {body}")
+    r.raise_for_status()
+
+async def _chat_via_openai_compat(req: ChatReq, up: Upstream) -> Tuple[str, str]:
+    """
+    兼容：本地 llama.cpp 或云端 DeepSeek 的 /v1/chat/completions
+    """
+    payload, headers = _openai_request(req, up, stream=False)
+    r = await _post(up.chat_url, json=payload, headers=headers)
+    _check_openai_status(r, up, r.text)
+    data = r.json()
+    _observe_response(data, up)
+    message = data.get("choices", [{}])[0].get("message", {})
+    if _use_native_tools(req, up):
+        text = react_from_message(message)
+    else:
+        text = (message.get("content") or "").strip()
+    used_model = data.get("model", up.model)
+    return text, used_model
+
+def _to_legacy_prompt(messages: List[Dict[str, str]]) -> str:
     parts = []
-    if sys: parts.append(f"System: {sys}")
     for m in messages:
-        if m.role == "user":
-            parts.append(f"User: {m.content}")
-        elif m.role == "assistant":
-            parts.append(f"Assistant: {m.content}")
+        if m["role"] == "system":
+            parts.append(f"System: {m['content']}")
+        elif m["role"] == "user":
+            parts.append(f"User: {m['content']}")
+        elif m["role"] == "assistant":
+            parts.append(f"Assistant: {m['content']}")
     parts.append("Assistant:")
     return "\n".join(parts)
 
-async def _chat_via_legacy_completion(req: ChatReq) -> Tuple[str, str]:
-    """
-    llama.cpp 旧接口 /completion
-    """
-    url = f"{LLAMA_BASE.rstrip('/')}/completion"
-    payload = {
-        "prompt": _to_legacy_prompt(req.messages),
+def _legacy_payload(req: ChatReq, up: Upstream, stream: bool, observe: bool) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        # 404 回退的那一次，前缀统计已在 /v1/chat/completions 那边记过，observe=False
+        "prompt": _to_legacy_prompt(_prepared_messages(req, up, observe=observe, legacy=True)),
         "n_predict": req.max_tokens or 512,
         "temperature": req.temperature or 0.7,
         "cache_prompt": True,
+        "stream": stream,
     }
-    async with httpx.AsyncClient(timeout=LLAMA_TIMEOUT) as client:
-        r = await client.post(url, json=payload)
-        r.raise_for_status()
-        data = r.json()
-        text = data.get("content") or data.get("generated_text") or data.get("text") or ""
-        if isinstance(text, list):
-            text = "".join(text)
-        return (text or "").strip(), "llama.cpp:completion"
+    schema = _SCHEMAS.get(_schema_name(req))
+    if schema is not None and up.output_format == FORMAT_JSON_SCHEMA:
+        payload["json_schema"] = schema
+    slot = slot_for(req.session_id, up.slots)
+    if slot is not None:
+        payload["id_slot"] = slot
+    return payload
 
-async def _chat_via_llama(req: ChatReq) -> Tuple[str, str]:
+async def _chat_via_legacy_completion(req: ChatReq, up: Upstream, observe: bool = True) -> Tuple[str, str]:
     """
-    统一入口：
+    llama.cpp 旧接口 /completion
+    """
+    r = await _post(up.completion_url, json=_legacy_payload(req, up, stream=False, observe=observe))
+    r.raise_for_status()
+    data = r.json()
+    _observe_response(data, up)
+    text = data.get("content") or data.get("generated_text") or data.get("text") or ""
+    if isinstance(text, list):
+        text = "".join(text)
+    return (text or "").strip(), "llama.cpp:completion"
+
+async def _chat_on(req: ChatReq, up: Upstream) -> Tuple[str, str]:
+    """
+    单个上游：
     - 云端：DeepSeek /v1/chat/completions
-    - 本地：llama.cpp /v1/chat/completions；如 404 且允许回退，则 /completion
+    - 本地：llama.cpp /v1/chat/completions；如 404 且允许回退，则 /completion（之后该上游直接走旧接口）
     """
+    if up.legacy_only:
+        return await _chat_via_legacy_completion(req, up)
     try:
-        return await _chat_via_openai_compat(req)
+        return await _chat_via_openai_compat(req, up)
     except FileNotFoundError:
-        if USE_LOCAL_MODEL and USE_LEGACY_FALLBACK:
-            return await _chat_via_legacy_completion(req)
+        if not (up.local and USE_LEGACY_FALLBACK):
+            raise
+        up.legacy_only = True
+        return await _chat_via_legacy_completion(req, up, observe=False)
+
+async def _chat_tracked(req: ChatReq, up: Upstream) -> Tuple[str, str]:
+    """
+    本地上游先占调度槽位；计入上游的在途数、整次延迟 EWMA（不含排队）和熔断计数；
+    对冲落败被取消的、本地队列满（QueueFull）的不算失败
+    """
+    async with _admission(req, up):
+        t0 = time.perf_counter()
+        with _UPSTREAMS.track(up), tracing.span("llm.upstream", upstream=up.name):
+            try:
+                result = await _chat_on(req, up)
+            except Exception as e:
+                up.record_failure(e)
+                raise
+    elapsed = time.perf_counter() - t0
+    up.record_success(elapsed * 1000, kind="total")
+    _M_UPSTREAM_TIME.observe(elapsed, up.name, "unary")
+    return result
+
+async def _chat_via_llama(req: ChatReq) -> Tuple[str, str]:
+    """
+    统一入口：按整次延迟评分挑一个上游；超过 hedge_delay 还没返回就向另一个上游再发一份，取先成功的；
+    上游报错时换下一个可用上游重试。
+    """
+    tried: Set[str] = set()
+    hedged: Set[str] = set()
+    pending: Dict[asyncio.Task, Upstream] = {}
+    last_err: Optional[BaseException] = None
+
+    def launch() -> Upstream:
+        up = _UPSTREAMS.pick(req.session_id, exclude=tried, kind="total")
+        tried.add(up.name)
+        pending[asyncio.create_task(_chat_tracked(req, up))] = up
+        return up
+
+    hedge = _UPSTREAMS.hedge_delay(launch(), kind="total")
+    try:
+        while pending:
+            can_hedge = hedge is not None and len(pending) == 1 and _UPSTREAMS.alternatives(tried) > 0
+            done, _ = await asyncio.wait(set(pending), timeout=hedge if can_hedge else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged.add(launch().name)
+                _UPSTREAMS.hedges += 1
+                hedge = None
+                continue
+            for t in done:
+                up = pending.pop(t)
+                if t.exception() is None:
+                    if up.name in hedged:
+                        up.hedges_won += 1
+                    return t.result()
+                last_err = t.exception()
+                print(f"[upstream] {up.name} 失败: {type(last_err).__name__}: {last_err}")
+            if not pending and _UPSTREAMS.alternatives(tried) > 0:
+                launch()
+        raise last_err or NoUpstreamAvailable("没有可用的上游")
+    finally:
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+# ================== 流式调用适配 ==================
+async def _sse_data(r: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    """逐行读取上游 SSE，产出每个 data: 的 JSON 负载"""
+    async for line in r.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
+            continue
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            continue
+
+async def _stream_via_openai_compat(req: ChatReq, up: Upstream) -> AsyncIterator[Tuple[str, str]]:
+    """/v1/chat/completions stream=True；产出 (文本增量, 模型名)"""
+    payload, headers = _openai_request(req, up, stream=True)
+    native = NativeReActStream() if _use_native_tools(req, up) else None
+    _HTTP_STATS["requests"] += 1
+    _HTTP_STATS["in_flight"] += 1
+    try:
+        async with _http().stream("POST", up.chat_url, json=payload, headers=headers) as r:
+            if r.status_code >= 400:
+                body = (await r.aread()).decode("utf-8", "replace")
+                _check_openai_status(r, up, body)
+            async for chunk in _sse_data(r):
+                if chunk.get("timings") or chunk.get("usage"):
+                    _observe_response(chunk, up)
+                piece = (chunk.get("choices") or [{}])[0].get("delta", {})
+                delta = native.feed(piece) if native is not None else piece.get("content")
+                if delta:
+                    yield delta, chunk.get("model", up.model)
+            tail = native.finish() if native is not None else ""
+            if tail:
+                yield tail, up.model
+    except Exception:
+        _HTTP_STATS["errors"] += 1
         raise
+    finally:
+        _HTTP_STATS["in_flight"] -= 1
 
-# ================== HTTP 接口 ==================
-@app.post("/llm", response_model=ChatResp)
-async def llm_endpoint(req: ChatReq, x_idempotency_key: Optional[str] = Header(None)):
-    # 幂等缓存
-    if x_idempotency_key:
-        _gc_idem()
-        cached = _IDEM.get(x_idempotency_key)
-        if cached:
-            return ChatResp(text=cached[1]["text"], model=cached[1]["model"], cached=True)
+async def _stream_via_legacy_completion(req: ChatReq, up: Upstream,
+                                        observe: bool = True) -> AsyncIterator[Tuple[str, str]]:
+    """llama.cpp /completion stream=True"""
+    payload = _legacy_payload(req, up, stream=True, observe=observe)
+    _HTTP_STATS["requests"] += 1
+    _HTTP_STATS["in_flight"] += 1
+    try:
+        async with _http().stream("POST", up.completion_url, json=payload) as r:
+            r.raise_for_status()
+            async for chunk in _sse_data(r):
+                if chunk.get("stop"):
+                    _observe_response(chunk, up)
+                delta = chunk.get("content")
+                if delta:
+                    yield delta, "llama.cpp:completion"
+    except Exception:
+        _HTTP_STATS["errors"] += 1
+        raise
+    finally:
+        _HTTP_STATS["in_flight"] -= 1
 
+async def _stream_on(req: ChatReq, up: Upstream) -> AsyncIterator[Tuple[str, str]]:
+    """
+    单个上游的流式调用；404 在产出任何 token 之前抛出，因此可以安全回退。
+    本地上游先占调度槽位（整个流期间占用），首个增量的到达时间（不含排队）计入首字节 EWMA
+    """
+    first = True
+
+    async def attempt() -> AsyncIterator[Tuple[str, str]]:
+        if up.legacy_only:
+            async for item in _stream_via_legacy_completion(req, up):
+                yield item
+            return
+        try:
+            async for item in _stream_via_openai_compat(req, up):
+                yield item
+        except FileNotFoundError:
+            if not (up.local and USE_LEGACY_FALLBACK):
+                raise
+            up.legacy_only = True
+            async for item in _stream_via_legacy_completion(req, up, observe=False):
+                yield item
+
+    t_first: Optional[float] = None
+    async with _admission(req, up):
+        t0 = time.perf_counter()
+        with _UPSTREAMS.track(up):
+            try:
+                async for item in attempt():
+                    if first:
+                        up.record_success((time.perf_counter() - t0) * 1000, kind="ttfb")
+                        first = False
+                        t_first = time.perf_counter()
+                        tracing.record("llm.ttfb", t0, t_first, upstream=up.name)
+                        _M_TTFB.observe(t_first - t0, up.name)
+                    yield item
+            except Exception as e:
+                up.record_failure(e)
+                raise
+            finally:
+                # 对冲落败被关掉的一路没有首字，不记 generation
+                if t_first is not None:
+                    tracing.record("llm.generation", t_first, upstream=up.name)
+                    _M_UPSTREAM_TIME.observe(time.perf_counter() - t0, up.name, "stream")
+
+async def _next_item(it: AsyncIterator[Tuple[str, str]]) -> Optional[Tuple[str, str]]:
+    try:
+        return await it.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def _stream_via_llama(req: ChatReq) -> AsyncIterator[Tuple[str, str]]:
+    """
+    流式统一入口：首个增量超过 hedge_delay 还没到，就向另一个上游再开一路，谁先出首字用谁，另一路关闭；
+    首字之前出错换上游重试。首字之后出错直接抛出（已经推给客户端的内容撤不回来）。
+    """
+    tried: Set[str] = set()
+    hedged: Set[str] = set()
+    pending: Dict[asyncio.Task, Tuple[Upstream, AsyncIterator[Tuple[str, str]]]] = {}
+    last_err: Optional[BaseException] = None
+
+    def launch() -> Upstream:
+        up = _UPSTREAMS.pick(req.session_id, exclude=tried)
+        tried.add(up.name)
+        it = _stream_on(req, up)
+        pending[asyncio.create_task(_next_item(it))] = (up, it)
+        return up
+
+    async def close_pending() -> None:
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for _, it in pending.values():
+            await it.aclose()
+        pending.clear()
+
+    hedge = _UPSTREAMS.hedge_delay(launch())
+    winner: Optional[AsyncIterator[Tuple[str, str]]] = None
+    first: Optional[Tuple[str, str]] = None
+    try:
+        while pending and winner is None:
+            can_hedge = hedge is not None and len(pending) == 1 and _UPSTREAMS.alternatives(tried) > 0
+            done, _ = await asyncio.wait(set(pending), timeout=hedge if can_hedge else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged.add(launch().name)
+                _UPSTREAMS.hedges += 1
+                hedge = None
+                continue
+            for t in done:
+                up, it = pending.pop(t)
+                if winner is None and t.exception() is None:
+                    winner, first = it, t.result()
+                    if up.name in hedged:
+                        up.hedges_won += 1
+                elif t.exception() is not None:
+                    last_err = t.exception()
+                    print(f"[upstream] {up.name} 失败: {type(last_err).__name__}: {last_err}")
+                else:
+                    await it.aclose()
+            if winner is None and not pending and _UPSTREAMS.alternatives(tried) > 0:
+                launch()
+        await close_pending()
+        if winner is None:
+            raise last_err or NoUpstreamAvailable("没有可用的上游")
+        if first is not None:
+            yield first
+            async for item in winner:
+                yield item
+    finally:
+        if pending:
+            await close_pending()
+        if winner is not None:
+            await winner.aclose()
+
+# ================== JSON-ReAct 解析 / 工具调用 ==================
+def _parse_react(text: str, schema_name: str = SCHEMA_REACT) -> Dict[str, Any]:
+    # JSON-ReAct 解析：标准 JSON 直接 json.loads；否则一遍容错扫描（代码块、尾逗号、单引号、截断等）
+    with tracing.span("llm.parse") as sp:
+        try:
+            data, repaired = loads_object(text)
+            outcome = "repaired" if repaired else "json"
+            if repaired:
+                print("警告：LLM 输出不是标准 JSON，已按容错规则修复")
+        except JSONRepairError as e:
+            print(f"错误：无法从 LLM 输出中解析出 JSON 对象: {e}")
+            data, outcome = {}, "failed"
+        if not data:
+            outcome = "failed"
+        sp.set(outcome=outcome)
+    _PARSE.record(schema_name, outcome)
+    return data
+
+async def _run_tool(action: Dict[str, Any]) -> Dict[str, Any]:
+    with tracing.span("tool", tool=action.get("name")) as sp:
+        result = await _tools().run(action)
+        sp.set(ok=result.get("ok"), timed_out=result.get("timed_out"))
+        _M_TOOL_TIME.observe((result.get("elapsed_ms") or 0.0) / 1000, str(action.get("name")))
+        return result
+
+async def _run_action(action: Any) -> Optional[Dict[str, Any]]:
+    """工具调用：在有界线程池里执行，返回（最后一个）执行结果；无 action 时返回 None"""
+    if isinstance(action, dict) and action:
+        return await _run_tool(action)
+    results = await _run_actions(action)
+    return results[-1] if results else None
+
+async def _run_actions(action: Any) -> List[Dict[str, Any]]:
+    """action 为对象或列表：按 after 依赖执行、无依赖的并发，按原顺序返回结果；无 action 时返回 []"""
+    steps = plan(action)
+    return await run_plan(steps, _run_tool) if steps else []
+
+def _dispatch_action(action: Any) -> Optional[asyncio.Task]:
+    """后台启动工具，不等待结果；无 action 时返回 None"""
+    if action_list(action):
+        return asyncio.create_task(_run_actions(action))
+    return None
+
+async def _chat_speculative(req: ChatReq, dispatched: List[asyncio.Task]
+                            ) -> Tuple[str, str, Dict[str, Any], Optional[asyncio.Task]]:
+    """
+    流式读取上游，action 一闭合就派发工具，模型同时继续写 answer。
+    返回 (完整文本, 模型名, 解析结果, 工具任务)；调用方负责 await 工具任务。
+    工具任务一派发就放进 dispatched：上游出错、或超时被取消（CancelledError）时这里来不及返回，
+    调用方从 dispatched 里拿到任务等它跑完，结果不会丢。
+    """
+    parser = ReActStreamParser(stream_fields=())
+    parts: List[str] = []
+    model_used = LLAMA_MODEL
+    task: Optional[asyncio.Task] = None
+    async for delta, model_used in _stream_via_llama(req):
+        parts.append(delta)
+        for kind, payload in parser.feed(delta):
+            if kind == "action":
+                task = _dispatch_action(payload)
+                if task is not None:
+                    dispatched.append(task)
+    text = "".join(parts).strip()
+    if parser.done:
+        data = parser.fields
+        _PARSE.record(SCHEMA_REACT, "json")
+    else:
+        data = _parse_react(text)
+    if task is None and not parser.action_emitted:
+        # 流里没能提前拿到 action（如输出不是规范 JSON），按整段解析结果派发
+        task = _dispatch_action(data.get("action", {}))
+    return text, model_used, data, task
+
+@asynccontextmanager
+async def _admission(req: ChatReq, up: Upstream) -> AsyncIterator[None]:
+    """调本地上游前占一个槽位；云端上游、未启用调度时直接放行"""
+    if _SCHED is None or not up.local:
+        yield
+        return
+    t0 = time.perf_counter()
+    async with _SCHED.slot(req.session_id, req.priority):
+        tracing.record("llm.queue", t0, priority=req.priority or "interactive")
+        yield
+
+def _use_speculative(req: ChatReq) -> bool:
+    return SPECULATIVE_TOOLS if req.speculative is None else req.speculative
+
+def _use_response_cache(req: ChatReq) -> bool:
+    return RESPONSE_CACHE if req.response_cache is None else req.response_cache
+
+def _match_intent(req: ChatReq) -> Optional[IntentMatch]:
+    """在请求 LLM 之前尝试本地意图路由；用户在回答上一轮提问时不走快速路由"""
+    if not (INTENT_FASTPATH if req.fastpath is None else req.fastpath):
+        return None
+    _, last_user, last_assistant = _dialog_parts(req)
+    if last_assistant.rstrip().endswith(("?", "？")):
+        return None
+    return _INTENTS.match(last_user)
+
+def _dialog_parts(req: ChatReq) -> Tuple[str, str, str]:
+    """(system prompt, 最后一句 user, 最后一句 user 之前的 assistant)"""
+    system = next((m.content for m in req.messages if m.role == "system"), "")
+    last_user, last_assistant = "", ""
+    for i in range(len(req.messages) - 1, -1, -1):
+        if req.messages[i].role == "user":
+            last_user = req.messages[i].content
+            last_assistant = next((m.content for m in reversed(req.messages[:i]) if m.role == "assistant"), "")
+            break
+    return system, last_user, last_assistant
+
+# ================== HTTP 接口 ==================
+async def _llm_compute_raw(req: ChatReq) -> Dict[str, Any]:
+    """CoT 单步等非对话请求：只做（受约束的）生成，原样返回文本，不走缓存/快速路由/工具"""
+    schema_name = _schema_name(req)
     try:
         text, model_used = await _chat_via_llama(req)
+    except QueueFull:
+        raise
+    except Exception as e:
+        return {"text": f"[LLM 调用失败] {type(e).__name__}: {e}", "model": "error", "tool": None, "cached": False}
+    if schema_name != SCHEMA_NONE:
+        try:
+            _, repaired = loads_object(text)
+            _PARSE.record(schema_name, "repaired" if repaired else "json")
+        except JSONRepairError:
+            _PARSE.record(schema_name, "failed")
+    return {"text": text, "model": model_used, "tool": None, "cached": False}
+
+async def _llm_compute(req: ChatReq) -> Dict[str, Any]:
+    """/llm 的实际处理：响应缓存 -> 意图快速路由 -> 多步 LLM + 工具；返回 text/model/tool/cached（+steps/stop_reason）"""
+    if _schema_name(req) != SCHEMA_REACT:
+        return await _llm_compute_raw(req)
+    use_cache = _use_response_cache(req)
+    if use_cache:
+        system, last_user, last_assistant = _dialog_parts(req)
+        hit = _RESP_CACHE.lookup(system, last_user, last_assistant)
+        if hit:
+            entry, score = hit
+            print(f"[cache] hit score={score} action={entry.action}")
+            return {"text": entry.answer, "model": entry.model, "tool": await _run_action(entry.action), "cached": True}
+
+    intent = _match_intent(req)
+    if intent is not None:
+        print(f"[fastpath] {intent.intent} conf={intent.confidence:.2f} action={intent.action}")
+        return {"text": intent.answer, "model": FASTPATH_MODEL, "tool": await _run_action(intent.action), "cached": False}
+
+    out = await _react_loop(req)
+    action, cacheable = out.pop("action"), out.pop("cacheable")
+    if use_cache and cacheable:
+        _RESP_CACHE.store(system, last_user, action, out["text"], out["model"])
+    return out
+
+async def _react_step(req: ChatReq, timeout: Optional[float]
+                      ) -> Tuple[str, str, Dict[str, Any], List[Dict[str, Any]], float, float]:
+    """
+    一步：LLM（占调度槽位，可限时）+ 工具（不占槽位）。
+    返回 (模型原文, 模型名, 解析结果, 工具结果列表, LLM 耗时, LLM 结束后等工具的耗时)；
+    超时抛 StepTimeout（超时前已投机派发的工具跑完后，结果带在异常里）
+    """
+    data: Optional[Dict[str, Any]] = None
+    task: Optional[asyncio.Task] = None
+    speculative = _use_speculative(req)
+    dispatched: List[asyncio.Task] = []
+
+    async def call() -> Tuple[str, str, Optional[Dict[str, Any]], Optional[asyncio.Task]]:
+        if speculative:
+            return await _chat_speculative(req, dispatched)
+        text, model_used = await _chat_via_llama(req)
+        return text, model_used, None, None
+
+    t0 = time.perf_counter()
+    try:
+        text, model_used, data, task = await asyncio.wait_for(call(), timeout)
         # if not text.endswith("\"}"):
         #     text = text + "\"}"
+    except QueueFull:
+        raise
+    except asyncio.TimeoutError:
+        # wait_for 取消了 LLM 调用，但已派发的工具任务不随之取消：等它跑完，结果交给循环记入这一步
+        t1 = time.perf_counter()
+        results = await dispatched[-1] if dispatched else []
+        raise StepTimeout(results, t1 - t0, time.perf_counter() - t1)
     except Exception as e:
         text = f"[LLM 调用失败] {type(e).__name__}: {e}"
         model_used = "error"
+        task = dispatched[-1] if dispatched else None
+    t1 = time.perf_counter()
 
-    # JSON-ReAct 解析（可选：模型若输出普通文本，这里会走 except）
-    try:
-        data = json.loads(text)
-    except json.JSONDecodeError:
-        print("警告：LLM 输出不是标准 JSON，尝试使用 ast.literal_eval 进行修复...")
+    if data is None:
+        data = _parse_react(text)
+    if task is not None:
+        results = await task
+    elif not speculative and model_used != "error":
+        results = await _run_actions(data.get("action"))
+    else:
+        results = []
+    return text, model_used, data, results, t1 - t0, time.perf_counter() - t1
+
+async def _react_loop(req: ChatReq) -> Dict[str, Any]:
+    """
+    多步 ReAct：执行工具 -> 注入观察结果 -> 再问模型，直到 action 为 null 或步数/时长用完。
+    返回 text/model/tool/steps/stop_reason/cached，外加给响应缓存用的 action/cacheable
+    """
+    budget = Budget(req.max_steps)
+    steps: List[Dict[str, Any]] = []
+    cur = req
+    text, model_used, answer, first_action = "", LLAMA_MODEL, "好的", None
+    last_tool: Optional[Dict[str, Any]] = None
+    stop = STOP_DONE
+    for i in range(budget.max_steps):
         try:
-            # ast.literal_eval 可以安全地解析 Python 字面量 (如字典、列表)
-            # 这是一个非常好的后备方案
-            data = ast.literal_eval(text)
-            if not isinstance(data, dict):
-                print(f"修复失败：ast.literal_eval 解析结果不是字典，而是 {type(data).__name__}。")
-                data = {} # 如果解析出来不是字典，也当作失败
-        except (ValueError, SyntaxError) as e:
-            # 如果两种方法都失败了，打印错误并继续
-            print(f"错误：无法将 LLM 输出解析为 JSON 或 Python 字面量: {e}")
-            data = {}
-    except Exception as e:
-        print(f"解析 LLM 输出时发生未知错误: {e}")
-        data = {}
+            with tracing.span("react.step", step=i + 1):
+                text, model_used, data, results, llm_s, wait_s = await _react_step(cur, budget.timeout_for(i))
+        except StepTimeout as e:
+            if e.results:
+                steps.append(step_record(i, e.llm_s, e.tool_wait_s, e.results))
+                last_tool = e.results[-1]
+            stop = STOP_TIME_BUDGET
+            break
+        thought = data.get("thought", "")
+        action = data.get("action", {})
+        answer = data.get("answer", text or "好的")
+        print(f"[step {i + 1}] {thought=}, {action=}, {answer=}")
+        if i == 0:
+            first_action = action
+        steps.append(step_record(i, llm_s, wait_s, results))
+        if results:
+            last_tool = results[-1]
+        if model_used == "error":
+            stop = STOP_ERROR
+            break
+        stop = budget.stop_after(i, results)
+        if stop is not None:
+            break
+        extra = [Msg(**m) for m in observation_messages(text, results)]
+        cur = cur.model_copy(update={"messages": list(cur.messages) + extra})
+    _LOOP.record(steps, stop)
+    return {
+        "text": answer, "model": model_used, "tool": last_tool, "steps": steps, "stop_reason": stop,
+        "cached": False, "action": first_action,
+        # 只有一步的才进响应缓存（多步的最终回答依赖观察结果，不能直接复用）；max_steps=1 时与原来一致
+        "cacheable": (model_used != "error" and len(steps) == 1 and "answer" in data
+                      and (stop == STOP_DONE or budget.max_steps == 1)),
+    }
 
-    thought = data.get("thought", "")
-    action = data.get("action", {})
-    observation = data.get("observation", "")
-    answer = data.get("answer", text or "好的")
-    print(f"{thought=}, {action=}, {observation=}, {answer=}")
+def _queue_full(e: QueueFull) -> HTTPException:
+    return HTTPException(status_code=429, detail="LLM 请求队列已满，请稍后重试",
+                         headers={"Retry-After": str(e.retry_after)})
 
-    # 工具调用
-    if isinstance(action, dict) and action:
-        function_name = action.get("name")
-        args = action.get("args", {})
+def _flight_key(req: ChatReq, x_idempotency_key: Optional[str]) -> str:
+    if x_idempotency_key:
+        return f"idem:{x_idempotency_key}"
+    return f"req:{fingerprint(req.model_dump())}"
+
+@app.post("/llm", response_model=ChatResp)
+async def llm_endpoint(req: ChatReq, response: Response, x_idempotency_key: Optional[str] = Header(None),
+                       x_request_id: Optional[str] = Header(None), traceparent: Optional[str] = Header(None)):
+    trace_id, parent_id = tracing.parse_headers(x_request_id, traceparent)
+    response.headers[tracing.REQUEST_ID_HEADER] = trace_id
+    with _observe_request("llm"), tracing.span("llm_endpoint", trace_id, parent_id) as sp:
+        # 幂等缓存
+        if x_idempotency_key:
+            cached = await _IDEM.aget(x_idempotency_key)
+            if cached:
+                sp.set(cached="idempotency")
+                return ChatResp(**cached, cached=True)
+
+        # 相同的请求正在处理中时，等它的结果，不再重复请求上游/执行工具
         try:
-            if function_name in function_map:
-                function_map[function_name](**args)
+            if SINGLEFLIGHT:
+                out, shared = await _FLIGHTS.do(_flight_key(req, x_idempotency_key), lambda: _llm_compute(req))
             else:
-                print(f"[Warn] unknown function: {function_name}")
-        except Exception as e:
-            print("[Error]", e)
-            print(traceback.format_exc())
+                out, shared = await _llm_compute(req), False
+        except QueueFull as e:
+            sp.set(status=429)
+            raise _queue_full(e)
+        sp.set(model=out["model"], shared=shared, steps=len(out.get("steps") or []))
+        if x_idempotency_key and not shared:
+            await _IDEM.aset(x_idempotency_key, {k: out.get(k) for k in ("text", "model", "tool", "steps", "stop_reason")})
+        return ChatResp(**dict(out, cached=out["cached"] or shared))
 
-    out = {"text": answer, "model": model_used}
-    if x_idempotency_key:
-        _IDEM[x_idempotency_key] = (time.time(), out)
-    return ChatResp(**out)
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _observed_stream(it: AsyncIterator[str], root: tracing.Span) -> AsyncIterator[str]:
+    """
+    SSE 生成器在响应开始后才被迭代（端点函数已返回），在这里把根 span 设为当前、计入在途请求，流结束时收尾
+    """
+    tracing.attach(root)
+    try:
+        with _observe_request("llm_stream"):
+            async for chunk in it:
+                yield chunk
+    finally:
+        root.end()
+
+@app.post("/llm/stream")
+async def llm_stream_endpoint(req: ChatReq, x_request_id: Optional[str] = Header(None),
+                              traceparent: Optional[str] = Header(None)):
+    """
+    SSE 流式接口，事件：
+    - token：上游原始增量；thought/answer：对应字段的解码后增量（answer 可直接送 TTS）
+    - action：action 对象闭合（或为 null）时立即推送；投机模式下此刻工具已在后台启动
+    - observation：{"step", "tools": 本步工具结果}；多步时随后开始下一步，token/answer 等事件继续推送
+    - done：{"text": 最终 answer, "model", "action": 最后一步的 action, "tool": 最后一个工具结果,
+      "steps": 每步计时, "stop_reason"}，在工具执行完之后推送
+    """
+    speculative = _use_speculative(req)
+    intent = _match_intent(req)
+
+    async def gen_fastpath(m: IntentMatch) -> AsyncIterator[str]:
+        yield _sse("action", {"action": m.action})
+        yield _sse("answer", {"delta": m.answer})
+        tool_result = await _run_action(m.action)
+        yield _sse("done", {"text": m.answer, "model": FASTPATH_MODEL, "action": m.action, "tool": tool_result})
+
+    async def gen() -> AsyncIterator[str]:
+        budget = Budget(req.max_steps)
+        steps: List[Dict[str, Any]] = []
+        cur = req
+        model_used = LLAMA_MODEL
+        answer, action, last_tool, stop = "好的", None, None, STOP_DONE
+        for i in range(budget.max_steps):
+            if i > 0 and budget.remaining() <= 0:
+                stop = STOP_TIME_BUDGET
+                break
+            parser = ReActStreamParser()
+            parts: List[str] = []
+            task: Optional[asyncio.Task] = None
+            t0 = time.perf_counter()
+            try:
+                async for delta, model_used in _stream_via_llama(cur):
+                    parts.append(delta)
+                    yield _sse("token", {"delta": delta})
+                    for kind, payload in parser.feed(delta):
+                        if kind == "action":
+                            if speculative:
+                                task = _dispatch_action(payload)
+                            yield _sse("action", {"action": payload})
+                        else:
+                            yield _sse(kind, {"delta": payload})
+            except Exception as e:
+                msg = f"[LLM 调用失败] {type(e).__name__}: {e}"
+                yield _sse("error", {"message": msg})
+                results = await task if task is not None else []
+                steps.append(step_record(i, time.perf_counter() - t0, 0.0, results))
+                _LOOP.record(steps, STOP_ERROR)
+                yield _sse("done", {"text": msg, "model": "error", "action": None,
+                                    "tool": results[-1] if results else last_tool,
+                                    "steps": steps, "stop_reason": STOP_ERROR})
+                return
+            t1 = time.perf_counter()
+
+            text = "".join(parts).strip()
+            if parser.done:
+                data = parser.fields
+                _PARSE.record(SCHEMA_REACT, "json")
+            else:
+                data = _parse_react(text)
+            action = data.get("action", {})
+            answer = data.get("answer", text or "好的")
+            if task is not None:
+                results = await task
+            elif not (speculative and parser.action_emitted):
+                results = await _run_actions(action)
+            else:
+                results = []
+            steps.append(step_record(i, t1 - t0, time.perf_counter() - t1, results))
+            tracing.record("react.step", t0, step=i + 1)
+            if results:
+                last_tool = results[-1]
+                yield _sse("observation", {"step": i + 1, "tools": results})
+            stop = budget.stop_after(i, results)
+            if stop is not None:
+                break
+            extra = [Msg(**m) for m in observation_messages(text, results)]
+            cur = cur.model_copy(update={"messages": list(cur.messages) + extra})
+        _LOOP.record(steps, stop)
+        yield _sse("done", {"text": answer, "model": model_used, "action": action or None, "tool": last_tool,
+                            "steps": steps, "stop_reason": stop})
+
+    if intent is None and _SCHED is not None and all(u.local for u in _UPSTREAMS.upstreams):
+        # 开始响应之前先做一次队列检查，满了直接 429，而不是在 SSE 里报错（有云端上游时本地满了会换云端，不必拒绝）
+        try:
+            _SCHED.check()
+        except QueueFull as e:
+            raise _queue_full(e)
+    trace_id, parent_id = tracing.parse_headers(x_request_id, traceparent)
+    root = tracing.start("llm_stream_endpoint", trace_id, parent_id, fastpath=intent is not None)
+    return StreamingResponse(_observed_stream(gen() if intent is None else gen_fastpath(intent), root),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                      tracing.REQUEST_ID_HEADER: trace_id})
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8001, reload=False, workers=1)
@@ -0,0 +1,232 @@
+# backend/metrics.py
+"""
+轻量指标：固定桶直方图（累计计数 + 总和，可估算分位数）、计数器、仪表，以及 Prometheus 文本格式输出，
+不依赖 prometheus_client。
+
+- 热路径上只是字典查找 + 加法（带标签的按标签值元组缓存子指标）；
+- 已经在别处计数的（幂等缓存命中、工具调用次数等）不重复计，注册成采集函数，抓取 /metrics 时才读取；
+- 计数器在事件循环线程里更新，不加锁；直方图可能在工具线程里更新，沿用自带的锁。
+"""
+from __future__ import annotations
+import abc
+import bisect
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# 常用桶（秒）：排队等待、阶段耗时
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 队列深度
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts: List[int] = [0] * (len(self.buckets) + 1)  # 最后一格为 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def cumulative(self) -> List[int]:
+        """各桶（含 +Inf）的累计计数，与 Prometheus 的 le 语义一致"""
+        out, acc = [], 0
+        with self._lock:
+            for c in self._counts:
+                acc += c
+                out.append(acc)
+        return out
+
+    def quantile(self, q: float) -> float:
+        """按桶内线性插值估算分位数；落在 +Inf 桶时返回最后一个有限边界"""
+        cum = self.cumulative()
+        total = cum[-1]
+        if not total:
+            return 0.0
+        rank = q * total
+        for i, c in enumerate(cum):
+            if c >= rank:
+                if i >= len(self.buckets):
+                    return self.buckets[-1]
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                prev = cum[i - 1] if i > 0 else 0
+                inside = c - prev
+                return lo + (self.buckets[i] - lo) * ((rank - prev) / inside if inside else 1.0)
+        return self.buckets[-1]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 4) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 4),
+            "p95": round(self.quantile(0.95), 4),
+            "p99": round(self.quantile(0.99), 4),
+        }
+
+
+# ---------- Prometheus 风格的指标与文本输出 ----------
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]          # (指标名含后缀, 标签, 值)
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class _Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+
+    @property
+    def family(self) -> str:
+        """HELP / TYPE 行用的名字：计数器的样本带 _total 后缀，这里也要带上，否则抓取端对不上"""
+        return self.name + "_total" if self.kind == "counter" else self.name
+
+    def _labels(self, values: Labels) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[Sample]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, v in list(self._values.items()):
+            yield self.name + "_total", self._labels(labels), v
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, v in list(self._values.items()):
+            yield self.name, self._labels(labels), v
+
+
+class HistogramVec(_Metric):
+    """按标签值分组的 Histogram；每组一个上面的 Histogram 实例"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Labels, Histogram] = {}
+
+    def labels(self, *labels: str) -> Histogram:
+        h = self._children.get(labels)
+        if h is None:
+            h = self._children.setdefault(labels, Histogram(self.buckets))
+        return h
+
+    def observe(self, value: float, *labels: str) -> None:
+        self.labels(*labels).observe(value)
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, h in list(self._children.items()):
+            base = self._labels(labels)
+            cum = h.cumulative()
+            for le, c in zip(list(self.buckets) + [float("inf")], cum):
+                yield self.name + "_bucket", dict(base, le=_fmt_value(le)), c
+            yield self.name + "_sum", base, h.sum
+            yield self.name + "_count", base, cum[-1]
+
+
+class _Collected(_Metric):
+    """抓取时才调用 fn 取值：fn 返回 [(标签值元组, 值), ...]"""
+
+    def __init__(self, kind: str, name: str, help: str, labelnames: Sequence[str],
+                 fn: Callable[[], Iterable[Tuple[Labels, float]]]):
+        super().__init__(name, help, labelnames)
+        self.kind, self._fn = kind, fn
+
+    def samples(self) -> Iterable[Sample]:
+        suffix = "_total" if self.kind == "counter" else ""
+        for labels, v in self._fn():
+            yield self.name + suffix, self._labels(tuple(str(x) for x in labels)), v
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> HistogramVec:
+        return self.register(HistogramVec(name, help, labelnames, buckets))  # type: ignore[return-value]
+
+    def collect(self, kind: str, name: str, help: str, labelnames: Sequence[str],
+                fn: Callable[[], Iterable[Tuple[Labels, float]]]) -> None:
+        """已有统计的只读视图：kind 为 counter / gauge"""
+        self.register(_Collected(kind, name, help, labelnames, fn))
+
+    def exposition(self) -> str:
+        """Prometheus 文本格式（0.0.4）；采集函数出错时跳过该指标，不影响其它指标"""
+        lines: List[str] = []
+        for m in self._metrics:
+            try:
+                samples = list(m.samples())
+            except Exception as e:
+                lines.append(f"# {m.family} 采集失败: {type(e).__name__}")
+                continue
+            lines.append(f"# HELP {m.family} {m.help}")
+            lines.append(f"# TYPE {m.family} {m.kind}")
+            lines.extend(f"{n}{_fmt_labels(labels)} {_fmt_value(v)}" for n, labels, v in samples)
+        return "\n".join(lines) + "\n"
+
+
+# 默认注册表；需要隔离时（测试、多个 app）自己 new 一个
+REGISTRY = Registry()
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,102 @@
+# backend/prefix_cache.py
+"""
+llama.cpp 提示前缀缓存（KV 复用）相关的辅助：
+
+- 稳定前缀：把 system prompt 里的 {{current_date}} 挪到消息末尾，前缀每轮保持不变；
+- 槽位亲和：同一 session_id 固定到同一个 llama-server 槽位（id_slot），上一轮的 KV 还在；
+- 命中统计：一方面比较本轮与该槽位上一轮消息的公共前缀（本地估算），
+  另一方面汇总上游返回的实测数据（llama.cpp timings.cache_n/prompt_n，
+  DeepSeek usage.prompt_cache_hit_tokens/prompt_cache_miss_tokens，OpenAI cached_tokens）。
+"""
+from __future__ import annotations
+import os
+import zlib
+import datetime as dt
+from typing import Any, Dict, List, Optional
+
+from backend.prompt import DATE_PLACEHOLDER, DATE_MESSAGE_PREFIX, date_message
+
+# llama-server 的并行槽位数（与 -np 一致）；0 表示不指定 id_slot，由服务端自行分配
+LLAMA_SLOTS = int(os.getenv("LLAMA_SLOTS", "0"))
+
+
+def stabilize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    system prompt 里仍带日期占位符的（老客户端），把占位符换成固定文字，
+    再在末尾补一条日期消息；已经自带日期消息的不再重复添加。
+    """
+    if not any(m["role"] == "system" and DATE_PLACEHOLDER in m["content"] for m in messages):
+        return messages
+    out = [dict(m, content=m["content"].replace(DATE_PLACEHOLDER, "（见对话末尾的当前日期）"))
+           if m["role"] == "system" else m for m in messages]
+    last = out[-1] if out else None
+    if not (last and last["role"] == "system" and last["content"].startswith(DATE_MESSAGE_PREFIX)):
+        out.append(date_message(dt.date.today().isoformat()))
+    return out
+
+
+def slot_for(session_id: Optional[str], slots: Optional[int] = None) -> Optional[int]:
+    """session_id -> 固定槽位；slots 缺省取 LLAMA_SLOTS，未配置槽位或没有 session 时返回 None"""
+    slots = LLAMA_SLOTS if slots is None else slots
+    if slots <= 0 or not session_id:
+        return None
+    return zlib.crc32(session_id.encode("utf-8")) % slots
+
+
+class PrefixStats:
+    def __init__(self):
+        self._last: Dict[str, List[str]] = {}   # 槽位/会话 -> 上一轮发送的消息内容
+        self.requests = 0
+        self.prefix_chars = 0                   # 与上一轮相同的前缀字符数（本地估算）
+        self.total_chars = 0
+        self.cached_tokens = 0                  # 上游实测：复用的提示 token
+        self.prompt_tokens = 0                  # 上游实测：本轮新算的提示 token
+
+    def observe_request(self, key: str, messages: List[Dict[str, str]]) -> None:
+        """记录发往某槽位（或会话）的消息，累计与上一轮的公共前缀长度"""
+        cur = [f'{m["role"]}\x00{m["content"]}' for m in messages]
+        prev = self._last.get(key, [])
+        common = 0
+        for a, b in zip(prev, cur):
+            if a != b:
+                common += len(os.path.commonprefix([a, b]))
+                break
+            common += len(a)
+        self._last[key] = cur
+        if len(self._last) > 4096:
+            self._last.pop(next(iter(self._last)))
+        self.requests += 1
+        self.prefix_chars += common
+        self.total_chars += sum(len(c) for c in cur)
+
+    def observe_response(self, data: Dict[str, Any]) -> None:
+        """从上游响应（或流式最后一个分片）里取缓存命中数据"""
+        timings = data.get("timings") or {}
+        if "prompt_n" in timings:
+            self.prompt_tokens += int(timings.get("prompt_n") or 0)
+            self.cached_tokens += int(timings.get("cache_n") or 0)
+            return
+        usage = data.get("usage") or {}
+        if "prompt_cache_hit_tokens" in usage:
+            self.cached_tokens += int(usage.get("prompt_cache_hit_tokens") or 0)
+            self.prompt_tokens += int(usage.get("prompt_cache_miss_tokens") or 0)
+        elif usage.get("prompt_tokens_details"):
+            cached = int(usage["prompt_tokens_details"].get("cached_tokens") or 0)
+            self.cached_tokens += cached
+            self.prompt_tokens += max(int(usage.get("prompt_tokens") or 0) - cached, 0)
+        elif "tokens_cached" in data:
+            # llama.cpp /completion 旧字段
+            cached = int(data.get("tokens_cached") or 0)
+            self.cached_tokens += cached
+            self.prompt_tokens += max(int(data.get("tokens_evaluated") or 0) - cached, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        upstream_total = self.cached_tokens + self.prompt_tokens
+        return {
+            "slots": LLAMA_SLOTS,
+            "requests": self.requests,
+            "prefix_reuse_ratio": round(self.prefix_chars / self.total_chars, 4) if self.total_chars else 0.0,
+            "cached_tokens": self.cached_tokens,
+            "evaluated_prompt_tokens": self.prompt_tokens,
+            "cache_hit_ratio": round(self.cached_tokens / upstream_total, 4) if upstream_total else 0.0,
+        }
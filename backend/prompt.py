@@ -12,6 +12,12 @@ TEST_PROMPT = """
 
 
 
+# 工具列表不再手写：{{tools}} 由后端按 function_map 的签名生成（backend/tool_registry.py），
+# 并只放本轮相关的工具；下面 TOOL_GUIDES 是签名表达不了的使用说明和例子。
+TOOLS_PLACEHOLDER = "{{tools}}"
+TOOLS_MESSAGE_PREFIX = "可用工具："
+TOOLS_MOVED_NOTE = "（可用工具见对话末尾）"
+
 SYSTEM_PROMPT = """
 你是一个能在执行电脑操作前进行思考的本地桌面助手。你必须只输出一段符合 RFC 8259 标准的 JSON 对象，不要输出任何 JSON 之外的文本、代码块标记、注释或 Markdown。
 
@@ -22,51 +28,83 @@ JSON 格式严格如下：
   "observation": "",   // 留空，系统会填充
   "answer": "给用户的最终回答（简短）"
 }
-给你已有的工具如下，你可以调用：
--切换播放/暂停（QQ音乐）
--在word写文章并保存到桌面，注意写文章请详细写并填充content_的内容
--打开网站或进行网络搜索
-- 创建日程提醒（可指定平台）
-- 查看日程安排
-可用 action：
-- {"name":"play_music","args":{}}                 
-- {"name":"write_article_in_word","args":{"file_name":"file_name", "content":"content_"}} 
-- {"name":"open_website_or_search","args":{"site_name":"网站别名"} or {"search_query":"搜索关键词"}}
-- {"name":"send_email","args":{"recipient":"收件人邮箱", "subject":"邮件主题", "body":"邮件正文"}}
-- {"name":"set_reminder","args":{"summary":"事件标题", "start_time_iso":"开始时间", "platforms":["google", "windows", or "both"]}}
-- {"name":"list_upcoming_events","args":{}}
-**工具使用说明：**
-1. `open_website_or_search`: 
-   - 当用户想打开一个常用网站（如B站、淘宝）时，使用 `site_name` 参数。例如：用户说 "打开B站"，你的 action 应该是 `{"name":"open_website_or_search", "args":{"site_name":"B站"}}`。
-   - 当用户想搜索不确定的内容时，使用 `search_query` 参数。例如：用户说 "搜索一下今天天气怎么样"，你的 action 应该是 `{"name":"open_website_or_search", "args":{"search_query":"今天天气怎么样"}}`。
-   - `site_name` 和 `search_query` **不要同时使用**。
-2. `send_email`: 
-  - 当用户想要发送邮件时，使用此工具。
-  - 你必须从用户的指令中提取出 **收件人邮箱(recipient)**、**邮件主题(subject)** 和 **邮件正文(body)**。
-  - 如果缺少任何一项信息，请将 "action" 置为 null，并在 "answer" 中向用户提问以获取缺失的信息。
-    例 (信息完整): 用户说 "给 test@example.com 发邮件，主题是项目更新，告诉他会议改到明天下午三点了"，action 应为 `{"name":"send_email", "args":{"recipient":"test@example.com", "subject":"项目更新", "body":"会议改到明天下午三点了。"}}`。
-    例 (信息不全): 用户说 "帮我发个邮件"，你的 action 必须为 `null`，answer 应为 "好的，请告诉我收件人的邮箱地址、邮件主题和内容是什么？"。
-3. `set_reminder` (创建日程提醒): 
-   - 你的任务是从用户的话里提取 **事件标题(summary)** 和 **与时间相关的原文(time_expression)**。
-   - **非常重要**: `time_expression` 这个参数，必须是用户话里**一字不差的、和时间相关的短语**。绝对不要自己计算或转换它！
-   - **关键**: 你必须根据用户的偏好，确定 `platforms` 参数... (这部分规则保持不变)
-   - 如果用户没说时间，请向他提问。
-      例1: 用户说 "提醒我**明天下午3点**开会"
-      你的 action 应该是: `{"name":"set_reminder", "args":{"summary":"开会", "time_expression":"明天下午3点", "platforms":["google"]}}`
-      
-      例2: 用户说 "在电脑上提醒我**周五上午10点**交报告"
-      你的 action 应该是: `{"name":"set_reminder", "args":{"summary":"交报告", "time_expression":"周五上午10点", "platforms":["windows"]}}`
-      
-      例3: 用户说 "提醒我**10:32**喝水"
-      你的 action 应该是: `{"name":"set_reminder", "args":{"summary":"喝水", "time_expression":"10:32", "platforms":["google"]}}`
-4. `list_upcoming_events`:
-   - 当用户询问“我今天有什么安排”或“接下来的日程”时使用。
+{{tools}}
 
 如果不需要执行动作，"action" 必须为 null。
+一句话里要办几件事时，"action" 可以写成列表，系统会同时执行，结果合在一条观察结果里返回；
+某个动作要等前面的动作成功后才能做时，给前面的动作加 "id"，后面的动作写 "after": [那个 id]，例如：
+  "action": [{"id": "1", "name": "set_reminder", "args": {...}}, {"id": "2", "name": "send_email", "args": {...}, "after": ["1"]}]
+系统执行完 action 后，会把工具返回的内容以“观察结果：”开头的消息告诉你：据此决定下一个 action；
+事情都办完了就把 "action" 置为 null，并在 "answer" 里根据观察结果回答用户。
 **严格要求：**
 - 你的整个输出必须是一个单独的 JSON 对象，以 `{` 开始，以 `}` 结束。
 - JSON 中所有的键（key）和字符串值（string value）都必须使用双引号 `"` 包裹。
 - 如果需要写文章，必须把 "content" 写成**完整正文**，不少于300字，不能包含 "content_"、"<内容>" 等占位符。
 - **当用户的查询中包含 "C++"、"C#"、".NET" 等带有特殊符号的专有名词时，必须完整保留这些名称，绝对不能简化或修改它们。**
 - 如果信息不足，请将 "action" 置为 null，并在 "answer" 里向用户提问收集所需主题/风格/字数等。
-"""
\ No newline at end of file
+"""
+
+# 日期等每轮都会变的内容不要写进 SYSTEM_PROMPT：放在消息末尾，
+# system prompt 前缀才能在 llama.cpp 里命中 KV 缓存（cache_prompt）。
+DATE_PLACEHOLDER = "{{current_date}}"
+DATE_MESSAGE_PREFIX = "当前日期："
+OBSERVATION_PREFIX = "观察结果："
+
+
+def date_message(today: str) -> dict:
+    return {"role": "system", "content": f"{DATE_MESSAGE_PREFIX}{today}"}
+
+
+def observation_message(text: str) -> dict:
+    return {"role": "system", "content": f"{OBSERVATION_PREFIX}{text}"}
+
+
+def tools_message(section: str) -> dict:
+    return {"role": "system", "content": f"{TOOLS_MESSAGE_PREFIX}\n{section}"}
+
+
+# 工具名 -> 使用说明（拼在自动生成的参数说明后面）
+TOOL_GUIDES = {
+    "play_music": "- 用户想听歌、暂停或继续播放时使用。",
+    "write_article_in_word": "- 用户要写文章、报告并保存成文档时使用；主题/风格/字数等信息不足时，action 置为 null，在 answer 里向用户提问。",
+    "open_website_or_search": (
+        "- 用户想打开一个常用网站（如B站、淘宝）时，使用 site_name。例：用户说 \"打开B站\"，"
+        "action 为 {\"name\":\"open_website_or_search\", \"args\":{\"site_name\":\"B站\"}}。\n"
+        "- 用户想搜索不确定的内容时，使用 search_query。例：用户说 \"搜索一下今天天气怎么样\"，"
+        "action 为 {\"name\":\"open_website_or_search\", \"args\":{\"search_query\":\"今天天气怎么样\"}}。\n"
+        "- site_name 和 search_query 不要同时使用。"
+    ),
+    "send_email": (
+        "- 必须从用户的指令中提取出收件人邮箱(recipient)、邮件主题(subject)和邮件正文(body)。\n"
+        "- 缺少任何一项时，action 置为 null，在 answer 中向用户提问以获取缺失的信息。\n"
+        "  例（信息完整）：用户说 \"给 test@example.com 发邮件，主题是项目更新，告诉他会议改到明天下午三点了\"，"
+        "action 为 {\"name\":\"send_email\", \"args\":{\"recipient\":\"test@example.com\", \"subject\":\"项目更新\", "
+        "\"body\":\"会议改到明天下午三点了。\"}}。\n"
+        "  例（信息不全）：用户说 \"帮我发个邮件\"，action 必须为 null，answer 为 \"好的，请告诉我收件人的邮箱地址、邮件主题和内容是什么？\"。"
+    ),
+    "set_reminder": (
+        "- 从用户的话里提取事件标题(summary)和与时间相关的原文(time_expression)。\n"
+        "- time_expression 必须是用户话里一字不差的、和时间相关的短语，绝对不要自己计算或转换它。\n"
+        "- platforms 按用户偏好确定：没说默认 [\"google\"]，说“在电脑上”用 [\"windows\"]，都要用 [\"both\"]。\n"
+        "- 如果用户没说时间，请向他提问。\n"
+        "  例1：用户说 \"提醒我明天下午3点开会\"，action 为 {\"name\":\"set_reminder\", \"args\":{\"summary\":\"开会\", "
+        "\"time_expression\":\"明天下午3点\", \"platforms\":[\"google\"]}}\n"
+        "  例2：用户说 \"在电脑上提醒我周五上午10点交报告\"，action 为 {\"name\":\"set_reminder\", \"args\":{\"summary\":\"交报告\", "
+        "\"time_expression\":\"周五上午10点\", \"platforms\":[\"windows\"]}}\n"
+        "  例3：用户说 \"提醒我10:32喝水\"，action 为 {\"name\":\"set_reminder\", \"args\":{\"summary\":\"喝水\", "
+        "\"time_expression\":\"10:32\", \"platforms\":[\"google\"]}}"
+    ),
+    "list_upcoming_events": "- 用户询问“我今天有什么安排”或“接下来的日程”时使用。",
+    "call_cot_assistant": "- 现有工具不足以完成的多步电脑操作（打开应用、操作页面、收集资料写成文档等）交给它，不要自己描述步骤。",
+}
+
+# 工具名 -> 触发词：并入该工具的检索文本（backend/tool_select.py 按 BM25 挑本轮相关的工具）
+TOOL_KEYWORDS = {
+    "play_music": ("音乐", "歌", "播放", "暂停", "QQ音乐"),
+    "write_article_in_word": ("文章", "写", "word", "Word", "文档", "作文", "报告"),
+    "open_website_or_search": ("打开", "搜索", "搜", "查", "网站", "百度", "谷歌", "必应", "B站", "知乎", "淘宝", "京东", "GitHub"),
+    "send_email": ("邮件", "邮箱", "email", "发信", "@"),
+    "set_reminder": ("提醒", "闹钟", "叫我", "记得", "明天", "后天", "分钟后", "小时后"),
+    "list_upcoming_events": ("安排", "日程", "日历", "行程"),
+    "call_cot_assistant": ("研报", "整理", "收集", "一步步", "操作"),
+}
@@ -0,0 +1,122 @@
+# backend/react_loop.py
+"""
+服务端多步 ReAct：执行完工具，把结果作为“观察结果”注入对话再问一次模型，直到 action 为 null。
+“查看日程然后提醒我”这类请求一轮语音就能办完，不用用户再说一遍。
+
+- 步数上限 REACT_MAX_STEPS（请求体 max_steps 可覆盖，1 即原来的单步行为）；
+- 总时长上限 REACT_TIME_BUDGET 秒：每步开始前检查，后续步骤的 LLM 调用也以剩余时间为超时；
+- 一步里的多个 action 按依赖并发执行（action 为列表时，见 backend/actions.py）；
+- 每步记录 LLM / 工具耗时，随响应返回，/health 汇总步数与停止原因。
+
+这里只放与 HTTP 无关的部分（预算、观察结果格式、步骤记录、统计），循环本身在 llm_app 里。
+"""
+from __future__ import annotations
+import os
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from backend.actions import observation_block
+from backend.metrics import Histogram, LATENCY_BUCKETS
+from backend.prompt import observation_message
+
+REACT_MAX_STEPS = int(os.getenv("REACT_MAX_STEPS", "4"))
+REACT_TIME_BUDGET = float(os.getenv("REACT_TIME_BUDGET", "20"))
+REACT_OBSERVATION_CHARS = int(os.getenv("REACT_OBSERVATION_CHARS", "1200"))   # 注入的观察结果上限
+
+STOP_DONE = "done"                 # 模型给出 action: null
+STOP_MAX_STEPS = "max_steps"
+STOP_TIME_BUDGET = "time_budget"
+STOP_ERROR = "error"               # LLM 调用失败
+STOP_REASONS = (STOP_DONE, STOP_MAX_STEPS, STOP_TIME_BUDGET, STOP_ERROR)
+STEP_BUCKETS = (1, 2, 3, 4, 6, 8)
+
+
+def observation_text(results: List[Dict[str, Any]], limit: int = REACT_OBSERVATION_CHARS) -> str:
+    """一步里所有动作的结果汇总成一个观察结果块（格式见 backend/actions.py）"""
+    return observation_block(results, limit)
+
+
+def observation_messages(model_text: str, results: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """下一步要追加的消息：模型本步的原始输出 + 观察结果"""
+    return [{"role": "assistant", "content": model_text}, observation_message(observation_text(results))]
+
+
+class StepTimeout(asyncio.TimeoutError):
+    """一步的 LLM 调用超时；超时前已经派发的工具仍会跑完，结果放在 results 里"""
+
+    def __init__(self, results: List[Dict[str, Any]], llm_s: float, tool_wait_s: float):
+        super().__init__("step timed out")
+        self.results = results
+        self.llm_s = llm_s
+        self.tool_wait_s = tool_wait_s
+
+
+class Budget:
+    def __init__(self, max_steps: Optional[int] = None, seconds: float = REACT_TIME_BUDGET):
+        self.max_steps = max(1, max_steps or REACT_MAX_STEPS)
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def timeout_for(self, step: int) -> Optional[float]:
+        """第一步不限时（与单步行为一致），之后以剩余时间为上限"""
+        return None if step == 0 else max(self.remaining(), 0.0)
+
+    def stop_after(self, step: int, results: List[Dict[str, Any]]) -> Optional[str]:
+        """本步（从 0 计）执行完后是否停止；返回停止原因，继续时返回 None"""
+        if not results:
+            return STOP_DONE
+        if step + 1 >= self.max_steps:
+            return STOP_MAX_STEPS
+        if self.remaining() <= 0:
+            return STOP_TIME_BUDGET
+        return None
+
+
+def step_record(step: int, llm_s: float, tool_wait_s: float, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    一步的计时：llm_ms 含排队，tool_ms 为各工具自身耗时的最大值（并发执行；投机派发时与 LLM 重叠），
+    wait_ms 为 LLM 结束后还要等工具的时间
+    """
+    return {
+        "step": step + 1,
+        "actions": [r.get("name") for r in results],
+        "ok": all(r.get("ok") for r in results),
+        "llm_ms": round(llm_s * 1000, 1),
+        "tool_ms": max((r.get("elapsed_ms") or 0.0 for r in results), default=0.0),
+        "wait_ms": round(tool_wait_s * 1000, 1),
+        "tools": results,
+    }
+
+
+class LoopStats:
+    def __init__(self):
+        self.requests = 0
+        self.stops = {r: 0 for r in STOP_REASONS}
+        self.steps = Histogram(STEP_BUCKETS)
+        self.step_time = Histogram(LATENCY_BUCKETS)
+        self.multi_action_steps = 0      # 一步里执行了多个动作
+        self.skipped = 0                 # 依赖未成功而跳过的动作
+
+    def record(self, steps: List[Dict[str, Any]], stop: str) -> None:
+        self.requests += 1
+        self.stops[stop] = self.stops.get(stop, 0) + 1
+        self.steps.observe(len(steps))
+        for s in steps:
+            self.step_time.observe((s["llm_ms"] + s["wait_ms"]) / 1000)
+            self.multi_action_steps += len(s["tools"]) > 1
+            self.skipped += sum(1 for r in s["tools"] if r.get("skipped"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_steps": REACT_MAX_STEPS,
+            "time_budget_s": REACT_TIME_BUDGET,
+            "requests": self.requests,
+            "stop_reasons": dict(self.stops),
+            "steps": self.steps.stats(),
+            "step_time_s": self.step_time.stats(),
+            "multi_action_steps": self.multi_action_steps,
+            "skipped_actions": self.skipped,
+        }
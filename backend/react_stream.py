@@ -0,0 +1,163 @@
+# backend/react_stream.py
+"""
+JSON-ReAct 输出的增量解析器。
+
+上游按 token 流式返回 {"thought": ..., "action": ..., "observation": ..., "answer": ...}，
+这里逐字符扫描，不等整段文本结束：
+- "thought"/"answer" 的字符一出现就作为增量吐出（可直接喂给 TTS）；
+- "action" 对象一闭合就整体吐出（可提前派发工具）；"action": null 也会吐出 None。
+  同一个对象里后面又出现非空的 "action"（原生 tool_calls 补在模型自己写的 null 之后）时再吐一次。
+"""
+from __future__ import annotations
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+Event = Tuple[str, Any]
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class ReActStreamParser:
+    def __init__(self, stream_fields: Tuple[str, ...] = ("thought", "answer")):
+        self.stream_fields = stream_fields
+        self.fields: Dict[str, Any] = {}   # 已完整解析的顶层字段
+        self.action_emitted = False
+        self._state = "pre"
+        self._key: List[str] = []
+        self._cur_key = ""
+        self._buf: List[str] = []          # 当前字符串值 / 嵌套原文 / 标量原文
+        self._esc = False
+        self._uni: Optional[str] = None    # \\uXXXX 收集中
+        self._depth = 0                    # 嵌套容器深度（仅 nested 状态）
+        self._nested_in_str = False
+        self._nested_esc = False
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> List[Event]:
+        events: List[Event] = []
+        delta: List[str] = []
+        for ch in chunk:
+            st = self._state
+            if st == "pre":
+                if ch == "{":
+                    self._state = "key_wait"
+            elif st == "key_wait":
+                if ch == '"':
+                    self._key = []
+                    self._state = "key"
+                elif ch == "}":
+                    self._state = "done"
+            elif st == "key":
+                c = self._string_char(ch)
+                if c is _END:
+                    self._cur_key = "".join(self._key)
+                    self._state = "colon"
+                elif c:
+                    self._key.append(c)
+            elif st == "colon":
+                if ch == ":":
+                    self._state = "value_wait"
+            elif st == "value_wait":
+                if ch == '"':
+                    self._buf = []
+                    self._state = "str"
+                elif ch in "{[":
+                    self._buf = [ch]
+                    self._depth = 1
+                    self._nested_in_str = self._nested_esc = False
+                    self._state = "nested"
+                elif not ch.isspace():
+                    self._buf = [ch]
+                    self._state = "scalar"
+            elif st == "str":
+                c = self._string_char(ch)
+                if c is _END:
+                    if delta:
+                        events.append((self._cur_key, "".join(delta)))
+                        delta = []
+                    self.fields[self._cur_key] = "".join(self._buf)
+                    self._state = "after_value"
+                elif c:
+                    self._buf.append(c)
+                    if self._cur_key in self.stream_fields:
+                        delta.append(c)
+            elif st == "nested":
+                self._buf.append(ch)
+                if self._nested_in_str:
+                    if self._nested_esc:
+                        self._nested_esc = False
+                    elif ch == "\\":
+                        self._nested_esc = True
+                    elif ch == '"':
+                        self._nested_in_str = False
+                elif ch == '"':
+                    self._nested_in_str = True
+                elif ch in "{[":
+                    self._depth += 1
+                elif ch in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._finish_value("".join(self._buf), events)
+                        self._state = "after_value"
+            elif st == "scalar":
+                if ch in ",}" or ch.isspace():
+                    self._finish_value("".join(self._buf).strip(), events)
+                    self._state = "done" if ch == "}" else ("key_wait" if ch == "," else "after_value")
+                else:
+                    self._buf.append(ch)
+            elif st == "after_value":
+                if ch == ",":
+                    self._state = "key_wait"
+                elif ch == "}":
+                    self._state = "done"
+            else:  # done：忽略对象之后的多余输出
+                break
+        if delta:
+            events.append((self._cur_key, "".join(delta)))
+        return events
+
+    def _string_char(self, ch: str):
+        """处理字符串内一个字符；返回解码后的字符、空串（转义中）或 _END（字符串结束）"""
+        if self._uni is not None:
+            self._uni += ch
+            if len(self._uni) < 4:
+                return ""
+            code, self._uni = self._uni, None
+            try:
+                return chr(int(code, 16))
+            except ValueError:
+                return ""
+        if self._esc:
+            self._esc = False
+            if ch == "u":
+                self._uni = ""
+                return ""
+            return _ESCAPES.get(ch, ch)
+        if ch == "\\":
+            self._esc = True
+            return ""
+        if ch == '"':
+            return _END
+        return ch
+
+    def _finish_value(self, raw: str, events: List[Event]) -> None:
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            value = raw
+        prev = self.fields.get(self._cur_key)
+        self.fields[self._cur_key] = value
+        if self._cur_key == "action" and (value is None or isinstance(value, (dict, list))):
+            if not self.action_emitted or (not prev and value):
+                self.action_emitted = True
+                events.append(("action", value))
+
+
+class _EndMarker:
+    pass
+
+
+_END = _EndMarker()
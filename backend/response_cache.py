@@ -0,0 +1,145 @@
+# backend/response_cache.py
+"""
+重复语音指令的响应缓存（可选开启）。
+
+键 = system prompt 的哈希 + 归一化后的最后一句用户话；值 = 上次解析出的 action + answer。
+- 精确匹配：dict 查找；
+- 模糊匹配：字符 n-gram 倒排索引取候选，Dice 系数打分，超过阈值才算命中（不依赖向量模型）；
+- 跳过规则：时效性工具（如 list_upcoming_events）、模型在反问用户、用户正在回答上一轮提问。
+"""
+from __future__ import annotations
+import os
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set, Tuple
+
+from backend.text_utils import normalize_utterance, char_ngrams, dice
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX = int(os.getenv("RESPONSE_CACHE_MAX", "512"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.85"))  # 模糊命中的最低相似度
+RESPONSE_CACHE_SKIP_TOOLS = set(filter(None, os.getenv(
+    "RESPONSE_CACHE_SKIP_TOOLS",
+    "list_upcoming_events,set_reminder,send_email,write_article_in_word,call_cot_assistant").split(",")))
+
+_DIGITS = re.compile(r"\d+")
+_QUESTION_END = ("?", "？")
+
+
+@dataclass
+class CachedResponse:
+    action: Any
+    answer: str
+    model: str
+    ts: float
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX, ttl: float = RESPONSE_CACHE_TTL,
+                 threshold: float = RESPONSE_CACHE_THRESHOLD, skip_tools: Optional[Set[str]] = None, n: int = 2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.skip_tools = RESPONSE_CACHE_SKIP_TOOLS if skip_tools is None else skip_tools
+        self.n = n
+        self._data: "OrderedDict[Tuple[str, str], CachedResponse]" = OrderedDict()
+        self._grams: Dict[Tuple[str, str], Set[str]] = {}
+        self._index: Dict[Tuple[str, str], Set[Tuple[str, str]]] = {}  # (sys_hash, gram) -> keys
+        self.stats_ = {"exact_hits": 0, "fuzzy_hits": 0, "misses": 0, "stores": 0, "skipped": 0, "evictions": 0}
+
+    @staticmethod
+    def _sys_hash(system_prompt: str) -> str:
+        return hashlib.sha1((system_prompt or "").encode("utf-8")).hexdigest()[:16]
+
+    def lookup(self, system_prompt: str, utterance: str,
+               last_assistant: str = "") -> Optional[Tuple[CachedResponse, float]]:
+        """返回 (缓存项, 相似度)；精确命中相似度为 1.0"""
+        norm = normalize_utterance(utterance)
+        if not norm or last_assistant.rstrip().endswith(_QUESTION_END):
+            # 用户在回答上一轮的提问：结果依赖上下文，不走缓存
+            self.stats_["misses"] += 1
+            return None
+        sh = self._sys_hash(system_prompt)
+        key = (sh, norm)
+        hit = self._fresh(key)
+        if hit is not None:
+            self.stats_["exact_hits"] += 1
+            return hit, 1.0
+
+        grams = char_ngrams(norm, self.n)
+        digits = _DIGITS.findall(norm)
+        best: Optional[Tuple[str, str]] = None
+        best_score = 0.0
+        seen: Set[Tuple[str, str]] = set()
+        for g in grams:
+            for cand in self._index.get((sh, g), ()):
+                if cand in seen:
+                    continue
+                seen.add(cand)
+                # 数字（时间、音量、数量）不同的指令不能互相替代
+                if _DIGITS.findall(cand[1]) != digits:
+                    continue
+                score = dice(grams, self._grams[cand])
+                if score > best_score:
+                    best, best_score = cand, score
+        if best is not None and best_score >= self.threshold:
+            hit = self._fresh(best)
+            if hit is not None:
+                self.stats_["fuzzy_hits"] += 1
+                return hit, round(best_score, 4)
+        self.stats_["misses"] += 1
+        return None
+
+    def store(self, system_prompt: str, utterance: str, action: Any, answer: str, model: str) -> bool:
+        norm = normalize_utterance(utterance)
+        if not norm or not self._cacheable(action, answer):
+            self.stats_["skipped"] += 1
+            return False
+        key = (self._sys_hash(system_prompt), norm)
+        if key in self._data:
+            self._drop(key)
+        self._data[key] = CachedResponse(action=action, answer=answer, model=model, ts=time.time())
+        grams = char_ngrams(norm, self.n)
+        self._grams[key] = grams
+        for g in grams:
+            self._index.setdefault((key[0], g), set()).add(key)
+        while len(self._data) > self.max_entries:
+            self._drop(next(iter(self._data)))
+            self.stats_["evictions"] += 1
+        self.stats_["stores"] += 1
+        return True
+
+    def _cacheable(self, action: Any, answer: str) -> bool:
+        if not answer:
+            return False
+        if not action and answer.rstrip().endswith(_QUESTION_END):
+            return False  # 模型在追问缺失信息，下次同样的话可能已经补全了上下文
+        actions = action if isinstance(action, list) else [action]
+        return not any(isinstance(a, dict) and a.get("name") in self.skip_tools for a in actions)
+
+    def _fresh(self, key: Tuple[str, str]) -> Optional[CachedResponse]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if time.time() - item.ts > self.ttl:
+            self._drop(key)
+            return None
+        self._data.move_to_end(key)
+        return item
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        self._data.pop(key, None)
+        for g in self._grams.pop(key, ()):
+            bucket = self._index.get((key[0], g))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._index[(key[0], g)]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.stats_, entries=len(self._data), threshold=self.threshold,
+                    skip_tools=sorted(self.skip_tools))
@@ -0,0 +1,174 @@
+# backend/scheduler.py
+"""
+本地模型的准入调度：并发请求排队，按 llama-server 的并行槽位数成批放行。
+
+llama.cpp 自己会把各槽位上的请求拼成一个 batch 连续解码（continuous batching），
+这里要做的是让在途请求数刚好填满槽位：多了只会在服务端排队、互相拖慢首字延迟，
+少了浪费 batch。槽位一空出来，就从队列里按下面的顺序补满：
+
+- 优先级：interactive（语音对话）先于 background（CoT 多步推理等）；
+  background 在队头等待超过 SCHED_AGING 秒后提升，避免饿死；
+- 同一优先级内按 session_id 轮转，一个会话连发多条不会挤占其他会话；
+- 队列满（SCHED_MAX_QUEUE）时直接拒绝，由接口返回 429 + Retry-After。
+"""
+from __future__ import annotations
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+from backend.metrics import Histogram, LATENCY_BUCKETS, DEPTH_BUCKETS
+
+SCHED_SLOTS = int(os.getenv("SCHED_SLOTS", "0"))            # 0 = 按本地上游的槽位数自动推断
+SCHED_MAX_QUEUE = int(os.getenv("SCHED_MAX_QUEUE", "64"))
+SCHED_AGING = float(os.getenv("SCHED_AGING", "5"))
+
+PRIORITIES = ("interactive", "background")
+DEFAULT_PRIORITY = "interactive"
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class _Waiter:
+    fut: asyncio.Future
+    session: str
+    priority: int
+    enqueued: float
+
+
+class AdmissionScheduler:
+    def __init__(self, slots: int, max_queue: int = SCHED_MAX_QUEUE, aging: float = SCHED_AGING):
+        self.slots = max(slots, 1)
+        self.max_queue = max_queue
+        self.aging = aging
+        self.active = 0
+        self._queues: List["OrderedDict[str, Deque[_Waiter]]"] = [OrderedDict() for _ in PRIORITIES]
+        self._depth = 0
+        self.admitted = {p: 0 for p in PRIORITIES}
+        self.rejected = 0
+        self.promoted = 0
+        self.service_ewma = 1.0       # 单个请求占用槽位的平均秒数，用来估算 Retry-After
+        self.wait_time = {p: Histogram(LATENCY_BUCKETS) for p in PRIORITIES}
+        self.queue_depth = Histogram(DEPTH_BUCKETS)
+
+    # ---------- 准入 ----------
+    @staticmethod
+    def priority_index(priority: Optional[str]) -> int:
+        return PRIORITIES.index(priority) if priority in PRIORITIES else 0
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.service_ewma * (self._depth + 1) / self.slots))
+
+    def check(self) -> None:
+        """队列已满时抛 QueueFull（流式接口在开始响应前先调一次）"""
+        if self._depth >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(self.retry_after())
+
+    async def acquire(self, session_id: Optional[str], priority: Optional[str] = None) -> None:
+        pri = self.priority_index(priority)
+        self.queue_depth.observe(self._depth)
+        if self.active < self.slots and self._depth == 0:
+            self.active += 1
+            self.admitted[PRIORITIES[pri]] += 1
+            self.wait_time[PRIORITIES[pri]].observe(0.0)
+            return
+        self.check()
+        w = _Waiter(asyncio.get_running_loop().create_future(), session_id or "", pri, time.monotonic())
+        self._queues[pri].setdefault(w.session, deque()).append(w)
+        self._depth += 1
+        try:
+            await w.fut
+        except asyncio.CancelledError:
+            if w.fut.done() and not w.fut.cancelled():
+                self.release()          # 已经分到槽位但调用方断开了，还回去
+            else:
+                self._remove(w)
+            raise
+        self.wait_time[PRIORITIES[pri]].observe(time.monotonic() - w.enqueued)
+
+    def release(self, service_s: Optional[float] = None) -> None:
+        self.active -= 1
+        if service_s is not None:
+            self.service_ewma = 0.2 * service_s + 0.8 * self.service_ewma
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, session_id: Optional[str], priority: Optional[str] = None) -> AsyncIterator[None]:
+        await self.acquire(session_id, priority)
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - t0)
+
+    # ---------- 出队 ----------
+    def _dispatch(self) -> None:
+        while self.active < self.slots and self._depth:
+            w = self._pop()
+            if w.fut.done():
+                continue                # 已取消、还没来得及从队列里移除
+            self.active += 1
+            self.admitted[PRIORITIES[w.priority]] += 1
+            w.fut.set_result(None)
+
+    def _pop(self) -> _Waiter:
+        order = list(range(len(PRIORITIES)))
+        # 低优先级队头等太久就先放它一个
+        for pri in order[1:]:
+            q = self._queues[pri]
+            if q and time.monotonic() - next(iter(q.values()))[0].enqueued > self.aging:
+                self.promoted += 1
+                order = [pri] + [p for p in order if p != pri]
+                break
+        for pri in order:
+            q = self._queues[pri]
+            if not q:
+                continue
+            session, dq = next(iter(q.items()))
+            w = dq.popleft()
+            del q[session]
+            if dq:
+                q[session] = dq      # 还有请求的会话排到本优先级末尾，轮转
+            self._depth -= 1
+            return w
+        raise RuntimeError("scheduler queue is empty")
+
+    def _remove(self, w: _Waiter) -> None:
+        q = self._queues[w.priority]
+        dq = q.get(w.session)
+        if dq is not None and w in dq:
+            dq.remove(w)
+            self._depth -= 1
+            if not dq:
+                del q[w.session]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "queued": self._depth,
+            "max_queue": self.max_queue,
+            "queued_by_priority": {p: sum(len(d) for d in self._queues[i].values()) for i, p in enumerate(PRIORITIES)},
+            "admitted": dict(self.admitted),
+            "rejected": self.rejected,
+            "promoted": self.promoted,
+            "service_ewma_s": round(self.service_ewma, 3),
+            "wait_time_s": {p: h.stats() for p, h in self.wait_time.items()},
+            "queue_depth": self.queue_depth.stats(),
+        }
+
+
+def make_scheduler(local_slots: int) -> Optional[AdmissionScheduler]:
+    """SCHED_SLOTS 显式配置优先；否则按本地上游的槽位数，没有本地上游时不启用"""
+    slots = SCHED_SLOTS or local_slots
+    return AdmissionScheduler(slots) if slots > 0 else None
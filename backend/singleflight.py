@@ -0,0 +1,57 @@
+# backend/singleflight.py
+"""
+并发请求合并（single-flight）：同一个键同时只有一个请求真正执行，其余并发的相同请求
+等待同一个结果。用于 /llm：GUI 重试、或两个客户端同时发来相同的幂等键/相同的消息时，
+只向上游发一次、只执行一次工具。
+
+领头请求放在独立的 Task 里跑，跟随者用 asyncio.shield 等待：任何一方断开连接都不会取消
+其他人正在等的结果。结果一出来键就移除，之后的请求走幂等缓存/正常流程。
+"""
+from __future__ import annotations
+import os
+import json
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "true").lower() in ("1", "true", "yes")
+
+
+def fingerprint(payload: Dict[str, Any]) -> str:
+    """请求体的稳定哈希（键排序，中文不转义）"""
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0        # 真正执行的次数
+        self.coalesced = 0      # 搭便车、省下的执行次数
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """返回 (结果, 是否复用了别人的执行)"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        self.leaders += 1
+        return await asyncio.shield(task), False
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # 所有等待者都已断开时，避免 “exception was never retrieved”
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.leaders,
+            "coalesced": self.coalesced,
+            "saved_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,33 @@
+# backend/text_utils.py
+"""语音指令文本的归一化与 n-gram 工具（响应缓存、意图路由共用）"""
+from __future__ import annotations
+import re
+import unicodedata
+from typing import Set
+
+# 句首客套、句尾语气词：不影响指令语义
+LEAD_FILLERS = re.compile(r"^(请你|请|麻烦你|麻烦|帮我|给我|你帮我|帮忙)+")
+TAIL_FILLERS = re.compile(r"(吧|呀|啊|呢|哦|嘛|哈|好吗|可以吗|谢谢)+$")
+_KEEP = re.compile(r"\w+")
+
+
+def normalize_utterance(text: str) -> str:
+    """全角转半角、小写、去标点空白、去掉首尾客套/语气词"""
+    s = unicodedata.normalize("NFKC", text or "").lower()
+    s = "".join(_KEEP.findall(s))
+    s = LEAD_FILLERS.sub("", s)
+    s = TAIL_FILLERS.sub("", s)
+    return s
+
+
+def char_ngrams(text: str, n: int = 2) -> Set[str]:
+    """字符 n-gram 集合；文本短于 n 时退化为整串"""
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def dice(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return 2.0 * len(a & b) / (len(a) + len(b))
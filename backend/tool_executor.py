@@ -0,0 +1,153 @@
+# backend/tool_executor.py
+"""
+工具执行器：把 function_map 里的同步工具（SMTP、Google API、COM、time.sleep…）
+放到有界线程池里跑，避免卡住 uvicorn 的事件循环。
+
+- 每个工具有独立的并发上限（asyncio.Semaphore），COM 类工具默认串行；
+- 每次调用有超时，超时后立即把结果返回给请求方（线程本身无法强杀，会跑完后才释放并发名额）；
+- 结果统一为 dict，可直接放进 HTTP 响应。
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+TOOL_DEFAULT_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))
+TOOL_DEFAULT_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "4"))
+
+# 工具名: (最大并发, 超时秒)；可用 TOOL_LIMITS='{"send_email": [1, 20]}' 覆盖
+DEFAULT_TOOL_LIMITS: Dict[str, Tuple[int, float]] = {
+    "play_music": (1, 15.0),
+    "write_article_in_word": (1, 120.0),
+    "send_email": (2, 30.0),
+    "set_reminder": (2, 30.0),
+    "list_upcoming_events": (4, 20.0),
+    "open_website_or_search": (4, 10.0),
+    "call_cot_assistant": (1, 300.0),
+}
+
+# 走 win32com 的工具：工作线程里需要先 CoInitialize
+COM_TOOLS = {"write_article_in_word"}
+
+
+def _load_limits() -> Dict[str, Tuple[int, float]]:
+    limits = dict(DEFAULT_TOOL_LIMITS)
+    raw = os.getenv("TOOL_LIMITS")
+    if raw:
+        try:
+            for name, (conc, timeout) in json.loads(raw).items():
+                limits[name] = (int(conc), float(timeout))
+        except (ValueError, TypeError) as e:
+            print(f"[Warn] TOOL_LIMITS 解析失败，使用默认值: {e}")
+    return limits
+
+
+def _jsonable(value: Any) -> Any:
+    try:
+        json.dumps(value, ensure_ascii=False)
+        return value
+    except (TypeError, ValueError):
+        return str(value)
+
+
+class ToolExecutor:
+    def __init__(self, function_map: Dict[str, Callable[..., Any]],
+                 max_workers: int = TOOL_WORKERS,
+                 limits: Optional[Dict[str, Tuple[int, float]]] = None):
+        self.function_map = function_map
+        self.limits = limits if limits is not None else _load_limits()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _limit(self, name: str) -> Tuple[int, float]:
+        return self.limits.get(name, (TOOL_DEFAULT_CONCURRENCY, TOOL_DEFAULT_TIMEOUT))
+
+    def _sem(self, name: str) -> asyncio.Semaphore:
+        sem = self._sems.get(name)
+        if sem is None:
+            sem = self._sems[name] = asyncio.Semaphore(self._limit(name)[0])
+        return sem
+
+    def _count(self, name: str, key: str) -> None:
+        st = self._stats.setdefault(name, {"calls": 0, "ok": 0, "error": 0, "timeout": 0, "busy": 0})
+        st[key] += 1
+
+    def _call(self, name: str, args: Dict[str, Any]) -> Any:
+        fn = self.function_map[name]
+        if name not in COM_TOOLS:
+            return fn(**args)
+        try:
+            import pythoncom  # pywin32，仅 Windows
+        except ImportError:
+            return fn(**args)
+        pythoncom.CoInitialize()
+        try:
+            return fn(**args)
+        finally:
+            pythoncom.CoUninitialize()
+
+    async def run(self, action: Dict[str, Any]) -> Dict[str, Any]:
+        """执行一个 {"name": ..., "args": {...}}，返回 {name, ok, result, error, timed_out, elapsed_ms}"""
+        name = action.get("name")
+        args = action.get("args") or {}
+        out: Dict[str, Any] = {"name": name, "ok": False, "result": None, "error": None,
+                               "timed_out": False, "elapsed_ms": 0.0}
+        if name not in self.function_map:
+            print(f"[Warn] unknown function: {name}")
+            out["error"] = f"unknown function: {name}"
+            return out
+        if not isinstance(args, dict):
+            out["error"] = f"args 必须是对象，而不是 {type(args).__name__}"
+            return out
+
+        self._count(name, "calls")
+        _, timeout = self._limit(name)
+        sem = self._sem(name)
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self._count(name, "busy")
+            out.update(error=f"tool busy: {name}", timed_out=True,
+                       elapsed_ms=round((time.perf_counter() - t0) * 1000, 1))
+            return out
+
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._pool, self._call, name, args)
+        # 线程真正结束时才归还并发名额，超时返回不会让同一工具的并发突破上限
+        fut.add_done_callback(lambda f: (sem.release(), f.cancelled() or f.exception()))
+        remaining = max(0.0, timeout - (time.perf_counter() - t0))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(fut), remaining)
+            out.update(ok=True, result=_jsonable(result))
+            self._count(name, "ok")
+        except asyncio.TimeoutError:
+            out.update(error=f"tool timeout after {timeout:g}s", timed_out=True)
+            self._count(name, "timeout")
+        except Exception as e:
+            print("[Error]", e)
+            print(traceback.format_exc())
+            out["error"] = f"{type(e).__name__}: {e}"
+            self._count(name, "error")
+        out["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self._pool._max_workers,
+            "tools": {name: dict(st, limit=self._limit(name)[0], timeout_s=self._limit(name)[1])
+                      for name, st in self._stats.items()},
+        }
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """{工具名: {calls/ok/error/timeout/busy: 次数}} 的副本（/metrics 用）"""
+        return {name: dict(st) for name, st in self._stats.items()}
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,355 @@
+# backend/tool_registry.py
+"""
+工具注册表：从 function_map 里的函数签名和 docstring 生成每个工具的参数 JSON Schema，
+不再在提示词里手写（手写版本会和真实签名漂移，比如 start_time_iso / time_expression）。
+
+- str/int/float/bool/List[...]/Optional[...]/Literal[...] 按类型映射；
+- 无默认值的参数为 required；*args/**kwargs 不生成参数；
+- docstring 第一段为工具说明，Args: 段里的 “参数 (类型): 说明” 为参数说明；
+- 签名表达不了的约束（枚举取值等）写在 PARAM_OVERRIDES 里。
+
+同一份 schema 有三种用法：受约束输出（grammar.py）、提示词里的工具说明（只放本轮相关的工具，
+由 tool_select 按 BM25 挑选；使用说明取自 prompt.TOOL_GUIDES）、支持 function calling 的上游的原生 tools 参数
+（返回的 tool_calls 再转回 JSON-ReAct 文本，后面的解析/投机派发不用区分）。
+"""
+from __future__ import annotations
+import re
+import json
+import inspect
+import typing
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from backend.json_repair import JSONRepairError, loads_object
+from backend.prompt import TOOL_GUIDES, TOOL_KEYWORDS, TOOLS_PLACEHOLDER, TOOLS_MOVED_NOTE, tools_message
+from backend.tool_select import ToolSelector
+
+# 签名之外的参数约束：工具名 -> 参数名 -> 合并进 schema 的字段
+PARAM_OVERRIDES: Dict[str, Dict[str, Dict[str, Any]]] = {
+    "set_reminder": {
+        "platforms": {"items": {"type": "string", "enum": ["google", "windows", "both"]}, "minItems": 1},
+    },
+}
+
+_SCALARS = {str: "string", int: "integer", float: "number", bool: "boolean"}
+_DOC_ARG = re.compile(r"^\s*(\w+)\s*(?:\([^)]*\))?\s*:\s*(.+)$")
+_DOC_SECTIONS = ("Args:", "Arguments:", "Parameters:", "Returns:", "Raises:", "Example:", "Examples:")
+NATIVE_TOOLS_NOTE = "（可用工具已通过 tools 参数提供：需要执行动作时直接调用工具）"
+
+
+@dataclass
+class ToolSpec:
+    name: str
+    description: str
+    parameters: Dict[str, Any] = field(default_factory=dict)   # {"type": "object", "properties": ..., "required": ...}
+    guide: str = ""                                             # 提示词里的使用说明/例子
+
+    def openai_tool(self) -> Dict[str, Any]:
+        """OpenAI / llama.cpp function calling 的 tools 条目"""
+        return {"type": "function", "function": {"name": self.name, "description": self.description,
+                                                 "parameters": self.parameters}}
+
+
+def annotation_schema(ann: Any) -> Dict[str, Any]:
+    """Python 类型注解 -> JSON Schema 片段；认不出的类型返回 {}（不约束）"""
+    if ann is inspect.Parameter.empty or ann is Any:
+        return {}
+    if ann in _SCALARS:
+        return {"type": _SCALARS[ann]}
+    origin = typing.get_origin(ann)
+    args = typing.get_args(ann)
+    if origin is typing.Union:
+        non_null = [a for a in args if a is not type(None)]
+        if len(non_null) == 1:
+            return annotation_schema(non_null[0])
+        return {"anyOf": [annotation_schema(a) for a in non_null]}
+    if origin in (list, tuple, set):
+        return {"type": "array", "items": annotation_schema(args[0]) if args else {}}
+    if origin is dict:
+        return {"type": "object"}
+    if origin is typing.Literal:
+        return {"enum": list(args)}
+    return {}
+
+
+def _type_hints(fn: Callable) -> Dict[str, Any]:
+    try:
+        return typing.get_type_hints(fn)
+    except Exception:
+        # 注解里引用了运行环境没有的类型时，退回未求值的注解
+        return getattr(fn, "__annotations__", {}) or {}
+
+
+def parse_docstring(doc: str) -> Tuple[str, Dict[str, str]]:
+    """Google 风格 docstring -> (第一段说明, {参数名: 说明})；说明跨行时拼接，空行结束 Args 段"""
+    summary = doc.split("\n\n")[0].strip()
+    params: Dict[str, str] = {}
+    in_args, last = False, None
+    for line in doc.splitlines():
+        stripped = line.strip()
+        if stripped in _DOC_SECTIONS:
+            in_args, last = stripped in _DOC_SECTIONS[:3], None
+            continue
+        if not stripped:
+            in_args, last = False, None   # 空行结束 Args 段
+            continue
+        if not in_args:
+            continue
+        m = _DOC_ARG.match(line)
+        if m:
+            last = m.group(1)
+            params[last] = m.group(2).strip()
+        elif last is not None:
+            params[last] += stripped
+    return summary, params
+
+
+def tool_spec(name: str, fn: Callable, guide: str = "") -> ToolSpec:
+    hints = _type_hints(fn)
+    summary, param_docs = parse_docstring(inspect.getdoc(fn) or "")
+    props: Dict[str, Any] = {}
+    required: List[str] = []
+    for p in inspect.signature(fn).parameters.values():
+        if p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD):
+            continue
+        schema = annotation_schema(hints.get(p.name, p.annotation))
+        schema.update(PARAM_OVERRIDES.get(name, {}).get(p.name, {}))
+        if p.name in param_docs:
+            schema["description"] = param_docs[p.name]
+        props[p.name] = schema
+        if p.default is p.empty:
+            required.append(p.name)
+    return ToolSpec(
+        name=name,
+        description=summary,
+        parameters={"type": "object", "properties": props, "required": required, "additionalProperties": False},
+        guide=guide,
+    )
+
+
+def build_specs(function_map: Mapping[str, Callable],
+                guides: Optional[Mapping[str, str]] = None) -> List[ToolSpec]:
+    guides = TOOL_GUIDES if guides is None else guides
+    return [tool_spec(name, fn, guides.get(name, "")) for name, fn in function_map.items()]
+
+
+# ---------- 提示词里的工具说明 ----------
+def _type_label(schema: Dict[str, Any]) -> str:
+    if "enum" in schema:
+        return "|".join(json.dumps(v, ensure_ascii=False) for v in schema["enum"])
+    if "anyOf" in schema:
+        return " 或 ".join(_type_label(s) for s in schema["anyOf"])
+    if schema.get("type") == "array":
+        return f"array<{_type_label(schema.get('items') or {})}>"
+    return schema.get("type", "any")
+
+
+def render_tool(spec: ToolSpec) -> str:
+    """一个工具在提示词里的说明：名字/用途、参数（由 schema 生成）、使用说明"""
+    props = spec.parameters.get("properties", {})
+    required = set(spec.parameters.get("required", ()))
+    args = []
+    for pname, schema in props.items():
+        label = _type_label(schema) + ("" if pname in required else "，可选")
+        args.append(f"{pname} ({label}) {schema.get('description', '').rstrip('。.')}".rstrip())
+    lines = [f"- {spec.name}：{spec.description}" if spec.description else f"- {spec.name}",
+             "  参数：" + ("；".join(args) if args else "无，args 为 {}")]
+    if spec.guide:
+        lines.extend("  " + g for g in spec.guide.splitlines())
+    return "\n".join(lines)
+
+
+def search_text(spec: ToolSpec, keywords: Sequence[str] = ()) -> str:
+    """工具的检索文本：名字、用途、参数说明、使用说明，触发词计两次"""
+    params = [p.get("description", "") for p in spec.parameters.get("properties", {}).values()]
+    return "\n".join([spec.name.replace("_", " "), spec.description, *params, spec.guide, *keywords, *keywords])
+
+
+def render_section(tools: Iterable[str]) -> str:
+    body = "\n".join(tools)
+    return ('action 为 {"name": 工具名, "args": {...}}，参数名必须与下列说明一致：\n' + body) if body else \
+        "本轮没有可用工具，action 必须为 null。"
+
+
+def expand_tools(messages: List[Dict[str, str]], section: Optional[str]) -> List[Dict[str, str]]:
+    """
+    system prompt 里的 {{tools}} 换成固定文字，工具说明作为一条 system 消息追加到末尾：
+    每轮选中的工具不同，放在末尾才不会破坏 KV 缓存的前缀。section 为 None 时（原生 tools）不追加。
+    没有占位符的（老客户端自带手写工具列表）原样返回。
+    """
+    if not any(m["role"] == "system" and TOOLS_PLACEHOLDER in m["content"] for m in messages):
+        return messages
+    note = NATIVE_TOOLS_NOTE if section is None else TOOLS_MOVED_NOTE
+    out = [dict(m, content=m["content"].replace(TOOLS_PLACEHOLDER, note)) if m["role"] == "system" else m
+           for m in messages]
+    if section is not None:
+        out.append(tools_message(section))
+    return out
+
+
+class ToolRegistry:
+    """
+    function_map 的工具说明：每个工具的提示词片段启动时渲染好，按用户这句话挑相关的拼起来；
+    同一组工具拼出的整段也缓存（组合数很少），每轮不重复拼接
+    """
+
+    def __init__(self, function_map: Mapping[str, Callable],
+                 keywords: Optional[Mapping[str, Sequence[str]]] = None, **select_opts: Any):
+        self.specs: Dict[str, ToolSpec] = {s.name: s for s in build_specs(function_map)}
+        keywords = TOOL_KEYWORDS if keywords is None else keywords
+        self.selector = ToolSelector({name: search_text(s, keywords.get(name, ()))
+                                      for name, s in self.specs.items()}, **select_opts)
+        self._rendered: Dict[str, str] = {name: render_tool(s) for name, s in self.specs.items()}
+        self._sections: Dict[Tuple[str, ...], str] = {}
+        self.full_section = self.section_for(list(self.specs))
+        self.requests = 0
+        self.selected = 0
+        self.section_chars = 0
+
+    def select(self, utterance: str, context: str = "") -> List[str]:
+        return self.selector.select(utterance, context)
+
+    def section_for(self, names: Sequence[str]) -> str:
+        key = tuple(names)
+        text = self._sections.get(key)
+        if text is None:
+            text = self._sections[key] = render_section(self._rendered[n] for n in names if n in self._rendered)
+        return text
+
+    def section(self, names: Sequence[str]) -> str:
+        """section_for + 计入统计（每次实际发往上游时调用）"""
+        text = self.section_for(names)
+        self.requests += 1
+        self.selected += len(names)
+        self.section_chars += len(text)
+        return text
+
+    def openai_tools(self, names: Sequence[str]) -> List[Dict[str, Any]]:
+        return [self.specs[n].openai_tool() for n in names if n in self.specs]
+
+    def stats(self) -> Dict[str, Any]:
+        avg = self.section_chars / self.requests if self.requests else 0.0
+        full = len(self.full_section)
+        return {
+            "tools": len(self.specs),
+            "requests": self.requests,
+            "avg_selected": round(self.selected / self.requests, 2) if self.requests else 0.0,
+            "full_section_chars": full,
+            "avg_section_chars": round(avg, 1),
+            "saved_ratio": round(1 - avg / full, 4) if self.requests and full else 0.0,
+            "select": self.selector.stats(),
+        }
+
+
+# ---------- 原生 tool_calls -> JSON-ReAct ----------
+def _call_action(call: Dict[str, Any]) -> Dict[str, Any]:
+    fn = call.get("function") or {}
+    args = fn.get("arguments") or {}
+    if isinstance(args, str):
+        try:
+            args = loads_object(args)[0] if args.strip() else {}
+        except JSONRepairError:
+            args = {}
+    return {"name": fn.get("name", ""), "args": args}
+
+
+def _calls_action(calls: List[Dict[str, Any]]) -> Any:
+    """一个 tool_call -> action 对象；多个 -> action 列表（彼此无依赖，并发执行）"""
+    actions = [_call_action(c) for c in calls]
+    return actions[0] if len(actions) == 1 else actions
+
+
+def _react_json(action: Any, answer: str) -> str:
+    return json.dumps({"thought": "", "action": action, "observation": "",
+                       "answer": answer or ("好的" if action else "")}, ensure_ascii=False)
+
+
+def react_from_message(message: Dict[str, Any]) -> str:
+    """
+    非流式响应的 message -> JSON-ReAct 文本。没有 tool_calls 时原样返回 content；
+    有的话作为 action（多个时为列表），content 是 JSON-ReAct 就补进 action，否则整段当作 answer
+    """
+    content = (message.get("content") or "").strip()
+    calls = message.get("tool_calls") or []
+    if not calls:
+        return content
+    action = _calls_action(calls)
+    if content.startswith("{"):
+        try:
+            data = loads_object(content)[0]
+            if not data.get("action"):
+                data["action"] = action
+            return json.dumps(data, ensure_ascii=False)
+        except JSONRepairError:
+            pass
+    return _react_json(action, content)
+
+
+class NativeReActStream:
+    """
+    流式响应的 delta（content / tool_calls 增量）-> JSON-ReAct 文本增量：
+    - content 以 { 开头：模型自己在写 JSON-ReAct，原样透传；
+    - 否则 content 是给用户的话，包进 "answer" 字符串里边收边吐（TTS 不用等）；
+    - tool_calls 的 name/arguments 按 index 分片累积，结束时作为 action（多个时为列表）补在最后。
+      JSON 模式下末尾的 } 先扣住，模型写的 JSON 里没有 action（或为 null）时把 tool_calls 补进去再闭合，
+      与非流式的 react_from_message 一致。
+    """
+
+    def __init__(self):
+        self._mode: Optional[str] = None     # "json" / "text"
+        self._calls: Dict[int, Dict[str, Any]] = {}
+        self._json: List[str] = []           # JSON 模式下收到的全部 content
+        self._held = ""                      # JSON 模式下扣住的结尾 }（及其后的空白）
+
+    def feed(self, delta: Dict[str, Any]) -> str:
+        for tc in delta.get("tool_calls") or []:
+            call = self._calls.setdefault(tc.get("index", 0), {"function": {"name": "", "arguments": ""}})
+            fn = tc.get("function") or {}
+            call["function"]["name"] += fn.get("name") or ""
+            call["function"]["arguments"] += fn.get("arguments") or ""
+        content = delta.get("content")
+        if not content:
+            return ""
+        if self._mode is None:
+            content = content.lstrip()
+            if not content:
+                return ""
+            self._mode = "json" if content.startswith("{") else "text"
+            if self._mode == "text":
+                return '{"thought": "", "observation": "", "answer": "' + json.dumps(content, ensure_ascii=False)[1:-1]
+        if self._mode == "json":
+            self._json.append(content)
+            out = self._held + content
+            tail = out.rstrip()
+            if tail.endswith("}"):
+                self._held = out[len(tail) - 1:]
+                return out[:len(tail) - 1]
+            self._held = ""
+            return out
+        return json.dumps(content, ensure_ascii=False)[1:-1]
+
+    def action(self) -> Any:
+        if not self._calls:
+            return None
+        return _calls_action([self._calls[i] for i in sorted(self._calls)])
+
+    def finish(self) -> str:
+        """流结束时补上的尾部；模型自己写了 JSON 的，补上扣住的 }，需要时先插入 tool_calls 转成的 action"""
+        if self._mode == "json":
+            return self._merge_action() + self._held
+        action = json.dumps(self.action(), ensure_ascii=False)
+        if self._mode == "text":
+            return '", "action": ' + action + "}"
+        return _react_json(self.action(), "")
+
+    def _merge_action(self) -> str:
+        action = self.action()
+        if action is None or not self._held:
+            return ""
+        try:
+            data = loads_object("".join(self._json))[0]
+        except JSONRepairError:
+            return ""
+        if data.get("action"):
+            return ""
+        return ', "action": ' + json.dumps(action, ensure_ascii=False)
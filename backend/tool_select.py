@@ -0,0 +1,103 @@
+# backend/tool_select.py
+"""
+按用户这句话挑相关工具：对每个工具的说明文本建 BM25 索引，取得分最高的 top-k。
+
+- 文档 = 工具名 + 用途 + 参数说明 + 使用说明/例子（prompt.TOOL_GUIDES）+ 触发词（TOOL_KEYWORDS，计两次）；
+- 词项 = 归一化后的单字 + 相邻二字（中文不分词也够用，英文/邮箱等按字符计）；
+- 只保留得分不低于最高分 TOOL_SELECT_RATIO 倍的工具，最多 TOOL_TOP_K 个；
+  最高分都不到 TOOL_MIN_SCORE（闲聊、没头没尾的一句）时按 TOOL_SELECT_FALLBACK 处理：
+  all 带全部工具（默认，宁可多带），none 不带工具；
+- 上一轮 assistant 在追问时，它的话按 TOOL_CONTEXT_WEIGHT 计入（回答“几点提醒你？”的“明天下午三点”仍能选中 set_reminder）。
+"""
+from __future__ import annotations
+import os
+import math
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+from backend.text_utils import normalize_utterance
+
+TOOL_TOP_K = int(os.getenv("TOOL_TOP_K", "3"))
+TOOL_MIN_SCORE = float(os.getenv("TOOL_MIN_SCORE", "3.0"))
+TOOL_SELECT_RATIO = float(os.getenv("TOOL_SELECT_RATIO", "0.4"))
+TOOL_SELECT_FALLBACK = os.getenv("TOOL_SELECT_FALLBACK", "all").lower()
+TOOL_CONTEXT_WEIGHT = float(os.getenv("TOOL_CONTEXT_WEIGHT", "0.5"))
+_CACHE_SIZE = 512
+
+
+def terms(text: str) -> List[str]:
+    """单字 + 相邻二字；normalize_utterance 已去掉标点空白并转小写"""
+    s = normalize_utterance(text)
+    return list(s) + [s[i:i + 2] for i in range(len(s) - 1)]
+
+
+class BM25:
+    def __init__(self, docs: Mapping[str, Sequence[str]], k1: float = 1.2, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self._tf: Dict[str, Counter] = {name: Counter(toks) for name, toks in docs.items()}
+        self._len = {name: len(toks) for name, toks in docs.items()}
+        self._avg = (sum(self._len.values()) / len(self._len)) if self._len else 1.0
+        df: Counter = Counter()
+        for tf in self._tf.values():
+            df.update(tf.keys())
+        n = len(self._tf)
+        # Lucene 的 idf 写法：所有文档都有的词 idf 仍为正，只是很小
+        self._idf = {t: math.log(1 + (n - c + 0.5) / (c + 0.5)) for t, c in df.items()}
+
+    def scores(self, query: Iterable[str]) -> Dict[str, float]:
+        q = Counter(t for t in query if t in self._idf)
+        out = {}
+        for name, tf in self._tf.items():
+            norm = self.k1 * (1 - self.b + self.b * self._len[name] / self._avg)
+            score = 0.0
+            for t, qn in q.items():
+                f = tf.get(t)
+                if f:
+                    score += qn * self._idf[t] * f * (self.k1 + 1) / (f + norm)
+            out[name] = score
+        return out
+
+
+class ToolSelector:
+    def __init__(self, docs: Mapping[str, str], top_k: int = TOOL_TOP_K, min_score: float = TOOL_MIN_SCORE,
+                 ratio: float = TOOL_SELECT_RATIO, fallback: str = TOOL_SELECT_FALLBACK,
+                 context_weight: float = TOOL_CONTEXT_WEIGHT):
+        self.names = list(docs)
+        self.top_k, self.min_score, self.ratio = top_k, min_score, ratio
+        self.fallback, self.context_weight = fallback, context_weight
+        self._bm25 = BM25({name: terms(text) for name, text in docs.items()})
+        self._cache: "OrderedDict[Tuple[str, str], List[str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def rank(self, utterance: str, context: str = "") -> List[Tuple[str, float]]:
+        scores = self._bm25.scores(terms(utterance))
+        if context and self.context_weight > 0:
+            for name, s in self._bm25.scores(terms(context)).items():
+                scores[name] += self.context_weight * s
+        return sorted(scores.items(), key=lambda kv: -kv[1])
+
+    def select(self, utterance: str, context: str = "") -> List[str]:
+        key = (utterance or "", context or "")
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        ranked = self.rank(*key)
+        top = ranked[0][1] if ranked else 0.0
+        if top < self.min_score:
+            self.fallbacks += 1
+            names = list(self.names) if self.fallback == "all" else []
+        else:
+            names = [n for n, s in ranked[:self.top_k] if s >= top * self.ratio]
+        self._cache[key] = names
+        if len(self._cache) > _CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return names
+
+    def stats(self) -> Dict[str, int]:
+        return {"top_k": self.top_k, "cache_hits": self.hits, "cache_misses": self.misses,
+                "fallbacks": self.fallbacks}
@@ -0,0 +1,103 @@
+# backend/trace_report.py
+"""
+读 tracing 写出的 JSONL，按阶段（span 名）打印次数、p50、p95、最大值，以及最慢的几轮各阶段耗时。
+
+用法（仓库根目录）：
+  python -m backend.trace_report                       # 默认读 TRACE_FILE 派生的各进程文件（data/trace.*.jsonl）
+  python -m backend.trace_report data/trace.llm-backend.jsonl --since 60 --slowest 5
+"""
+from __future__ import annotations
+import sys
+import json
+import math
+import time
+import argparse
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from backend.tracing import TRACE_FILE, trace_files
+
+
+def load_spans(path: str, since_s: Optional[float] = None) -> List[Dict[str, Any]]:
+    cutoff = (time.time() - since_s) * 1e9 if since_s else 0
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                s = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 进程被杀时最后一行可能不完整
+            if s.get("startTimeUnixNano", 0) >= cutoff:
+                spans.append(s)
+    return spans
+
+
+def percentile(xs: List[float], q: float) -> float:
+    """最近秩法；xs 已排序"""
+    if not xs:
+        return 0.0
+    return xs[min(len(xs) - 1, max(0, math.ceil(q * len(xs)) - 1))]
+
+
+def stage_table(spans: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    by_name: Dict[str, List[float]] = defaultdict(list)
+    service: Dict[str, str] = {}
+    for s in spans:
+        by_name[s["name"]].append(float(s.get("durationMs") or 0.0))
+        service.setdefault(s["name"], s.get("service") or "")
+    rows = []
+    for name, xs in by_name.items():
+        xs.sort()
+        rows.append({"name": name, "service": service[name], "count": len(xs),
+                     "p50": percentile(xs, 0.5), "p95": percentile(xs, 0.95), "max": xs[-1]})
+    rows.sort(key=lambda r: (r["service"], -r["p50"]))
+    return rows
+
+
+def slowest_traces(spans: List[Dict[str, Any]], n: int) -> List[Dict[str, Any]]:
+    """按根 span（没有父 span 或父 span 不在文件里）的时长排序，列出各阶段耗时"""
+    ids = {s["spanId"] for s in spans}
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for s in spans:
+        traces[s["traceId"]].append(s)
+    out = []
+    for tid, group in traces.items():
+        roots = [s for s in group if not s.get("parentSpanId") or s["parentSpanId"] not in ids]
+        start = min(s["startTimeUnixNano"] for s in group)
+        end = max(s.get("endTimeUnixNano") or s["startTimeUnixNano"] for s in group)
+        out.append({"traceId": tid, "roots": [r["name"] for r in roots], "totalMs": (end - start) / 1e6,
+                    "stages": sorted(group, key=lambda s: s["startTimeUnixNano"])})
+    out.sort(key=lambda t: -t["totalMs"])
+    return out[:n]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("paths", nargs="*", help="默认为 TRACE_FILE 派生的各进程文件")
+    ap.add_argument("--since", type=float, help="只看最近多少分钟")
+    ap.add_argument("--slowest", type=int, default=3, help="列出最慢的几轮（0 不列）")
+    args = ap.parse_args(argv)
+
+    paths = args.paths or trace_files(TRACE_FILE)
+    spans = [s for p in paths for s in load_spans(p, args.since * 60 if args.since else None)]
+    if not spans:
+        print(f"{', '.join(paths) or TRACE_FILE} 里没有 span")
+        return
+    print(f"{len(spans)} 个 span，{len({s['traceId'] for s in spans})} 条 trace\n")
+    print(f"{'服务':<14}{'阶段':<28}{'次数':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}")
+    for r in stage_table(spans):
+        print(f"{r['service'][:13]:<14}{r['name'][:27]:<28}{r['count']:>6}"
+              f"{r['p50']:>10.1f}{r['p95']:>10.1f}{r['max']:>10.1f}")
+
+    for t in slowest_traces(spans, args.slowest):
+        print(f"\ntrace {t['traceId']}  {t['totalMs']:.0f}ms  （{', '.join(t['roots'])}）")
+        t0 = t["stages"][0]["startTimeUnixNano"]
+        for s in t["stages"]:
+            offset = (s["startTimeUnixNano"] - t0) / 1e6
+            print(f"  +{offset:>8.1f}ms  {s['name']:<28}{s.get('durationMs', 0):>9.1f}ms")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+# backend/tracing.py
+"""
+分阶段耗时追踪：一轮语音 ASR -> LLM（排队/首字/生成/解析/工具）-> TTS 各记一个 span，写进本地 JSONL。
+
+- span 字段沿用 OTLP 的命名（traceId / spanId / parentSpanId / startTimeUnixNano / endTimeUnixNano / attributes），
+  导入 Jaeger/Tempo 等只需简单转换；
+- 当前 span 放在 contextvars 里：同一线程 / asyncio 任务内嵌套的 span 自动成为子 span；
+- 客户端请求 /llm 时带 x-request-id（= traceId）和 W3C traceparent 头，服务端的 span 挂在同一条 trace 下；
+- 写文件在后台线程里做，热路径上只是往队列里放一个 dict；
+- 默认关闭，TRACING=true 开启；每个进程写自己的文件（data/trace.<服务名>.jsonl），
+  超过 TRACE_MAX_MB 轮转成 .1，只留一份旧文件。
+
+报告：python -m backend.trace_report [data/trace.*.jsonl ...]
+"""
+from __future__ import annotations
+import os
+import re
+import glob
+import json
+import time
+import queue
+import atexit
+import hashlib
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+TRACING = os.getenv("TRACING", "false").lower() in ("1", "true", "yes")
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("data", "trace.jsonl"))   # 实际文件名里插入服务名，见 trace_path
+TRACE_MAX_BYTES = int(float(os.getenv("TRACE_MAX_MB", "50")) * 1024 * 1024)
+TRACE_SERVICE = os.getenv("TRACE_SERVICE", "")     # 为空时由调用方 set_service 设定
+
+REQUEST_ID_HEADER = "x-request-id"
+TRACEPARENT_HEADER = "traceparent"
+_HEX32 = re.compile(r"^[0-9a-f]{32}$")
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attrs", "_t0")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, **attrs: Any):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            # 墙钟可能被调整，时长以单调时钟为准
+            self.end_ns = self.start_ns + int((time.perf_counter() - self._t0) * 1e9)
+            _SINK.emit(self)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "service": _SERVICE,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round(self.duration_ms, 3),
+            "attributes": self.attrs,
+        }
+
+
+def trace_path(base: str, service: str, backup: bool = False) -> str:
+    """data/trace.jsonl -> data/trace.llm-backend.jsonl（轮转出的旧文件为 data/trace.llm-backend.1.jsonl）"""
+    root, ext = os.path.splitext(base)
+    if service:
+        root = f"{root}.{service}"
+    return f"{root}.1{ext}" if backup else f"{root}{ext}"
+
+
+def trace_files(base: str = TRACE_FILE) -> List[str]:
+    """base 派生出的所有进程的文件（含轮转的旧文件），旧的在前"""
+    root, ext = os.path.splitext(base)
+    files = glob.glob(glob.escape(root) + "*" + ext)
+    return sorted(files, key=lambda p: (not p.endswith(".1" + ext), p))
+
+
+class _Sink:
+    """
+    后台线程批量追加写 JSONL；进程退出时把队列里剩下的写完。
+    文件名在第一次写时按服务名确定（set_service 在进程启动时调用），各进程互不干扰，轮转也不会和别的进程抢。
+    """
+
+    def __init__(self, base: str):
+        self.base = base
+        self.path = base
+        self.max_bytes = TRACE_MAX_BYTES
+        self.rotations = 0
+        self._q: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.errors = 0
+
+    def emit(self, span: Span) -> None:
+        if not TRACING:
+            return
+        if self._thread is None:
+            self._start()
+        self._q.put(span)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="trace-sink", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._q.get()]
+            while True:
+                try:
+                    batch.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._write([s for s in batch if s is not None])
+            if stop:
+                return
+
+    def _write(self, spans) -> None:
+        if not spans:
+            return
+        self.path = trace_path(self.base, _SERVICE)
+        try:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(s.to_json(), ensure_ascii=False) + "\n" for s in spans))
+            self.written += len(spans)
+        except OSError as e:
+            self.errors += 1
+            print(f"[trace] 写入 {self.path} 失败: {e}")
+
+    def _rotate(self) -> None:
+        if self.max_bytes <= 0:
+            return
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        os.replace(self.path, trace_path(self.base, _SERVICE, backup=True))
+        self.rotations += 1
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._q.put(None)
+            self._thread.join(timeout=2)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": TRACING, "file": self.path, "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+                "written": self.written, "rotations": self.rotations, "errors": self.errors}
+
+
+_SINK = _Sink(TRACE_FILE)
+_SERVICE = TRACE_SERVICE
+_CURRENT: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+
+
+def set_service(name: str) -> None:
+    """进程的服务名（voice-client / llm-backend），写进每个 span；环境变量 TRACE_SERVICE 优先"""
+    global _SERVICE
+    if not TRACE_SERVICE:
+        _SERVICE = name
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def trace_id_for(request_id: str) -> str:
+    """x-request-id 不是 32 位十六进制时（别的客户端自定义的 id），哈希成合法的 traceId"""
+    rid = request_id.strip().lower()
+    return rid if _HEX32.match(rid) else hashlib.sha1(rid.encode("utf-8")).hexdigest()[:32]
+
+
+def parse_headers(request_id: Optional[str], traceparent: Optional[str]) -> Tuple[str, Optional[str]]:
+    """从请求头取 (traceId, 父 spanId)；都没有时开一条新 trace"""
+    m = _TRACEPARENT.match((traceparent or "").strip().lower())
+    if m:
+        return m.group(1), m.group(2)
+    if request_id:
+        return trace_id_for(request_id), None
+    return new_trace_id(), None
+
+
+def current() -> Optional[Span]:
+    return _CURRENT.get()
+
+
+def start(name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None, **attrs: Any) -> Span:
+    """开一个 span（不设为当前）；未指定 trace 时挂在当前 span 下，没有当前 span 时开新 trace"""
+    if trace_id is None:
+        parent = _CURRENT.get()
+        trace_id = parent.trace_id if parent else new_trace_id()
+        parent_id = parent.span_id if parent else None
+    return Span(name, trace_id, parent_id, **attrs)
+
+
+def attach(span: Span) -> contextvars.Token:
+    """把 span 设为当前 span；在 async 生成器里用时不必 reset（生成器所在任务结束即丢弃）"""
+    return _CURRENT.set(span)
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+         **attrs: Any) -> Iterator[Span]:
+    """with span("TTS.say"): ...  嵌套的 span 自动成为子 span；异常时记录 error 属性"""
+    s = start(name, trace_id, parent_id, **attrs)
+    token = _CURRENT.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=type(e).__name__)
+        raise
+    finally:
+        try:
+            _CURRENT.reset(token)
+        except ValueError:
+            # 同步生成器在别的上下文里被关闭时 token 不匹配，清空当前 span 即可
+            _CURRENT.set(None)
+        s.end()
+
+
+def record(name: str, t0: float, t1: Optional[float] = None, parent: Optional[Span] = None, **attrs: Any) -> None:
+    """事后补记一个阶段：t0/t1 为 time.perf_counter() 读数（t1 缺省为现在），挂在 parent（缺省为当前 span）下"""
+    if not TRACING:
+        return
+    now = time.perf_counter()
+    t1 = now if t1 is None else t1
+    if parent is not None:
+        s = Span(name, parent.trace_id, parent.span_id, **attrs)
+    else:
+        s = start(name, **attrs)
+    s.start_ns = time.time_ns() - int((now - t0) * 1e9)
+    s.end_ns = s.start_ns + int((t1 - t0) * 1e9)
+    _SINK.emit(s)
+
+
+def headers(s: Optional[Span] = None) -> Dict[str, str]:
+    """客户端发请求时带上的头：s（缺省为当前 span）的 traceId 与 traceparent；没有 span 时为空"""
+    s = s or _CURRENT.get()
+    if s is None:
+        return {}
+    return {REQUEST_ID_HEADER: s.trace_id, TRACEPARENT_HEADER: s.traceparent()}
+
+
+def stats() -> Dict[str, Any]:
+    return _SINK.stats()
@@ -0,0 +1,213 @@
+# backend/tts_worker.py
+"""
+播报线程：TTS 引擎只在一个专用线程里创建和使用，调用方（命令行主循环、Tk 的后台线程）只往队列里放句子，从不阻塞。
+
+- 文本可以一段段喂（LLM 流式增量）：SentenceSplitter 凑满一句就入队；回复开头凑够 TTS_FIRST_CLAUSE_CHARS 个字
+  遇到逗号就先播，首句不必等到句号；一直没有标点时超过 TTS_MAX_CHARS 强制切；
+- 一句一次 say + runAndWait，句与句之间可以插入取消；
+- cancel()（打断 / barge-in）：清空队列、丢掉未成句的残余，正在播的这句在引擎的下一个词回调里 stop()——
+  stop 在播报线程自己的事件循环里调用，不跨线程操作引擎；
+- wait() 等队列播完，close() 停线程。
+"""
+from __future__ import annotations
+import os
+import time
+import queue
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+
+from backend import tracing
+
+TTS_FIRST_CLAUSE_CHARS = int(os.getenv("TTS_FIRST_CLAUSE_CHARS", "6"))
+TTS_MAX_CHARS = int(os.getenv("TTS_MAX_CHARS", "80"))
+TTS_INIT_TIMEOUT = float(os.getenv("TTS_INIT_TIMEOUT", "10"))
+
+SENTENCE_END = "。！？!?；;\n"
+CLAUSE_END = "，,、：:"
+
+
+def _first_of(text: str, chars: str, start: int = 0) -> int:
+    hits = [i for i in (text.find(c, start) for c in chars) if i >= 0]
+    return min(hits) if hits else -1
+
+
+class SentenceSplitter:
+    """增量切句：feed 返回已经完整的句子，flush 返回剩下的部分"""
+
+    def __init__(self, first_clause_chars: int = TTS_FIRST_CLAUSE_CHARS, max_chars: int = TTS_MAX_CHARS):
+        self.first_clause_chars = first_clause_chars
+        self.max_chars = max_chars
+        self.reset()
+
+    def reset(self) -> None:
+        self.pending = ""
+        self.first = True
+
+    def _cut(self) -> int:
+        p = self.pending
+        cut = _first_of(p, SENTENCE_END)
+        if self.first and self.first_clause_chars > 0:
+            clause = _first_of(p, CLAUSE_END, self.first_clause_chars - 1)
+            if clause >= 0 and (cut < 0 or clause < cut):
+                cut = clause
+        if cut < 0 and len(p) >= self.max_chars:
+            head = p[:self.max_chars]
+            cut = max(max(head.rfind(c) for c in CLAUSE_END + " "), 0) or self.max_chars - 1
+        return cut
+
+    def feed(self, text: str) -> List[str]:
+        self.pending += text
+        out = []
+        while True:
+            cut = self._cut()
+            if cut < 0:
+                return out
+            piece, self.pending = self.pending[:cut + 1].strip(), self.pending[cut + 1:]
+            if piece:
+                out.append(piece)
+                self.first = False
+
+    def flush(self) -> List[str]:
+        piece = self.pending.strip()
+        self.reset()
+        return [piece] if piece else []
+
+
+class SpeechWorker:
+    """
+    engine_factory 在播报线程里调用，返回 pyttsx3 风格的引擎（say / runAndWait / stop / connect）。
+    引擎创建失败时构造函数抛出同样的异常（和原来直接 pyttsx3.init() 一致）。
+    """
+
+    def __init__(self, engine_factory: Callable[[], Any]):
+        self._factory = engine_factory
+        self.engine: Any = None
+        self._q: "queue.Queue[Optional[Tuple[int, str, Optional[tracing.Span], float]]]" = queue.Queue()
+        self._splitter = SentenceSplitter()
+        self._lock = threading.Lock()               # 喂文本 / 取消可能来自不同线程
+        self._gen = 0                               # 每次 cancel 加一，旧一代的句子直接丢弃
+        self._speaking_gen: Optional[int] = None
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+        self.spoken = 0
+        self.cancelled = 0
+        self._thread = threading.Thread(target=self._run, name="tts-worker", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(TTS_INIT_TIMEOUT):
+            raise TimeoutError("TTS 引擎初始化超时")
+        if self._error is not None:
+            raise self._error
+
+    # ---------- 调用方 ----------
+    def feed(self, text: str) -> None:
+        """喂一段增量文本，凑满的句子立即入队"""
+        if not text:
+            return
+        with self._lock:
+            for s in self._splitter.feed(text):
+                self._put(s)
+
+    def flush(self) -> None:
+        """这段回复结束：剩下不成句的部分也入队"""
+        with self._lock:
+            for s in self._splitter.flush():
+                self._put(s)
+
+    def say(self, text: str) -> None:
+        """整段文本按句入队后立即返回，不等播完"""
+        if not text:
+            return
+        with self._lock:
+            for s in self._splitter.feed(text) + self._splitter.flush():
+                self._put(s)
+
+    def _put(self, sentence: str) -> None:
+        with self._idle:
+            self._pending += 1
+        self._q.put((self._gen, sentence, tracing.current(), time.perf_counter()))
+
+    def cancel(self) -> None:
+        """打断：丢掉排队和未成句的文本，正在播的这句尽快停"""
+        with self._lock:
+            self._gen += 1
+            self._splitter.reset()
+        while True:
+            try:
+                item = self._q.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._q.put(None)
+                break
+            self._done()
+        if self._speaking_gen is not None:
+            self.cancelled += 1
+
+    @property
+    def speaking(self) -> bool:
+        return self._pending > 0
+
+    @property
+    def generation(self) -> int:
+        """每次 cancel 加一；边收边喂的调用方（GUI 的后台线程）据此判断这段回复是否已被打断"""
+        return self._gen
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等到队列播完（或被取消）；超时返回 False"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self) -> None:
+        self.cancel()
+        self._q.put(None)
+        self._thread.join(timeout=2)
+
+    # ---------- 播报线程 ----------
+    def _done(self) -> None:
+        with self._idle:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def _on_word(self, name=None, location=None, length=None) -> None:
+        # 引擎事件循环里的回调：本句已被取消就停下
+        if self._speaking_gen is not None and self._speaking_gen != self._gen:
+            self.engine.stop()
+
+    def _run(self) -> None:
+        try:
+            try:
+                import comtypes  # Windows SAPI5：非主线程用 COM 前需要初始化
+                comtypes.CoInitialize()
+            except ImportError:
+                pass
+            self.engine = self._factory()
+            self.engine.connect("started-word", self._on_word)
+        except BaseException as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            gen, text, parent, enqueued = item
+            try:
+                if gen != self._gen:
+                    continue
+                self._speaking_gen = gen
+                t0 = time.perf_counter()
+                try:
+                    self.engine.say(text)
+                    self.engine.runAndWait()
+                except Exception as e:
+                    print(f"[TTS] 播报失败: {type(e).__name__}: {e}")
+                self.spoken += 1
+                tracing.record("TTS.say", t0, parent=parent, chars=len(text),
+                               queued_ms=round((t0 - enqueued) * 1000, 1), cancelled=gen != self._gen)
+            finally:
+                self._speaking_gen = None
+                self._done()
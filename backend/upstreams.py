@@ -0,0 +1,250 @@
+# backend/upstreams.py
+"""
+多上游 LLM 路由：若干本地 llama.cpp + 云端，按延迟与排队情况挑选。
+
+- 评分：EWMA 延迟 × (1 + 在途请求数 / 并发上限)，越小越好；首字节延迟（流式）和整次延迟（非流式）分开统计，
+  流式请求按前者、非流式请求按后者选路和对冲；
+- 会话亲和：同一 session_id 优先回到上次的上游（KV 缓存还在），除非它明显更慢；
+- 熔断：连续失败 BREAKER_FAILURES 次后打开，冷却 BREAKER_COOLDOWN 秒后半开放行一个请求试探；
+- 健康探测：后台定期请求 /health（llama.cpp）或 /models（云端）；
+- 对冲：由调用方（llm_app）在 hedge_delay() 之后向第二个上游再发一份，取先返回的。
+
+配置：LLM_UPSTREAMS 为 JSON 列表，例如
+[{"name": "gpu", "base": "http://127.0.0.1:8080", "model": "qwen2.5-3b-instruct", "local": true, "max_inflight": 4},
+ {"name": "cloud", "base": "https://api.deepseek.com/v1", "model": "deepseek-chat", "local": false, "api_key_env": "LLM_API_KEY"}]
+未配置时退化为单个上游（沿用 LLAMA_BASE / LLAMA_MODEL / USE_LOCAL_MODEL）。
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import asyncio
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Set
+
+if TYPE_CHECKING:                       # 只用于类型标注；client 由 llm_app 传入
+    import httpx
+
+EWMA_ALPHA = float(os.getenv("UPSTREAM_EWMA_ALPHA", "0.3"))
+EWMA_PRIOR_MS = float(os.getenv("UPSTREAM_EWMA_PRIOR_MS", "800"))   # 尚无样本时的假定首字节延迟
+EWMA_PRIOR_TOTAL_MS = float(os.getenv("UPSTREAM_EWMA_PRIOR_TOTAL_MS", "3000"))   # 尚无样本时的假定整次延迟
+BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "15"))
+HEALTH_INTERVAL = float(os.getenv("UPSTREAM_HEALTH_INTERVAL", "10"))
+AFFINITY_SLACK = float(os.getenv("UPSTREAM_AFFINITY_SLACK", "1.5"))  # 亲和上游评分不超过最优的这么多倍就继续用
+HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE", "true").lower() in ("1", "true", "yes")
+HEDGE_AFTER_MS = float(os.getenv("UPSTREAM_HEDGE_AFTER_MS", "0"))   # 0 表示按 EWMA 自动估计
+HEDGE_MIN_MS, HEDGE_MAX_MS = 300.0, 5000.0
+HEDGE_MAX_TOTAL_MS = 60000.0
+
+
+@dataclass
+class Upstream:
+    name: str
+    base: str
+    model: str
+    local: bool = True
+    api_key: str = ""
+    auth_scheme: str = "Bearer"
+    max_inflight: int = 4
+    slots: int = 0                      # llama-server 并行槽位数（id_slot 亲和用），0 为不指定
+    response_format: str = ""           # 输出约束方式 json_schema / json_object / none，空为按 local 自动选择
+    native_tools: bool = False          # 支持 function calling：工具走 tools 参数，tool_calls 转回 JSON-ReAct
+    # ---- 运行时状态 ----
+    ttfb_ms: float = EWMA_PRIOR_MS      # 流式首字节延迟 EWMA
+    total_ms: float = EWMA_PRIOR_TOTAL_MS   # 非流式整次调用延迟 EWMA
+    inflight: int = 0
+    failures: int = 0                   # 连续失败次数
+    state: str = "closed"               # closed | open | half_open
+    opened_at: float = 0.0
+    healthy: bool = True
+    legacy_only: bool = False           # /v1/chat/completions 404 过，直接走 /completion
+    requests: int = 0
+    errors: int = 0
+    hedges_won: int = 0
+    last_error: str = ""
+    _trial_inflight: bool = field(default=False, repr=False)
+
+    @property
+    def chat_url(self) -> str:
+        base = self.base.rstrip("/")
+        return f"{base}/chat/completions" if base.endswith("/v1") else f"{base}/v1/chat/completions"
+
+    @property
+    def completion_url(self) -> str:
+        return f"{self.base.rstrip('/')}/completion"
+
+    @property
+    def probe_url(self) -> str:
+        base = self.base.rstrip("/")
+        if self.local:
+            return (base[:-3] if base.endswith("/v1") else base) + "/health"
+        return (base if base.endswith("/v1") else base + "/v1") + "/models"
+
+    @property
+    def output_format(self) -> str:
+        """llama.cpp 支持 JSON Schema 约束解码；云端默认只要求 JSON 对象（DeepSeek 等不支持 schema）"""
+        return self.response_format or ("json_schema" if self.local else "json_object")
+
+    def headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if not self.local:
+            headers["Authorization"] = f"{self.auth_scheme} {self.api_key}"
+        return headers
+
+    def latency(self, kind: str = "ttfb") -> float:
+        """kind: ttfb（流式首字节）| total（非流式整次）"""
+        return self.total_ms if kind == "total" else self.ttfb_ms
+
+    def score(self, kind: str = "ttfb") -> float:
+        return self.latency(kind) * (1.0 + self.inflight / max(self.max_inflight, 1))
+
+    def available(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        if self.state == "open":
+            if now - self.opened_at < BREAKER_COOLDOWN:
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            return not self._trial_inflight   # 半开状态只放行一个试探请求
+        return True
+
+    def record_success(self, latency_ms: float, kind: str = "ttfb") -> None:
+        if kind == "total":
+            self.total_ms = EWMA_ALPHA * latency_ms + (1 - EWMA_ALPHA) * self.total_ms
+        else:
+            self.ttfb_ms = EWMA_ALPHA * latency_ms + (1 - EWMA_ALPHA) * self.ttfb_ms
+        self.failures = 0
+        self.state = "closed"
+
+    def record_failure(self, err: BaseException) -> None:
+        self.errors += 1
+        self.failures += 1
+        self.last_error = f"{type(err).__name__}: {err}"[:200]
+        if self.state == "half_open" or self.failures >= BREAKER_FAILURES:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name, "base": self.base, "model": self.model, "local": self.local,
+            "healthy": self.healthy, "breaker": self.state,
+            "ttfb_ms": round(self.ttfb_ms, 1), "total_ms": round(self.total_ms, 1),
+            "inflight": self.inflight, "max_inflight": self.max_inflight,
+            "requests": self.requests, "errors": self.errors, "hedges_won": self.hedges_won,
+            "consecutive_failures": self.failures, "legacy_only": self.legacy_only,
+            "output_format": self.output_format,
+            "last_error": self.last_error or None,
+        }
+
+
+class NoUpstreamAvailable(RuntimeError):
+    pass
+
+
+class UpstreamPool:
+    def __init__(self, upstreams: List[Upstream]):
+        if not upstreams:
+            raise ValueError("至少需要一个上游")
+        self.upstreams = upstreams
+        self._affinity: Dict[str, str] = {}     # session_id -> 上游名
+        self.hedges = 0
+
+    def pick(self, session_id: Optional[str] = None, exclude: Optional[Set[str]] = None,
+             kind: str = "ttfb") -> Upstream:
+        now = time.monotonic()
+        exclude = exclude or set()
+        cands = [u for u in self.upstreams if u.name not in exclude and u.available(now)]
+        if not cands:
+            # 全部熔断/不健康时，退而求其次选一个没被排除的，总比直接报错好
+            cands = [u for u in self.upstreams if u.name not in exclude]
+            if not cands:
+                raise NoUpstreamAvailable("没有可用的上游")
+        best = min(cands, key=lambda u: u.score(kind))
+        if session_id:
+            prev = next((u for u in cands if u.name == self._affinity.get(session_id)), None)
+            if prev is not None and prev.score(kind) <= best.score(kind) * AFFINITY_SLACK:
+                best = prev
+            self._affinity[session_id] = best.name
+            if len(self._affinity) > 4096:
+                self._affinity.pop(next(iter(self._affinity)))
+        return best
+
+    def alternatives(self, exclude: Set[str]) -> int:
+        now = time.monotonic()
+        return sum(1 for u in self.upstreams if u.name not in exclude and u.available(now))
+
+    @contextmanager
+    def track(self, up: Upstream) -> Iterator[None]:
+        """在途计数；半开状态下标记试探请求"""
+        up.requests += 1
+        up.inflight += 1
+        trial = up.state == "half_open"
+        if trial:
+            up._trial_inflight = True
+        try:
+            yield
+        finally:
+            up.inflight -= 1
+            if trial:
+                up._trial_inflight = False
+
+    def hedge_delay(self, up: Upstream, kind: str = "ttfb") -> Optional[float]:
+        """
+        多久没结果就对冲（秒）：流式看首字节（kind="ttfb"），非流式看整次返回（kind="total"）；
+        不满足对冲条件时返回 None。UPSTREAM_HEDGE_AFTER_MS 只作用于流式首字节，非流式始终按整次延迟估计。
+        """
+        if not HEDGE_ENABLED or len(self.upstreams) < 2:
+            return None
+        if kind == "total":
+            ms = min(max(2.0 * up.total_ms, HEDGE_MIN_MS), HEDGE_MAX_TOTAL_MS)
+        else:
+            ms = HEDGE_AFTER_MS or min(max(2.0 * up.ttfb_ms, HEDGE_MIN_MS), HEDGE_MAX_MS)
+        return ms / 1000.0
+
+    async def probe_once(self, client: httpx.AsyncClient) -> None:
+        async def probe(up: Upstream) -> None:
+            try:
+                r = await client.get(up.probe_url, headers=up.headers(), timeout=3.0)
+                up.healthy = r.status_code < 500
+            except Exception as e:
+                up.healthy = False
+                up.last_error = f"probe {type(e).__name__}: {e}"[:200]
+        await asyncio.gather(*(probe(u) for u in self.upstreams))
+
+    async def probe_loop(self, client_factory) -> None:
+        """lifespan 中后台运行；client_factory 返回共享的 httpx.AsyncClient"""
+        while True:
+            try:
+                await self.probe_once(client_factory())
+            except Exception as e:
+                print(f"[Warn] upstream probe failed: {e}")
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hedges": self.hedges, "upstreams": [u.stats() for u in self.upstreams]}
+
+
+def load_upstreams(default: Upstream) -> UpstreamPool:
+    """按 LLM_UPSTREAMS 构建上游池；未配置时只有 default 一个"""
+    raw = os.getenv("LLM_UPSTREAMS")
+    if not raw:
+        return UpstreamPool([default])
+    ups = []
+    for i, cfg in enumerate(json.loads(raw)):
+        api_key = cfg.get("api_key") or os.getenv(cfg.get("api_key_env", ""), "")
+        ups.append(Upstream(
+            name=cfg.get("name") or f"upstream-{i}",
+            base=cfg["base"],
+            model=cfg.get("model", default.model),
+            local=bool(cfg.get("local", True)),
+            api_key=api_key,
+            auth_scheme=cfg.get("auth_scheme", default.auth_scheme),
+            max_inflight=int(cfg.get("max_inflight", 4)),
+            slots=int(cfg.get("slots", default.slots)),
+            response_format=cfg.get("response_format", ""),
+            native_tools=bool(cfg.get("native_tools", False)),
+        ))
+    return UpstreamPool(ups)
@@ -3,24 +3,34 @@ import time
 import uuid
 import json
 import hashlib
-import threading
 import typing
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Callable
 
+import numpy as np
 import requests
 import speech_recognition as sr
 import pyttsx3
-from backend.prompt import SYSTEM_PROMPT
+from backend.prompt import SYSTEM_PROMPT, date_message
+from backend.history import HistoryManager, Summarizer, make_llm_summarizer
+from backend import tracing
+from backend.audio_capture import MicCapture, EnergyVAD, make_vad
+from backend.asr_engines import ASR_ENGINE, make_engine, stream_utterance
+from backend.tts_worker import SpeechWorker
 import datetime as dt
 # ================== 配置 ==================
 LLM_ENDPOINT = os.getenv("LLM_ENDPOINT", "http://127.0.0.1:8001/llm")
 LLM_MODEL = os.getenv("LLAMA_MODEL", "qwen2.5-3b-instruct")
+HISTORY_SUMMARY_LLM = os.getenv("HISTORY_SUMMARY_LLM", "false").lower() in ("1", "true", "yes")  # 用 LLM 而非抽取式摘要
+USE_STREAM = os.getenv("LLM_STREAM", "true").lower() in ("1", "true", "yes")  # 走 /llm/stream，边生成边播报
 
 # 语音识别参数
-USE_GOOGLE = True        # True: Google Web Speech；False: 强制离线 Sphinx
+# 识别引擎（backend/asr_engines.py）：ASR_ENGINE=auto 时装了 faster_whisper 就本地流式识别，否则走下面的 Google/Sphinx
+USE_GOOGLE = True        # speech_recognition 引擎下 True: Google Web Speech；False: 强制离线 Sphinx
 LANG_CODE = "zh-CN"      # 识别语言（可改为 "en-US" 等）
 PHRASE_TIME_LIMIT = 12   # 单次说话最长秒数
 ENERGY_THRESHOLD = None  # None 表示自动；或设为 300~400 这样的固定阈值
+# 常驻麦克风：设备只打开一次，后台持续采集 + VAD 切句（backend/audio_capture.py）；false 时每轮打开设备并校准 1 秒
+PERSISTENT_MIC = os.getenv("ASR_PERSISTENT_MIC", "true").lower() in ("1", "true", "yes")
 
 # TTS 参数（pyttsx3 离线）
 VOICE_NAME_CONTAINS = None   # 指定包含关键字的声音，如 "Chinese"；None 自动
@@ -39,21 +49,28 @@ def make_idempotency_key(text: str, session_id: str) -> str:
 
 # ================== LLM 客户端 ==================
 class LLMClient:
-    def __init__(self, endpoint: str, model: str):
+    def __init__(self, endpoint: str, model: str, summarizer: Optional[Summarizer] = None):
         self.endpoint = endpoint.rstrip("/")
         self.model = model
         self.session_id = str(uuid.uuid4())
-        self.messages: List[Dict[str, str]] = []
+        # 按模型的 token 预算维护历史：system 固定、最近若干轮原样保留、更早的后台并入摘要
+        if summarizer is None and HISTORY_SUMMARY_LLM:
+            summarizer = make_llm_summarizer(self.endpoint)
+        self.history = HistoryManager(model, summarizer=summarizer)
         self._last_sent: Dict[str, float] = {}  # idem_key -> ts
 
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        return self.history.build()
+
     def add_system(self, content: str):
-        self.messages.append({"role": "system", "content": content})
+        self.history.set_system(content)
 
     def add_user(self, content: str):
-        self.messages.append({"role": "user", "content": content})
+        self.history.add("user", content)
 
     def add_assistant(self, content: str):
-        self.messages.append({"role": "assistant", "content": content})
+        self.history.add("assistant", content)
 
     def _prune_idem(self):
         now = time.time()
@@ -61,17 +78,16 @@ class LLMClient:
             if now - ts > IDEM_TTL:
                 self._last_sent.pop(k, None)
 
+    def _messages_to_send(self) -> List[Dict[str, str]]:
+        # system prompt 原样发送（不再替换日期），前缀每轮一致，llama.cpp 才能复用 KV 缓存；
+        # 日期作为最后一条 system 消息追加。消息字典不会被修改，无需逐条拷贝。
+        messages = self.messages
+        messages.append(date_message(dt.date.today().isoformat()))
+        return messages
+
     def chat(self, temperature: float = 0.7, max_tokens: int = 512) -> str:
-        # 复制一份消息历史，避免修改原始列表
-        messages_to_send = [msg.copy() for msg in self.messages]
-        
-        # 检查并替换 system prompt 中的日期占位符
-        if messages_to_send and messages_to_send[0]['role'] == 'system':
-            today_str = dt.date.today().isoformat()
-            original_prompt = messages_to_send[0]['content']
-            # 使用 .replace() 方法替换占位符
-            updated_prompt = original_prompt.replace('{{current_date}}', today_str)
-            messages_to_send[0]['content'] = updated_prompt
+        self.history.reserve = max_tokens
+        messages_to_send = self._messages_to_send()
         payload = {
             "messages": messages_to_send,
             "session_id": self.session_id,
@@ -79,54 +95,108 @@ class LLMClient:
             "max_tokens": max_tokens,
         }
         # 用最后一条 user 内容生成幂等键
-        last_user = next((m["content"] for m in reversed(self.messages) if m["role"] == "user"), "")
+        last_user = next((m["content"] for m in reversed(messages_to_send) if m["role"] == "user"), "")
         idem_key = make_idempotency_key(last_user, self.session_id)
-        headers = {"x-idempotency-key": idem_key}
 
         self._prune_idem()
         self._last_sent[idem_key] = time.time()
 
+        # x-request-id / traceparent 让服务端的各阶段 span 挂在这一轮的 trace 下
+        with tracing.span("LLMClient.chat") as sp:
+            headers = {"x-idempotency-key": idem_key, **tracing.headers()}
+            try:
+                r = requests.post(self.endpoint, json=payload, headers=headers, timeout=60)
+                r.raise_for_status()
+                data = r.json()
+                text = data.get("text", "").strip()
+                sp.set(status=r.status_code, chars=len(text))
+                return text
+            except Exception as e:
+                sp.set(error=type(e).__name__)
+                return f"[本地模型暂不可用] {type(e).__name__}: {e}"
+
+    def chat_stream(self, temperature: float = 0.7, max_tokens: int = 512) -> Iterator[str]:
+        """
+        调用 /llm/stream，逐段产出 answer 的文本增量（可边收边播报）。
+        调用方自行拼接完整回复并 add_assistant。
+        """
+        self.history.reserve = max_tokens
+        payload = {
+            "messages": self._messages_to_send(),
+            "session_id": self.session_id,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        streamed = False
+        # 生成器在两次 yield 之间会执行调用方的代码（边收边播），span 不设为当前，免得 TTS 的 span 挂到它下面；
+        # 它的时长包含调用方播报的时间，首个 answer 的到达时间另记 llm.first_answer
+        sp = tracing.start("LLMClient.chat_stream")
+        t0 = time.perf_counter()
         try:
-            r = requests.post(self.endpoint, json=payload, headers=headers, timeout=60)
-            r.raise_for_status()
-            data = r.json()
-            text = data.get("text", "").strip()
-            return text
+            with requests.post(self.endpoint + "/stream", json=payload, headers=tracing.headers(sp),
+                               stream=True, timeout=60) as r:
+                r.raise_for_status()
+                r.encoding = "utf-8"  # text/event-stream 未声明 charset 时 requests 默认按 latin-1 解码
+                event = ""
+                for line in r.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                        continue
+                    if not line.startswith("data:"):
+                        continue
+                    data = json.loads(line[5:].strip())
+                    if event == "answer":
+                        if not streamed:
+                            tracing.record("llm.first_answer", t0, parent=sp)
+                        streamed = True
+                        yield data.get("delta", "")
+                    elif event == "done" and not streamed:
+                        # 模型没按 JSON 输出时，answer 只在 done 里给出
+                        yield (data.get("text") or "").strip()
         except Exception as e:
-            return f"[本地模型暂不可用] {type(e).__name__}: {e}"
+            sp.set(error=type(e).__name__)
+            if not streamed:
+                yield f"[本地模型暂不可用] {type(e).__name__}: {e}"
+        finally:
+            sp.end()
 
 
 # ================== TTS 播放器（pyttsx3） ==================
-class TTS:
+class TTS(SpeechWorker):
+    """
+    pyttsx3 引擎在独立的播报线程里创建和运行（backend/tts_worker.py）：say / feed 只是按句入队，立即返回；
+    cancel() 打断正在播的回复，wait() 等播完
+    """
+
     def __init__(self):
-        self.engine = pyttsx3.init()
-        self.engine.setProperty("rate", TTS_RATE)
-        self.engine.setProperty("volume", TTS_VOLUME)
-        self._choose_voice(VOICE_NAME_CONTAINS)
-
-        # 独立线程异步播报，避免阻塞主循环
-        self._lock = threading.Lock()
-    def _choose_voice(self, contains: Optional[str]):
+        super().__init__(self._make_engine)
+
+    def _make_engine(self):
+        engine = pyttsx3.init()
+        engine.setProperty("rate", TTS_RATE)
+        engine.setProperty("volume", TTS_VOLUME)
+        self._choose_voice(engine, VOICE_NAME_CONTAINS)
+        return engine
+
+    @staticmethod
+    def _choose_voice(engine, contains: Optional[str]):
         if contains:
             # <-- 2. 修复点：使用 typing.cast
-            voices = typing.cast(list, self.engine.getProperty("voices"))
+            voices = typing.cast(list, engine.getProperty("voices"))
             for v in voices:
                 name = getattr(v, "name", "") or ""
                 if contains.lower() in name.lower():
-                    self.engine.setProperty("voice", v.id)
+                    engine.setProperty("voice", v.id)
                     break
 
-    def say(self, text: str):
-        if not text:
-            return
-        with self._lock:
-            self.engine.say(text)
-            self.engine.runAndWait()
-
 
 # ================== 语音识别（speech_recognition） ==================
 class ASR:
-    def __init__(self, lang: str = "zh-CN", phrase_time_limit: int = 12, energy_threshold: Optional[int] = None):
+    def __init__(self, lang: str = "zh-CN", phrase_time_limit: int = 12, energy_threshold: Optional[int] = None,
+                 muted: Optional[Callable[[], bool]] = None):
+        """muted：返回 True 时常驻麦克风不做端点检测（传 lambda: tts.speaking，免得把自己的播报识别成用户说话）"""
         self.rec = sr.Recognizer()
         self.lang = lang
         self.phrase_time_limit = phrase_time_limit
@@ -135,35 +205,110 @@ class ASR:
             self.rec.dynamic_energy_threshold = False
         else:
             self.rec.dynamic_energy_threshold = True  # 自动适配环境噪声
-
-    def listen_once(self) -> Optional[str]:
-        """按回车开始后调用；返回识别文本或 None"""
-        with sr.Microphone() as mic:
-            if self.rec.dynamic_energy_threshold:
-                print(">>> 环境噪声校准中（1秒）…")
-                self.rec.adjust_for_ambient_noise(mic, duration=1)
-            print(f"🎙️ 开始说话（最长 {self.phrase_time_limit}s）…")
-            audio = self.rec.listen(mic, timeout=None, phrase_time_limit=self.phrase_time_limit)
-        # 优先 Google，失败则退回 Sphinx
-        if USE_GOOGLE:
+        self._energy_threshold = energy_threshold
+        self._capture: Optional[MicCapture] = None
+        self._persistent = PERSISTENT_MIC
+        self._muted = muted
+        # 模型只在这里加载一次；faster_whisper 不可用时 auto 退回 Google/Sphinx
+        self.engine = make_engine(ASR_ENGINE, language=lang, recognizer=self.rec, google=USE_GOOGLE)
+
+    def _mic(self) -> Optional[MicCapture]:
+        """首次使用时打开常驻采集；打不开（没有 pyaudio、设备被占用）时退回每轮打开设备"""
+        if self._capture is None and self._persistent:
+            # 固定阈值时按绝对能量判定，不随底噪浮动
+            vad = make_vad() if self._energy_threshold is None else EnergyVAD(ratio=1.0, min_rms=self._energy_threshold)
             try:
-                text = self.rec.recognize_google(audio, language=self.lang) # type: ignore
-                return text.strip()
+                self._capture = MicCapture(vad=vad, muted=self._muted).start()
             except Exception as e:
-                print(f"[Google 识别失败，退回 Sphinx] {e}")
-        # Sphinx（离线）
+                print(f"[ASR] 常驻麦克风启动失败，改为每轮打开设备: {type(e).__name__}: {e}")
+                self._persistent = False
+        return self._capture
+
+    def close(self) -> None:
+        if self._capture is not None:
+            self._capture.stop()
+            self._capture = None
+
+    def listen_once(self, on_partial: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """按回车开始后调用；返回识别文本或 None。流式引擎在说话过程中把部分结果回调给 on_partial"""
+        with tracing.span("ASR.listen_once", engine=self.engine.name) as sp:
+            cap = self._mic()
+            if cap is not None:
+                print(f"🎙️ 开始说话（最长 {self.phrase_time_limit}s）…")
+                session = self.engine.session(cap.sample_rate)
+                with tracing.span("asr.capture", vad=cap.vad.name) as cs:
+                    utt = stream_utterance(cap, session, max_seconds=self.phrase_time_limit,
+                                           on_partial=on_partial)
+                    partials = session.decodes
+                    cs.set(partial_decodes=partials)
+                # 说话中已经识别到结尾时直接复用，否则只补识别最后一小段
+                try:
+                    with tracing.span("asr.recognition", engine=self.engine.name) as rs:
+                        text = session.finalize(utt.pcm)
+                        rs.set(reused=session.decodes == partials, audio_s=round(utt.duration, 2))
+                except Exception as e:
+                    print(f"[{self.engine.name} 识别失败] {type(e).__name__}: {e}")
+                    text = None
+            else:
+                with sr.Microphone() as mic:
+                    if self.rec.dynamic_energy_threshold:
+                        print(">>> 环境噪声校准中（1秒）…")
+                        with tracing.span("asr.calibration"):
+                            self.rec.adjust_for_ambient_noise(mic, duration=1)
+                    print(f"🎙️ 开始说话（最长 {self.phrase_time_limit}s）…")
+                    with tracing.span("asr.capture"):
+                        audio = self.rec.listen(mic, timeout=None, phrase_time_limit=self.phrase_time_limit)
+                text = self._recognize(audio)
+            text = (text or "").strip() or None
+            sp.set(recognized=text is not None)
+            return text
+
+    def _recognize(self, audio) -> Optional[str]:
+        pcm = np.frombuffer(audio.get_raw_data(convert_width=2), dtype=np.int16)
         try:
-            text = self.rec.recognize_sphinx(audio, language=self.lang) # type: ignore
-            return text.strip()
+            with tracing.span("asr.recognition", engine=self.engine.name):
+                return self.engine.transcribe(pcm, audio.sample_rate)
         except Exception as e:
-            print(f"[Sphinx 识别失败] {e}")
+            print(f"[{self.engine.name} 识别失败] {type(e).__name__}: {e}")
             return None
 
 
 # ================== 主循环 ==================
+def turn(llm: LLMClient, asr: ASR, tts: TTS) -> None:
+    """一轮：听一句 -> 问 LLM -> 播报"""
+    # 部分结果在同一行刷新显示
+    user_text = asr.listen_once(on_partial=lambda t: print(f"\r… {t}", end="", flush=True))
+    print("\r", end="")
+    if not user_text:
+        print("（未识别到有效语音）\n")
+        return
+
+    print(f"👤 你：{user_text}")
+    llm.add_user(user_text)
+
+    if USE_STREAM:
+        # 增量喂给播报线程：首个分句凑够就开始播，生成和播报并行
+        parts: List[str] = []
+        print("🤖 助手：", end="", flush=True)
+        for delta in llm.chat_stream(temperature=0.2, max_tokens=512):
+            print(delta, end="", flush=True)
+            parts.append(delta)
+            tts.feed(delta)
+        print("\n")
+        tts.flush()
+        llm.add_assistant("".join(parts).strip())
+        return
+
+    reply = llm.chat(temperature=0.2, max_tokens=512)
+    llm.add_assistant(reply)
+    print(f"🤖 助手：{reply}\n")
+
+    # 语音播报
+    tts.say(reply)
 
 
 def main():
+    tracing.set_service("voice-client")
     print("== Voice Chat Client ==")
     print(f"- LLM endpoint: {LLM_ENDPOINT}")
     print("提示：按 Enter 说话，输入 q + Enter 退出。\n")
@@ -172,28 +317,22 @@ def main():
     llm.add_system(SYSTEM_PROMPT)
 
     tts = TTS()
-    asr = ASR(lang=LANG_CODE, phrase_time_limit=PHRASE_TIME_LIMIT, energy_threshold=ENERGY_THRESHOLD)
+    asr = ASR(lang=LANG_CODE, phrase_time_limit=PHRASE_TIME_LIMIT, energy_threshold=ENERGY_THRESHOLD,
+              muted=lambda: tts.speaking)
 
     while True:
+        # 播报在后台进行，提示符立即出现；播报中按 Enter 即打断（barge-in）
         cmd = input("按 Enter 开始说话（q 退出）> ").strip().lower()
+        tts.cancel()
         if cmd == "q":
             break
 
-        user_text = asr.listen_once()
-        if not user_text:
-            print("（未识别到有效语音）\n")
-            continue
-
-        print(f"👤 你：{user_text}")
-        llm.add_user(user_text)
-
-        reply = llm.chat(temperature=0.2, max_tokens=512)
-        llm.add_assistant(reply)
-        print(f"🤖 助手：{reply}\n")
-
-        # 语音播报
-        tts.say(reply)
+        # 一轮对话一条 trace：ASR、LLM 请求（及服务端各阶段）、TTS 都挂在 voice.turn 下
+        with tracing.span("voice.turn"):
+            turn(llm, asr, tts)
 
+    asr.close()
+    tts.close()
     print("Bye.")
 
 
@@ -0,0 +1,109 @@
+# bench/asr_batch.py
+"""
+对比识别服务逐段识别与跨会话攒批（backend/asr_batcher.py）在 CPU 上的吞吐和延迟。
+
+模拟 --clients 个客户端同时说话：每个客户端闭环地连续提交 --requests 段音频（上一段识别完才交下一段），
+分别跑
+- unbatched：FasterWhisperEngine.decode 逐段识别，--workers 个请求可并行（WhisperModel num_workers 同值）；
+- batch=N：BatchedEngine 攒批，窗口 --wait-ms，每批最多 N 段。
+输出每种配置的吞吐（段/秒）、单段延迟 p50/p95、平均批大小。
+
+音频：给了 wav（16kHz 单声道 16bit）就轮流用这些文件，否则用合成的类语音信号（只适合看编码器开销，解码的 token 数偏少）。
+
+用法（仓库根目录）：
+  python -m bench.asr_batch [a.wav b.wav ...] --clients 8 --requests 4 --batch-sizes 2,4,8 --wait-ms 30
+"""
+from __future__ import annotations
+import sys
+import time
+import wave
+import argparse
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from backend.asr_engines import ASR_MODEL, ASREngine, FasterWhisperEngine
+from backend.asr_batcher import BatchedEngine
+from backend.trace_report import percentile
+
+SAMPLE_RATE = 16000
+
+
+def load_wav(path: Path) -> np.ndarray:
+    with wave.open(str(path), "rb") as w:
+        if w.getsampwidth() != 2 or w.getnchannels() != 1 or w.getframerate() != SAMPLE_RATE:
+            raise ValueError(f"{path} 不是 16kHz 单声道 16bit")
+        return np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+
+
+def synth_utterance(seconds: float, seed: int) -> np.ndarray:
+    """基频抖动的谐波 + 音节包络 + 底噪"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    f0 = 140 + 30 * np.sin(2 * np.pi * 0.7 * t + seed)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = np.clip(np.sin(2 * np.pi * 3.5 * t), 0, None)
+    x = 4000 * voice * envelope + rng.normal(0, 80, t.size)
+    return np.clip(x, -32768, 32767).astype(np.int16)
+
+
+def run(engine: ASREngine, clips: List[np.ndarray], clients: int, requests: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def client(c: int) -> None:
+        for r in range(requests):
+            pcm = clips[(c * requests + r) % len(clips)]
+            t0 = time.perf_counter()
+            engine.decode(pcm, SAMPLE_RATE)
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return {"n": len(latencies), "wall": wall, "throughput": len(latencies) / wall,
+            "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95)}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("wavs", nargs="*", type=Path)
+    ap.add_argument("--model", default=ASR_MODEL)
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=4, help="每个客户端提交几段")
+    ap.add_argument("--workers", type=int, default=1, help="WhisperModel num_workers / 同时推理的批数")
+    ap.add_argument("--batch-sizes", default="2,4,8")
+    ap.add_argument("--wait-ms", type=float, default=30)
+    ap.add_argument("--seconds", type=float, default=3.0, help="合成音频每段时长")
+    args = ap.parse_args(argv)
+
+    clips = [load_wav(p) for p in args.wavs] or [synth_utterance(args.seconds, i) for i in range(8)]
+    engine = FasterWhisperEngine(args.model, num_workers=args.workers)
+    engine.decode(clips[0], SAMPLE_RATE)          # 预热
+    engine.decode_batch([(clips[0], SAMPLE_RATE, "")] * 2)
+    print(f"{len(clips)} 段音频，平均 {np.mean([c.size for c in clips]) / SAMPLE_RATE:.1f}s；"
+          f"{args.clients} 个客户端 × {args.requests} 段，workers={args.workers}\n")
+    print(f"{'配置':<14}{'吞吐(段/s)':>12}{'p50(ms)':>10}{'p95(ms)':>10}{'平均批':>8}")
+
+    base = run(engine, clips, args.clients, args.requests)
+    print(f"{'unbatched':<14}{base['throughput']:>12.2f}{base['p50'] * 1000:>10.0f}{base['p95'] * 1000:>10.0f}{1:>8.2f}")
+    for size in (int(x) for x in args.batch_sizes.split(",") if x.strip()):
+        batched = BatchedEngine(engine, size, args.wait_ms, runners=args.workers)
+        r = run(batched, clips, args.clients, args.requests)
+        mean_batch = batched.stats()["mean_batch"]
+        batched.close()
+        print(f"{f'batch={size}':<14}{r['throughput']:>12.2f}{r['p50'] * 1000:>10.0f}{r['p95'] * 1000:>10.0f}"
+              f"{mean_batch:>8.2f}   吞吐 ×{r['throughput'] / base['throughput']:.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# bench/json_parse.py
+"""
+对比 LLM 输出解析方案的恢复率与耗时：
+
+- legacy：json.loads -> ast.literal_eval -> {}（llm_app 原来的做法）
+- slice：json.loads -> find("{")/rfind("}") 切片再 json.loads（CoT 客户端原来的做法）
+- tolerant：backend/json_repair.loads_object（一遍容错扫描）
+
+语料为 JSONL，每行 {"name", "raw", "expect"}：expect 是解析结果里必须相等的字段子集，
+null 表示这条本来就不含 JSON（解析失败才算对）。自带的 bench/data/llm_bad_outputs.jsonl 是手写的 28 条典型失败，
+不是线上抓的；要看真实分布请把线上抓到的坏输出追加进去。
+
+用法（仓库根目录）：python -m bench.json_parse [语料.jsonl ...] [--repeat 200]
+"""
+from __future__ import annotations
+import ast
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.json_repair import JSONRepairError, loads_object
+
+DEFAULT_CORPUS = Path(__file__).parent / "data" / "llm_bad_outputs.jsonl"
+
+
+def parse_legacy(text: str) -> Dict[str, Any]:
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        try:
+            data = ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            data = {}
+    return data if isinstance(data, dict) else {}
+
+
+def parse_slice(text: str) -> Dict[str, Any]:
+    try:
+        return json.loads(text)
+    except Exception:
+        s, e = text.find("{"), text.rfind("}")
+        try:
+            data = json.loads(text[s:e + 1])
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+
+def parse_tolerant(text: str) -> Dict[str, Any]:
+    try:
+        return loads_object(text)[0]
+    except JSONRepairError:
+        return {}
+
+
+PARSERS: Dict[str, Callable[[str], Dict[str, Any]]] = {
+    "legacy": parse_legacy,
+    "slice": parse_slice,
+    "tolerant": parse_tolerant,
+}
+
+
+def recovered(result: Dict[str, Any], expect: Optional[Dict[str, Any]]) -> bool:
+    if expect is None:
+        return not result
+    return all(k in result and result[k] == v for k, v in expect.items())
+
+
+def load_corpus(paths: List[Path]) -> List[Dict[str, Any]]:
+    rows = []
+    for p in paths:
+        with open(p, encoding="utf-8") as f:
+            rows.extend(json.loads(line) for line in f if line.strip())
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("corpus", nargs="*", type=Path, default=[DEFAULT_CORPUS])
+    ap.add_argument("--repeat", type=int, default=200, help="每条样本重复解析次数（计时用）")
+    ap.add_argument("-v", "--verbose", action="store_true", help="列出每个方案没救回来的样本")
+    args = ap.parse_args(argv)
+
+    rows = load_corpus(args.corpus)
+    print(f"语料 {len(rows)} 条，每条重复 {args.repeat} 次\n")
+    results: Dict[str, List[bool]] = {}
+    timings: Dict[str, List[float]] = {}
+    for name, fn in PARSERS.items():
+        results[name], timings[name] = [], []
+        for row in rows:
+            t0 = time.perf_counter()
+            for _ in range(args.repeat):
+                try:
+                    result = fn(row["raw"])
+                except Exception:
+                    result = {}
+            timings[name].append((time.perf_counter() - t0) / args.repeat * 1e6)
+            results[name].append(recovered(result, row["expect"]))
+
+    # 同样本对比：只看 legacy 本来就能解析的那些，速度才可比
+    common = [i for i, ok in enumerate(results["legacy"]) if ok]
+    print(f"{'方案':<10}{'恢复':>8}{'恢复率':>9}{'单次(µs)':>11}{'legacy可解样本(µs)':>20}")
+    for name in PARSERS:
+        ok = sum(results[name])
+        mean = sum(timings[name]) / len(rows)
+        same = sum(timings[name][i] for i in common) / len(common) if common else 0.0
+        print(f"{name:<10}{ok:>5}/{len(rows):<3}{ok / len(rows):>8.1%}{mean:>11.1f}{same:>20.1f}")
+        missed = [row["name"] for row, good in zip(rows, results[name]) if not good]
+        if args.verbose and missed:
+            print(f"{'':<10}未恢复：{', '.join(missed)}")
+
+if __name__ == "__main__":
+    sys.exit(main())
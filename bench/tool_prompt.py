@@ -0,0 +1,119 @@
+# bench/tool_prompt.py
+"""
+对比每轮带全部工具说明与只带 BM25 选出的 top-k 工具说明：
+
+- 提示 token（backend/history.approx_tokens 估算，system prompt + 工具说明 + 用户这句话）；
+- 选择是否覆盖了该用的工具（语料 expect；null 表示闲聊，不计覆盖率）；
+- 选择本身的耗时（首次 / 命中缓存）；
+- 给了 --endpoint 时，向 /llm 各发一轮实测端到端延迟：before 把全部工具说明直接写进 system prompt
+  （后端对没有占位符的 system prompt 原样转发），after 用带 {{tools}} 占位符的 SYSTEM_PROMPT。
+
+用法（仓库根目录）：python -m bench.tool_prompt [语料.jsonl] [--endpoint http://127.0.0.1:8001/llm]
+"""
+from __future__ import annotations
+import sys
+import json
+import time
+import uuid
+import argparse
+import statistics
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from backend.history import approx_tokens
+from backend.prompt import SYSTEM_PROMPT, TOOLS_PLACEHOLDER
+from backend.tool_registry import ToolRegistry, expand_tools
+
+DEFAULT_CORPUS = Path(__file__).parent / "data" / "tool_utterances.jsonl"
+
+
+def load_corpus(path: Path) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(approx_tokens(m["content"]) + 4 for m in messages)
+
+
+def messages_before(reg: ToolRegistry, text: str) -> List[Dict[str, str]]:
+    return [{"role": "system", "content": SYSTEM_PROMPT.replace(TOOLS_PLACEHOLDER, reg.full_section)},
+            {"role": "user", "content": text}]
+
+
+def messages_after(reg: ToolRegistry, text: str, context: str = "") -> List[Dict[str, str]]:
+    base = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": text}]
+    return expand_tools(base, reg.section_for(reg.select(text, context)))
+
+
+def measure_latency(endpoint: str, messages: List[Dict[str, str]]) -> Optional[float]:
+    import requests
+    payload = {"messages": messages, "session_id": str(uuid.uuid4()), "max_tokens": 256,
+               "fastpath": False, "response_cache": False}
+    t0 = time.perf_counter()
+    try:
+        r = requests.post(endpoint, json=payload, timeout=120)
+        r.raise_for_status()
+    except Exception as e:
+        print(f"  请求失败：{type(e).__name__}: {e}")
+        return None
+    return (time.perf_counter() - t0) * 1000
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("corpus", nargs="?", type=Path, default=DEFAULT_CORPUS)
+    ap.add_argument("--endpoint", help="后端 /llm 地址；不给则只统计提示 token")
+    args = ap.parse_args(argv)
+
+    from function_call.function_call_register import function_map
+    reg = ToolRegistry(function_map)
+    rows = load_corpus(args.corpus)
+
+    before, after, selected, covered, labelled = [], [], [], 0, 0
+    t0 = time.perf_counter()
+    for row in rows:
+        reg.select(row["text"], row.get("context", ""))
+    cold_us = (time.perf_counter() - t0) / len(rows) * 1e6
+    t0 = time.perf_counter()
+    for row in rows:
+        reg.select(row["text"], row.get("context", ""))
+    warm_us = (time.perf_counter() - t0) / len(rows) * 1e6
+
+    print(f"语料 {len(rows)} 条，工具 {len(reg.specs)} 个\n")
+    print(f"{'before':>8}{'after':>7}{'工具数':>6}  话语 -> 选中的工具")
+    for row in rows:
+        names = reg.select(row["text"], row.get("context", ""))
+        b = prompt_tokens(messages_before(reg, row["text"]))
+        a = prompt_tokens(messages_after(reg, row["text"], row.get("context", "")))
+        before.append(b)
+        after.append(a)
+        selected.append(len(names))
+        if row.get("expect"):
+            labelled += 1
+            covered += row["expect"] in names
+        mark = "" if not row.get("expect") or row["expect"] in names else "  ✗ 缺 " + row["expect"]
+        print(f"{b:>8}{a:>7}{len(names):>6}  {row['text'][:24]} -> {', '.join(names)}{mark}")
+
+    mean_b, mean_a = statistics.mean(before), statistics.mean(after)
+    print(f"\n平均提示 token：before {mean_b:.0f}，after {mean_a:.0f}（减少 {1 - mean_a / mean_b:.1%}）")
+    print(f"平均选中工具 {statistics.mean(selected):.2f} 个；应选工具覆盖 {covered}/{labelled}")
+    print(f"选择耗时：首次 {cold_us:.1f}µs / 条，命中缓存 {warm_us:.1f}µs / 条")
+
+    if not args.endpoint:
+        return
+    print(f"\n端到端延迟（{args.endpoint}）：")
+    lat: Dict[str, List[float]] = {"before": [], "after": []}
+    for row in rows:
+        for name, msgs in (("before", messages_before(reg, row["text"])),
+                           ("after", messages_after(reg, row["text"], row.get("context", "")))):
+            ms = measure_latency(args.endpoint, msgs)
+            if ms is not None:
+                lat[name].append(ms)
+    for name, xs in lat.items():
+        if xs:
+            print(f"  {name:<7} n={len(xs):<3} p50 {statistics.median(xs):7.0f}ms  mean {statistics.mean(xs):7.0f}ms")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
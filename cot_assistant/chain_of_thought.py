@@ -1,5 +1,5 @@
 from __future__ import annotations
-import json, time
+import time
 from typing import Optional, Dict, Any, Tuple
 
 from schemas import Action, Selector
@@ -7,6 +7,7 @@ from cot_prompt import build_cot_prompt
 from vision import Screen
 from ocr import OCR
 from manipulate.manipulate_mouse import MouseManipulator, MouseConfig
+from backend.json_repair import loads_object
 
 # 你已有的 LLM 客户端：请封装一个 predict_json(messages or prompt)->dict
 class CoTLLMClient:
@@ -24,17 +25,17 @@ class CoTLLMClient:
                 {"role": "user", "content": prompt}
             ],
             "temperature": 0.2,
+            "priority": "background",  # 后端调度时让位于语音对话
+            "response_schema": "cot_step",  # 后端按 schemas.Action 约束输出，原样返回 JSON 文本
         }
         r = httpx.post(self.endpoint, json=payload, timeout=60)
         r.raise_for_status()
-        content = r.json()["choices"][0]["message"]["content"]
-        # 尝试解析 JSON（防御）
-        try:
-            return json.loads(content)
-        except Exception:
-            # 简单提取 {...} 片段
-            s = content.find("{"); e = content.rfind("}")
-            return json.loads(content[s:e+1])
+        body = r.json()
+        # 本项目的 /llm 返回 {"text": ...}；直接接 OpenAI 兼容接口时是 choices[0].message.content
+        content = body["text"] if "text" in body else body["choices"][0]["message"]["content"]
+        # 容错解析：代码块、前后废话、尾逗号、单引号、截断等（与后端共用）
+        data, _ = loads_object(content)
+        return data
 
 class CoTAssistant:
     def __init__(self, goal: str,
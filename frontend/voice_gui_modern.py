@@ -12,7 +12,7 @@ from tkinter import ttk, filedialog, messagebox
 from functools import partial
 
 # —— 你现有的语音/LLM 模块（名字不同请按你的项目调整导入路径）——
-from backend.voice_interact import LLMClient, ASR, TTS, SYSTEM_PROMPT, LLM_ENDPOINT, LLM_MODEL
+from backend.voice_interact import LLMClient, ASR, TTS, SYSTEM_PROMPT, LLM_ENDPOINT, LLM_MODEL, USE_STREAM
 # imports 顶部附近
 import urllib.request, urllib.error  # 新增：轻量 HTTP 客户端（免第三方依赖）
 
@@ -77,8 +77,9 @@ class ModernVoiceChat(tk.Tk):
         # ===== Core =====
         self.llm = LLMClient(LLM_ENDPOINT, LLM_MODEL)
         self.llm.add_system(SYSTEM_PROMPT)
-        self.asr = ASR()
         self.tts = TTS()
+        # 播报期间常驻麦克风不做端点检测，免得把自己的声音识别进去
+        self.asr = ASR(muted=lambda: self.tts.speaking)
 
         self.tts_enabled = tk.BooleanVar(value=True)
         self.listening = tk.BooleanVar(value=False)
@@ -433,6 +434,7 @@ class ModernVoiceChat(tk.Tk):
         self._ui(self.toolbar_status.configure, text=msg)
 
     def on_clear(self):
+        self.tts.cancel()
         for w in list(self.inner.children.values()):
             w.destroy()
         self.history.clear()
@@ -473,6 +475,8 @@ class ModernVoiceChat(tk.Tk):
         threading.Thread(target=self._llm_reply, args=(text,), daemon=True).start()
 
     def on_speak_toggle(self):
+        # 开口前先打断还在播的回复（barge-in），也免得麦克风录进播报声
+        self.tts.cancel()
         if self.listening.get():
             self.listening.set(False)
             self._set_status("Stopped.", "idle")
@@ -507,13 +511,12 @@ class ModernVoiceChat(tk.Tk):
         try:
             self._set_status("Thinking…", "thinking")
             self.llm.add_user(user_text)
-            reply = self.llm.chat(temperature=0.6, max_tokens=512)
+            # TTS 交给播报线程（只是按句入队，不阻塞；不能放进 UI 队列在 Tk 主线程里 runAndWait）
+            reply = self._fetch_reply(speak=self.tts_enabled.get())
             self.llm.add_assistant(reply)
 
-            # UI & TTS 在主线程队列执行
+            # UI 在主线程队列执行
             self._append_assistant(reply)
-            if self.tts_enabled.get():
-                self._ui(self.tts.say, reply)
             self._set_status("Ready", "idle")
 
         except Exception as e:
@@ -521,6 +524,26 @@ class ModernVoiceChat(tk.Tk):
             self._append_assistant(error_msg, msg_type="error")
             self._set_status("Error", mode="error")
 
+    def _fetch_reply(self, speak: bool) -> str:
+        """
+        取回复；流式时边收边把增量喂给播报线程（凑满一句就开播，不等整段回复）。
+        中途被打断（开口说话 / 清空）后不再喂这段回复的剩余部分
+        """
+        if not USE_STREAM:
+            reply = self.llm.chat(temperature=0.6, max_tokens=512)
+            if speak:
+                self.tts.say(reply)
+            return reply
+        gen = self.tts.generation
+        parts = []
+        for delta in self.llm.chat_stream(temperature=0.6, max_tokens=512):
+            parts.append(delta)
+            if speak and self.tts.generation == gen:
+                self.tts.feed(delta)
+        if speak and self.tts.generation == gen:
+            self.tts.flush()
+        return "".join(parts).strip()
+
     def _once_asr_round(self):
         try:
             user_text = self.asr.listen_once()
@@ -1,3 +1,4 @@
 
 def call_cot_assistant(*args):
+    """把需要多步电脑操作的复杂任务交给思维链助手执行。"""
     pass
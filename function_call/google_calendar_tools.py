@@ -72,7 +72,12 @@ def create_calendar_event(summary: str, start_time_iso: str, end_time_iso: str,
         return f"创建日历事件时发生未知错误: {e}"
 
 def list_upcoming_events(max_results: int = 5) -> str:
-    """列出 Google Calendar 中即将发生的事件。"""
+    """
+    列出 Google Calendar 中即将发生的事件。
+
+    Args:
+        max_results (int, optional): 最多返回几条，默认 5。
+    """
     try:
         service = _get_calendar_service()
         now = dt.datetime.utcnow().isoformat() + 'Z'
@@ -2,6 +2,7 @@ from manipulate.manipulate_app import *
 from manipulate.manipulate_keyboard import qqmusic_hotkey_play_pause_v2
 from manipulate.manipulate_mouse import *
 def play_music(*args):
+    """切换 QQ 音乐的播放/暂停（未打开时先从桌面启动）。"""
     # QQ音乐
     app_path = find_on_desktop("QQ音乐")
     if app_path:
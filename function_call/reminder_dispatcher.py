@@ -13,7 +13,15 @@ def set_reminder(
     description: Optional[str] = ""
 ) -> str:
     """
+    创建日程提醒，可指定提醒平台。
+
     总调度器：使用 dateparser 解析自然语言时间，并设置提醒。
+
+    Args:
+        summary (str): 事件标题。
+        time_expression (str): 用户原话里与时间相关的短语，原样传入，不要换算。
+        platforms (List[str]): 提醒平台：google / windows / both。
+        description (str, optional): 事件描述，默认同标题。
     """
     # 3. 使用 dateparser 将“明天下午3点”这样的短语翻译成精确的时间
     #    'PREFER_DATES_FROM': 'future' 能确保 "10:30" 被理解为未来的时间
@@ -56,6 +56,12 @@ def _save_as_txt(full_path_txt: str, content: str) -> str:
 
 def write_article_in_word(file_name: str, content: str) -> str:
     """
+    写一篇文章并保存到桌面的 Word 文档。
+
+    Args:
+        file_name (str): 文件名（不含扩展名也可以）。
+        content (str): 文章完整正文。
+
     优先顺序：
     1) pywin32 调 Word 真写入（需安装 Office + pywin32）
     2) python-docx 直接生成 docx（无需 Office）
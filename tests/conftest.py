@@ -0,0 +1,6 @@
+# tests/conftest.py
+# 从仓库根目录导入 backend.*（仓库没有安装成包）
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
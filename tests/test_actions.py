@@ -0,0 +1,90 @@
+# tests/test_actions.py
+import asyncio
+
+from backend.actions import ACTIONS_MAX, action_list, observation_block, plan, run_plan
+
+
+def test_action_list_normalizes_object_list_and_empty():
+    assert action_list({"name": "a"}) == [{"name": "a"}]
+    assert action_list([{"name": "a"}, {}, "x", None, {"name": "b"}]) == [{"name": "a"}, {"name": "b"}]
+    assert action_list(None) == action_list({}) == action_list("play") == []
+
+
+def test_plan_assigns_ids_and_keeps_only_backward_dependencies():
+    steps = plan([
+        {"name": "a", "args": {"x": 1}},
+        {"id": "b", "name": "b", "after": ["1", "c", "missing"]},
+        {"id": "c", "name": "c", "after": "b"},
+        {"id": "b", "name": "dup"},
+    ])
+    assert [s.id for s in steps] == ["1", "b", "c", "4"]
+    assert steps[0].args == {"x": 1}
+    assert steps[1].after == ["1"]          # 指向后面的 c 和不存在的 id 都忽略
+    assert steps[2].after == ["b"]          # 单个字符串也认
+    assert steps[3].name == "dup"           # 重复的 id 改用序号
+
+
+def test_plan_keeps_ids_unique_when_fallback_index_is_taken():
+    steps = plan([{"id": "2", "name": "a"}, {"id": "2", "name": "b"}, {"id": "2", "name": "c"}])
+    assert [s.id for s in steps] == ["2", "2#2", "3"]
+
+
+def test_plan_caps_number_of_actions():
+    assert len(plan([{"name": str(i)} for i in range(ACTIONS_MAX + 3)])) == ACTIONS_MAX
+
+
+def _runner(log, fail=(), delay=0.05):
+    async def run(action):
+        log.append(("start", action["name"]))
+        await asyncio.sleep(delay)
+        log.append(("end", action["name"]))
+        ok = action["name"] not in fail
+        return {"name": action["name"], "ok": ok, "result": action["args"] if ok else None,
+                "error": None if ok else "boom", "timed_out": False, "elapsed_ms": delay * 1000}
+    return run
+
+
+def test_run_plan_runs_independent_actions_concurrently_in_order():
+    log = []
+    steps = plan([{"name": "a"}, {"name": "b"}, {"name": "c"}])
+    results = asyncio.run(run_plan(steps, _runner(log)))
+    assert [r["id"] for r in results] == ["1", "2", "3"]
+    assert [r["name"] for r in results] == ["a", "b", "c"]
+    # 三个都在任何一个结束之前启动
+    assert [e for e, _ in log[:3]] == ["start"] * 3
+
+
+def test_run_plan_waits_for_dependencies_and_skips_after_failure():
+    log = []
+    steps = plan([
+        {"id": "s", "name": "search"},
+        {"id": "o", "name": "open", "after": ["s"]},
+        {"id": "m", "name": "mail"},
+        {"id": "r", "name": "remind", "after": ["m"]},
+    ])
+    results = asyncio.run(run_plan(steps, _runner(log, fail={"mail"})))
+    assert log.index(("end", "search")) < log.index(("start", "open"))
+    by_id = {r["id"]: r for r in results}
+    assert by_id["o"]["ok"]
+    assert not by_id["m"]["ok"]
+    assert by_id["r"]["skipped"] and not by_id["r"]["ok"]
+    assert ("start", "remind") not in log
+
+
+def test_run_plan_returns_one_result_per_step_for_duplicate_ids():
+    log = []
+    steps = plan([{"id": "2", "name": "a"}, {"id": "2", "name": "b"}])
+    results = asyncio.run(run_plan(steps, _runner(log)))
+    assert [(r["id"], r["name"]) for r in results] == [("2", "a"), ("2#2", "b")]
+
+
+def test_observation_block_summarizes_each_result():
+    results = [
+        {"id": "1", "name": "a", "ok": True, "result": {"k": "v"}},
+        {"id": "2", "name": "b", "ok": False, "error": "boom"},
+        {"id": "3", "name": "c", "ok": False, "skipped": True, "error": "依赖的动作 2 未成功"},
+    ]
+    text = observation_block(results, 1200)
+    assert text.startswith("共 3 个动作（1 个成功）")
+    assert "[1] a 成功" in text and "[2] b 失败：boom" in text and "[3] c 跳过" in text
+    assert observation_block([], 100) == ""
@@ -0,0 +1,51 @@
+# tests/test_json_repair.py
+import pytest
+
+from backend.json_repair import JSONRepairError, loads_object, tolerant_loads
+
+
+def test_valid_json_is_not_marked_repaired():
+    assert loads_object('{"a": 1, "b": [1, 2]}') == ({"a": 1, "b": [1, 2]}, False)
+
+
+@pytest.mark.parametrize("raw, expect", [
+    ('```json\n{"answer": "hi"}\n```', {"answer": "hi"}),
+    ('好的，下面是结果：{"answer": "hi"} 希望有帮助', {"answer": "hi"}),
+    ('{"a": 1, "b": 2,}', {"a": 1, "b": 2}),
+    ("{'a': 'x', 'b': None, 'c': True}", {"a": "x", "b": None, "c": True}),
+    ('{answer: "hi", action: null}', {"answer": "hi", "action": None}),
+    ('{"answer": "第一行\n第二行"}', {"answer": "第一行\n第二行"}),
+    ('{"answer": "他说"你好"然后走了"}', {"answer": '他说"你好"然后走了'}),
+    ('{"a": 1, // 留空\n "b": /* 注释 */ 2}', {"a": 1, "b": 2}),
+])
+def test_repairs_common_llm_mistakes(raw, expect):
+    data, repaired = loads_object(raw)
+    assert data == expect
+    assert repaired
+
+
+def test_truncated_output_is_closed_and_partial_key_dropped():
+    data, repaired = loads_object('{"thought": "想一想", "action": {"name": "play_music", "args": {}}, "answer": "好的，马')
+    assert repaired
+    assert data["action"] == {"name": "play_music", "args": {}}
+    assert data["answer"] == "好的，马"
+    data, _ = loads_object('{"thought": "x", "ans')
+    assert data == {"thought": "x"}
+
+
+@pytest.mark.parametrize("raw", ["", "没有 JSON", "[1, 2, 3]"])
+def test_no_object_raises(raw):
+    with pytest.raises(JSONRepairError):
+        loads_object(raw)
+
+
+@pytest.mark.parametrize("raw", ['{"a":' + "[" * 100000, "[" * 100000, '{"a": {' * 5000])
+def test_too_deep_raises_repair_error_not_recursion_error(raw):
+    with pytest.raises(JSONRepairError):
+        loads_object(raw)
+    with pytest.raises(JSONRepairError):
+        tolerant_loads(raw)
+
+
+def test_tolerant_loads_accepts_arrays():
+    assert tolerant_loads("[1, 2,]") == ([1, 2], True)
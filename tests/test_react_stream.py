@@ -0,0 +1,86 @@
+# tests/test_react_stream.py
+import json
+
+from backend.react_stream import ReActStreamParser
+
+REPLY = {"thought": "用户想听歌", "action": {"name": "play_music", "args": {}}, "observation": "", "answer": "好的，马上播放。"}
+
+
+def _feed_all(parser, text, step):
+    events = []
+    for i in range(0, len(text), step):
+        events.extend(parser.feed(text[i:i + step]))
+    return events
+
+
+def _joined(events, kind):
+    return "".join(p for k, p in events if k == kind)
+
+
+def test_streams_fields_and_action_at_any_chunk_size():
+    text = json.dumps(REPLY, ensure_ascii=False)
+    for step in (1, 2, 3, 7, len(text)):
+        p = ReActStreamParser()
+        events = _feed_all(p, text, step)
+        assert _joined(events, "thought") == REPLY["thought"]
+        assert _joined(events, "answer") == REPLY["answer"]
+        assert [v for k, v in events if k == "action"] == [REPLY["action"]]
+        assert p.done
+        assert p.fields == REPLY
+
+
+def test_action_is_emitted_before_answer_starts():
+    p = ReActStreamParser()
+    events = p.feed(json.dumps(REPLY, ensure_ascii=False))
+    kinds = [k for k, _ in events]
+    assert kinds.index("action") < kinds.index("answer")
+
+
+def test_null_action_is_emitted_as_none():
+    p = ReActStreamParser()
+    events = p.feed('{"thought": "", "action": null, "answer": "你好"}')
+    assert ("action", None) in events
+    assert p.action_emitted
+    assert p.fields["action"] is None
+
+
+def test_later_non_empty_action_supersedes_null():
+    p = ReActStreamParser()
+    events = p.feed('{"action": null, "answer": "hi", "action": {"name": "a", "args": {}}}')
+    assert [v for k, v in events if k == "action"] == [None, {"name": "a", "args": {}}]
+    assert p.fields["action"] == {"name": "a", "args": {}}
+
+
+def test_action_list_and_nested_strings_with_braces():
+    action = [{"id": "1", "name": "search", "args": {"q": "a}b{\"c"}}, {"id": "2", "name": "open", "args": {}, "after": ["1"]}]
+    text = json.dumps({"thought": "", "action": action, "answer": "ok"}, ensure_ascii=False)
+    p = ReActStreamParser()
+    events = _feed_all(p, text, 1)
+    assert [v for k, v in events if k == "action"] == [action]
+
+
+def test_escapes_and_unicode_split_across_chunks():
+    p = ReActStreamParser()
+    events = _feed_all(p, '{"answer": "第一行\\n\\u4f60\\"好\\""}', 1)
+    assert _joined(events, "answer") == '第一行\n你"好"'
+
+
+def test_stream_fields_can_be_disabled():
+    p = ReActStreamParser(stream_fields=())
+    events = p.feed(json.dumps(REPLY, ensure_ascii=False))
+    assert [k for k, _ in events] == ["action"]
+    assert p.fields["answer"] == REPLY["answer"]
+
+
+def test_ignores_preamble_and_trailing_output():
+    p = ReActStreamParser()
+    events = p.feed('```json\n{"answer": "hi", "action": null}\n```\n{"answer": "again"}')
+    assert _joined(events, "answer") == "hi"
+    assert p.done
+
+
+def test_truncated_output_is_not_done():
+    p = ReActStreamParser()
+    p.feed('{"thought": "x", "answer": "半')
+    assert not p.done
+    assert not p.action_emitted
@@ -0,0 +1,96 @@
+# tests/test_scheduler.py
+import asyncio
+
+import pytest
+
+from backend.scheduler import AdmissionScheduler, QueueFull
+
+
+async def _queued(sched, session, priority=None):
+    """排进队列并让出一次，保证入队顺序就是调用顺序"""
+    task = asyncio.create_task(sched.acquire(session, priority))
+    await asyncio.sleep(0)
+    return task
+
+
+def test_admits_up_to_slots_then_queues():
+    async def main():
+        sched = AdmissionScheduler(2)
+        await sched.acquire("a")
+        await sched.acquire("b")
+        assert sched.active == 2
+        waiter = await _queued(sched, "c")
+        assert not waiter.done() and sched.stats()["queued"] == 1
+        sched.release(0.1)
+        await waiter
+        assert sched.active == 2 and sched.stats()["queued"] == 0
+    asyncio.run(main())
+
+
+def test_interactive_before_background_and_round_robin_by_session():
+    async def main():
+        sched = AdmissionScheduler(1)
+        await sched.acquire("hold")
+        order = []
+
+        async def want(session, priority):
+            await sched.acquire(session, priority)
+            order.append((session, priority))
+
+        tasks = []
+        for session, priority in [("bg", "background"), ("s1", None), ("s1", None), ("s2", None)]:
+            tasks.append(asyncio.create_task(want(session, priority)))
+            await asyncio.sleep(0)
+        for _ in tasks:
+            sched.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        # interactive 先于 background；s1 连发两条时 s2 插在中间
+        assert order == [("s1", None), ("s2", None), ("s1", None), ("bg", "background")]
+    asyncio.run(main())
+
+
+def test_background_is_promoted_after_aging():
+    async def main():
+        sched = AdmissionScheduler(1, aging=0.0)
+        await sched.acquire("hold")
+        bg = await _queued(sched, "bg", "background")
+        fg = await _queued(sched, "fg", "interactive")
+        await asyncio.sleep(0.01)
+        sched.release()
+        await asyncio.sleep(0)
+        assert bg.done() and not fg.done()
+        assert sched.promoted == 1
+        sched.release()
+        await fg
+    asyncio.run(main())
+
+
+def test_queue_full_raises_with_retry_after():
+    async def main():
+        sched = AdmissionScheduler(1, max_queue=1)
+        await sched.acquire("a")
+        waiter = await _queued(sched, "b")
+        with pytest.raises(QueueFull) as e:
+            await sched.acquire("c")
+        assert e.value.retry_after >= 1
+        assert sched.rejected == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_queue_and_slot_is_not_leaked():
+    async def main():
+        sched = AdmissionScheduler(1)
+        await sched.acquire("a")
+        waiter = await _queued(sched, "b")
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert sched.stats()["queued"] == 0
+        sched.release()
+        assert sched.active == 0
+        async with sched.slot("c"):
+            assert sched.active == 1
+        assert sched.active == 0
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+# tests/test_upstreams.py
+import pytest
+
+from backend import upstreams
+from backend.upstreams import BREAKER_COOLDOWN, BREAKER_FAILURES, NoUpstreamAvailable, Upstream, UpstreamPool
+
+
+def _fail(up, n=1):
+    for _ in range(n):
+        up.record_failure(RuntimeError("boom"))
+
+
+def test_breaker_opens_after_consecutive_failures():
+    up = Upstream("a", "http://a", "m")
+    _fail(up, BREAKER_FAILURES - 1)
+    assert up.state == "closed" and up.available(0.0)
+    _fail(up)
+    assert up.state == "open"
+    assert not up.available(up.opened_at + BREAKER_COOLDOWN / 2)
+
+
+def test_success_resets_failure_count():
+    up = Upstream("a", "http://a", "m")
+    _fail(up, BREAKER_FAILURES - 1)
+    up.record_success(100)
+    _fail(up, BREAKER_FAILURES - 1)
+    assert up.state == "closed"
+
+
+def test_half_open_admits_one_trial_and_closes_on_success():
+    pool = UpstreamPool([Upstream("a", "http://a", "m")])
+    up = pool.upstreams[0]
+    _fail(up, BREAKER_FAILURES)
+    later = up.opened_at + BREAKER_COOLDOWN + 0.1
+    assert up.available(later) and up.state == "half_open"
+    with pool.track(up):
+        assert not up.available(later)          # 试探请求在途时不放行第二个
+        up.record_success(100)
+    assert up.state == "closed" and up.available(later)
+
+
+def test_half_open_failure_reopens():
+    up = Upstream("a", "http://a", "m")
+    _fail(up, BREAKER_FAILURES)
+    up.available(up.opened_at + BREAKER_COOLDOWN + 0.1)
+    assert up.state == "half_open"
+    _fail(up)
+    assert up.state == "open"
+
+
+def test_separate_ttfb_and_total_latency():
+    up = Upstream("a", "http://a", "m")
+    ttfb, total = up.ttfb_ms, up.total_ms
+    up.record_success(10000, kind="total")
+    assert up.ttfb_ms == ttfb and up.total_ms > total
+    up.record_success(10, kind="ttfb")
+    assert up.ttfb_ms < ttfb
+
+
+def test_pick_scores_by_kind_and_skips_open_breakers():
+    fast_stream = Upstream("s", "http://s", "m", ttfb_ms=100, total_ms=9000)
+    fast_unary = Upstream("u", "http://u", "m", ttfb_ms=900, total_ms=1000)
+    pool = UpstreamPool([fast_stream, fast_unary])
+    assert pool.pick().name == "s"
+    assert pool.pick(kind="total").name == "u"
+    _fail(fast_stream, BREAKER_FAILURES)
+    assert pool.pick().name == "u"
+    with pytest.raises(NoUpstreamAvailable):
+        pool.pick(exclude={"s", "u"})
+
+
+def test_hedge_delay_uses_matching_latency(monkeypatch):
+    monkeypatch.setattr(upstreams, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(upstreams, "HEDGE_AFTER_MS", 0.0)
+    a = Upstream("a", "http://a", "m", ttfb_ms=400, total_ms=6000)
+    pool = UpstreamPool([a, Upstream("b", "http://b", "m")])
+    assert pool.hedge_delay(a) == pytest.approx(0.8)
+    assert pool.hedge_delay(a, kind="total") == pytest.approx(12.0)
+    assert UpstreamPool([a]).hedge_delay(a) is None